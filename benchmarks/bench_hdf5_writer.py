@@ -0,0 +1,57 @@
+"""
+Benchmark daily updates of an HDF5 store with HDF5BatchWriter against opening the store and putting the whole
+history of each symbol.
+
+Run from the repository root: python -m benchmarks.bench_hdf5_writer
+"""
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from tools.hdf5_helper import HDF5BatchWriter, repack
+
+
+def make_prices(number_of_dates, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, number_of_dates)))
+    return pd.DataFrame({
+        'open': close * (1 + rng.normal(0, 0.005, number_of_dates)),
+        'high': close * (1 + np.abs(rng.normal(0, 0.01, number_of_dates))),
+        'low': close * (1 - np.abs(rng.normal(0, 0.01, number_of_dates))),
+        'close': close.round(2),
+        'volume': rng.integers(10 ** 5, 10 ** 7, number_of_dates).astype(float),
+    }, index=pd.bdate_range(end='2023-12-29', periods=number_of_dates, name='date'))
+
+
+def put_per_symbol(path, df_dict):
+    for symbol, df in df_dict.items():
+        with pd.HDFStore(path, mode='a') as store:
+            store.put(f'prices/{symbol}', df, format='table', data_columns=True)
+
+
+def batch_writer(path, df_dict, **kwargs):
+    with HDF5BatchWriter(path, verbose=False, **kwargs) as writer:
+        for symbol, df in df_dict.items():
+            writer.write(f'prices/{symbol}', df)
+
+
+if __name__ == '__main__':
+    number_of_symbols, number_of_dates, number_of_days = 50, 5000, 10
+    prices = {f'S{i}': make_prices(number_of_dates, seed=i) for i in range(number_of_symbols)}
+    first_day = number_of_dates - number_of_days
+    with tempfile.TemporaryDirectory() as directory:
+        for name, write in [('put per symbol', put_per_symbol),
+                            ('HDF5BatchWriter uncompressed', lambda path, df_dict: batch_writer(path, df_dict,
+                                                                                                complevel=0)),
+                            ('HDF5BatchWriter blosc:zstd', batch_writer)]:
+            path = os.path.join(directory, f'{name.replace(" ", "_")}.h5')
+            write(path, {symbol: df.iloc[:first_day] for symbol, df in prices.items()})
+            start = time.perf_counter()
+            for day in range(first_day + 1, number_of_dates + 1):
+                write(path, {symbol: df.iloc[:day] for symbol, df in prices.items()})
+            seconds = (time.perf_counter() - start) / number_of_days
+            print(f'{name:30s}: {seconds:6.3f} s per daily update of {number_of_symbols} symbols, '
+                  f'{os.path.getsize(path) / 1e6:5.1f} MB')
+        repack(path)
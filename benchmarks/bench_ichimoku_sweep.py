@@ -0,0 +1,38 @@
+"""
+Benchmark calculate_ichimoku_sweep against one calculate_ichimoku call per period combination.
+
+Run from the repository root: python -m benchmarks.bench_ichimoku_sweep
+"""
+import itertools
+import timeit
+import numpy as np
+import pandas as pd
+
+from tools.pattern_helper import calculate_ichimoku, calculate_ichimoku_sweep
+
+period_grid = list(itertools.product([5, 7, 9, 12, 15], [20, 26, 30, 40], [44, 52, 60, 78, 104]))
+
+
+def per_combination(df):
+    for conversion_period, base_period, span_b_period in period_grid:
+        calculate_ichimoku(df.copy(), conversion_period=conversion_period, base_period=base_period,
+                           span_b_period=span_b_period)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    for years in [5, 20]:
+        index = pd.bdate_range(end='2023-12-29', periods=252 * years)
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(index))))
+        df = pd.DataFrame({
+            'high': close * (1 + np.abs(rng.normal(0, 0.01, len(index)))),
+            'low': close * (1 - np.abs(rng.normal(0, 0.01, len(index)))),
+            'close': close,
+        }, index=index)
+        repeat = 5
+        single_time = min(timeit.repeat(lambda: calculate_ichimoku(df.copy()), number=1, repeat=repeat))
+        loop_time = min(timeit.repeat(lambda: per_combination(df), number=1, repeat=repeat))
+        sweep_time = min(timeit.repeat(lambda: calculate_ichimoku_sweep(df, period_grid), number=1, repeat=repeat))
+        print(f'{len(index):6d} bars, {len(period_grid)} combinations: single run {single_time * 1000:7.2f} ms, '
+              f'per combination {loop_time * 1000:8.2f} ms, sweep {sweep_time * 1000:7.2f} ms, '
+              f'speedup {loop_time / sweep_time:5.1f}x')
@@ -0,0 +1,138 @@
+"""
+Benchmark ingest rate and single-ticker range queries of the flat intraday table against the table partitioned by
+month, with and without partitions by ticker hash.
+
+Needs a Postgres database (POSTGRES_DB, default is stock, POSTGRES_USER and POSTGRES_PASSWORD). The benchmark
+creates its tickers and tables in the scratch schemas bench_intraday and bench_intraday_archive and drops them
+afterwards, the tables of the database are not touched.
+Run from the repository root: python -m benchmarks.bench_intraday_partitions
+"""
+import os
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from tools.database_helper import archive_partitions, bulk_upsert, create_month_partitions, \
+    create_stock_database_tables, is_partitioned
+from tools.get_ticker_data import create_intraday_table
+
+number_of_tickers = 100
+scratch_schema = 'bench_intraday'
+archive_schema = f'{scratch_schema}_archive'
+months = pd.period_range('2023-01', periods=12, freq='M')
+
+
+def month_bars(month):
+    days = pd.bdate_range(month.start_time, month.end_time)
+    # 5-minute bars of the regular session
+    return (days.values[:, None] + pd.timedelta_range('09:30:00', '15:55:00', freq='5min').values[None, :]).ravel()
+
+
+def make_quotes(ticker_ids, metadata_id, month, rng):
+    datetimes = month_bars(month)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.001, (len(ticker_ids), len(datetimes))), axis=1))
+    return pd.DataFrame({
+        'ticker_id': np.repeat(ticker_ids, len(datetimes)),
+        'datetime': np.tile(datetimes, len(ticker_ids)),
+        'metadata_id': metadata_id,
+        'open': close.ravel(),
+        'high': close.ravel() * 1.001,
+        'low': close.ravel() * 0.999,
+        'close': close.ravel(),
+        'volume': rng.integers(100, 10000, close.size),
+    })
+
+
+def ingest(conn, cur, table, ticker_ids, metadata_id, ticker_partitions):
+    rng = np.random.default_rng(0)
+    partitioned = is_partitioned(cur, table)
+    rows, seconds = 0, 0.0
+    # a month of all tickers per transaction, like a backfill month by month
+    for month in months:
+        df = make_quotes(ticker_ids, metadata_id, month, rng)
+        start = time.perf_counter()
+        if partitioned:
+            create_month_partitions(cur, table, df['datetime'], ticker_partitions=ticker_partitions)
+        rows += bulk_upsert(cur, df, table, conflict_columns=('ticker_id', 'datetime'), update=False)
+        conn.commit()
+        seconds += time.perf_counter() - start
+    return rows, seconds
+
+
+def query_latency(cur, table, ticker_ids, number_of_queries=50):
+    rng = np.random.default_rng(1)
+    latencies = []
+    for _ in range(number_of_queries):
+        ticker_id = int(rng.choice(ticker_ids))
+        month = months[rng.integers(len(months))]
+        start = time.perf_counter()
+        cur.execute(f"""
+            SELECT datetime, open, high, low, close, volume FROM {table}
+            WHERE ticker_id = %s AND datetime >= %s AND datetime < %s
+        """, (ticker_id, month.start_time, (month + 1).start_time))
+        cur.fetchall()
+        latencies.append(time.perf_counter() - start)
+    return np.median(latencies)
+
+
+def drop_first_month(conn, cur, table):
+    start = time.perf_counter()
+    if is_partitioned(cur, table):
+        for partition in archive_partitions(conn, cur, table, (months[0] + 1).start_time,
+                                            archive_schema=archive_schema):
+            cur.execute(f"DROP TABLE {archive_schema}.{partition}")
+    else:
+        cur.execute(f"DELETE FROM {table} WHERE datetime < %s", ((months[0] + 1).start_time,))
+    conn.commit()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    db_params = {
+        'dbname': os.environ.get('POSTGRES_DB', 'stock'),
+        'user': os.environ["POSTGRES_USER"],
+        'password': os.environ["POSTGRES_PASSWORD"],
+        'host': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'port': os.environ.get('POSTGRES_PORT', '5432'),
+    }
+    with psycopg2.connect(**db_params) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA {scratch_schema}")
+            # the reference, metadata and quote tables are created in the scratch schema
+            cur.execute(f"SET search_path TO {scratch_schema}")
+            conn.commit()
+            try:
+                tables = create_stock_database_tables(conn, cur)
+                bulk_upsert(cur, pd.DataFrame({'ticker_symbol': [f'BENCH{i}' for i in range(number_of_tickers)]}),
+                            tables['reference_table'], conflict_columns=('ticker_symbol',), update=False)
+                cur.execute(f"SELECT ticker_id FROM {tables['reference_table']}")
+                ticker_ids = np.array([ticker_id for ticker_id, in cur.fetchall()])
+                cur.execute(f"""
+                    INSERT INTO {tables['meta_data_table']} (ticker_id, datetime) VALUES (%s, now())
+                    RETURNING metadata_id
+                """, (int(ticker_ids[0]),))
+                metadata_id = cur.fetchone()[0]
+                conn.commit()
+
+                for name, partitioned, ticker_partitions in [('flat', False, 0), ('monthly partitions', True, 0),
+                                                              ('monthly x 8 ticker hash', True, 8)]:
+                    table = create_intraday_table(conn, cur, table_prefix='stock_quotes', interval='bench',
+                                                  partitioned=partitioned)
+                    try:
+                        rows, seconds = ingest(conn, cur, table, ticker_ids, metadata_id, ticker_partitions)
+                        cur.execute(f"ANALYZE {table}")
+                        latency = query_latency(cur, table, ticker_ids)
+                        drop_seconds = drop_first_month(conn, cur, table)
+                        print(f'{name:25s}: {rows} rows ingested at {rows / seconds:8.0f} rows/s, '
+                              f'one ticker and month queried in {latency * 1000:6.2f} ms, '
+                              f'oldest month removed in {drop_seconds:6.3f} s')
+                    finally:
+                        conn.rollback()
+                        cur.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+                        conn.commit()
+            finally:
+                conn.rollback()
+                cur.execute(f"DROP SCHEMA IF EXISTS {archive_schema} CASCADE")
+                cur.execute(f"DROP SCHEMA {scratch_schema} CASCADE")
+                conn.commit()
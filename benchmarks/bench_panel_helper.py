@@ -0,0 +1,65 @@
+"""
+Benchmark the panel indicator kernels against computing RSI, MFI, RMI, MACD and Ichimoku one symbol at a time.
+
+Run from the repository root: python -m benchmarks.bench_panel_helper
+"""
+import time
+import numpy as np
+import pandas as pd
+import talib
+
+from tools.panel_helper import (calculate_panel_ichimoku, calculate_panel_macd, calculate_panel_mfi,
+                                calculate_panel_rmi, calculate_panel_rsi)
+from tools.pattern_helper import calculate_ichimoku, calculate_rmi
+
+
+def make_panel(number_of_symbols, number_of_dates, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (number_of_symbols, number_of_dates)), axis=1))
+    panel = {
+        'high': close * (1 + np.abs(rng.normal(0, 0.01, close.shape))),
+        'low': close * (1 - np.abs(rng.normal(0, 0.01, close.shape))),
+        'close': close,
+        'volume': rng.integers(10 ** 5, 10 ** 7, close.shape).astype(float),
+    }
+    # later listings leave leading gaps
+    listing = rng.integers(0, number_of_dates // 2, number_of_symbols)
+    for values in panel.values():
+        values[np.arange(number_of_dates)[None, :] < listing[:, None]] = np.nan
+    return panel
+
+
+def per_symbol(panel, dates):
+    for row in range(panel['close'].shape[0]):
+        valid = ~np.isnan(panel['close'][row])
+        df = pd.DataFrame({column: values[row, valid] for column, values in panel.items()}, index=dates[valid])
+        talib.RSI(df['close'], timeperiod=14)
+        talib.MFI(high=df['high'], low=df['low'], close=df['close'], volume=df['volume'], timeperiod=14)
+        calculate_rmi(df['close'], time_period=14, momentum_period=5)
+        talib.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
+        calculate_ichimoku(df)
+
+
+def panel_kernels(panel):
+    calculate_panel_rsi(panel['close'])
+    calculate_panel_mfi(panel['high'], panel['low'], panel['close'], panel['volume'])
+    calculate_panel_rmi(panel['close'])
+    calculate_panel_macd(panel['close'])
+    calculate_panel_ichimoku(panel['high'], panel['low'])
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    number_of_dates = 252 * 10
+    dates = pd.bdate_range(end='2023-12-29', periods=number_of_dates)
+    for number_of_symbols in [500, 3000]:
+        panel = make_panel(number_of_symbols, number_of_dates)
+        per_symbol_time = timed(per_symbol, panel, dates)
+        panel_time = min(timed(panel_kernels, panel) for _ in range(3))
+        print(f'{number_of_symbols:5d} symbols x {number_of_dates} dates: per symbol {per_symbol_time:6.2f} s, '
+              f'panel {panel_time:6.2f} s, speedup {per_symbol_time / panel_time:5.1f}x')
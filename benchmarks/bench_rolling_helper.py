@@ -0,0 +1,35 @@
+"""
+Benchmark rolling_calendar_extrema against per-window pandas rolling for the close_to_N_day_high/low features.
+
+Run from the repository root: python -m benchmarks.bench_rolling_helper
+"""
+import timeit
+import numpy as np
+import pandas as pd
+
+from tools.rolling_helper import rolling_calendar_extrema
+
+week_multiplier = 2
+windows_days = [365] + list(range(week_multiplier * 7, 13 * week_multiplier * 7, week_multiplier * 7))
+
+
+def pandas_rolling(close):
+    for days in windows_days:
+        close.rolling(window=f'{days}D').max()
+        close.rolling(window=f'{days}D').min()
+
+
+def kernel_rolling(close):
+    rolling_calendar_extrema(close.values, close.index, windows_days)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    for years in [5, 20, 40]:
+        index = pd.bdate_range(end='2023-12-29', periods=252 * years, tz='US/Eastern')
+        close = pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(index)))), index=index)
+        repeat = 20
+        pandas_time = min(timeit.repeat(lambda: pandas_rolling(close), number=1, repeat=repeat))
+        kernel_time = min(timeit.repeat(lambda: kernel_rolling(close), number=1, repeat=repeat))
+        print(f'{len(index):6d} bars, {len(windows_days)} windows: pandas {pandas_time * 1000:7.2f} ms, '
+              f'kernel {kernel_time * 1000:7.2f} ms, speedup {pandas_time / kernel_time:5.1f}x')
@@ -0,0 +1,46 @@
+import argparse
+import os
+import psycopg2
+from tools.bar_aggregation import update_all_bars
+from tools.database_helper import create_stock_database_tables
+
+
+def main(source_interval='1min', intervals=('5min', '15min', '30min', '60min', '1day'), extended=False,
+         full=False):
+    """
+    Aggregate the stored intraday quotes of the finest interval to longer intervals.
+
+    Args:
+        source_interval: str, interval of the stored quotes, e.g. '1min' (default is '1min')
+        intervals: tuple of the intervals of the aggregated bars
+        extended: boolean, also aggregate the bars of the extended session (default is False)
+        full: boolean, aggregate every quote instead of only the quotes saved since the last run (default is False)
+    """
+    # Database connection parameters
+    db_params = {
+        'dbname': 'stock',
+        'user': os.environ["POSTGRES_USER"],
+        'password': os.environ["POSTGRES_PASSWORD"],
+        'host': 'localhost',
+        'port': '5432'
+    }
+
+    with psycopg2.connect(**db_params) as conn:
+        with conn.cursor() as cur:
+            create_stock_database_tables(conn, cur)
+            sessions = ('regular', 'extended') if extended else ('regular',)
+            return update_all_bars(conn, cur, source_interval=source_interval, intervals=intervals,
+                                   sessions_to_update=sessions, full=full)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregate intraday quotes to bars of longer intervals.')
+    parser.add_argument('--source-interval', default='1min', help='interval of the stored quotes')
+    parser.add_argument('--intervals', nargs='+', default=['5min', '15min', '30min', '60min', '1day'],
+                        help='intervals of the aggregated bars')
+    parser.add_argument('--extended', action='store_true', help='also aggregate the extended session')
+    parser.add_argument('--full', action='store_true',
+                        help='aggregate every quote instead of only the quotes saved since the last run')
+    args = parser.parse_args()
+    main(source_interval=args.source_interval, intervals=tuple(args.intervals), extended=args.extended,
+         full=args.full)
@@ -1,9 +1,12 @@
 import psycopg2
 from tools import get_ticker_data, scrape_events
 from tools.database_helper import *
+from tools.response_cache import ResponseCache
 
 save_type = 'psql'
-outputsize = 'compact' # use 'compact' to update existing records with past 100 trading days.
+outputsize = 'auto'  # 'compact' or 'full' for every ticker, 'auto' chooses per ticker from the stored quotes
+# responses of the last 12 hours are not downloaded again, e.g. when rerunning after a crash
+cache = ResponseCache('res/response_cache')
 
 # Database connection parameters
 db_params = {
@@ -42,7 +45,8 @@ with psycopg2.connect(**db_params) as conn:
             save_type=save_type,
             outputsize=outputsize,
             conn=conn,
-            cur=cur
+            cur=cur,
+            cache=cache
         )
 
         # --- Chart Events ----
@@ -58,5 +62,6 @@ with psycopg2.connect(**db_params) as conn:
             tables=tables,
             save_type=save_type,
             conn=conn,
-            cur=cur
+            cur=cur,
+            cache=cache
         )
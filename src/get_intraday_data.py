@@ -4,6 +4,8 @@ from tools.database_helper import *
 save_type = 'psql'
 outputsize = 'compact' # use 'compact' to update existing records with past 100 trading days.
 reference_table='tickers'
+# month to download the history from one month at a time, None only updates the latest quotes
+backfill_start_month = None  # e.g. '2022-01'
 
 # Connect to your postgres DB
 conn = psycopg2.connect(
@@ -20,10 +22,16 @@ cur = conn.cursor()
 
 all_symbols = get_all_ticker_symbols(cur, reference_table=reference_table)
 # all_symbols = ['TSLA', 'GOOG', 'IBM']
-download_and_save_intraday_sql(
-    all_symbols, conn, cur,
-    table_prefix='stock_quotes', reference_table=reference_table, interval='5min',
-    outputsize=outputsize, month='', extended_hours='false', sleep_time=1)
+if backfill_start_month:
+    # resumes from res/intraday_backfill.jsonl when restarted
+    backfill_intraday_sql(
+        all_symbols, conn, cur, backfill_start_month, intervals=('5min',),
+        table_prefix='stock_quotes', reference_table=reference_table, extended_hours='false', requests_per_minute=75)
+else:
+    download_and_save_intraday_sql(
+        all_symbols, conn, cur,
+        table_prefix='stock_quotes', reference_table=reference_table, interval='5min',
+        outputsize=outputsize, month='', extended_hours='false', requests_per_minute=75)
 
 cur.close()
 conn.close()
@@ -0,0 +1,13 @@
+import argparse
+from tools.hdf5_helper import repack
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reclaim the space of removed nodes and rows of an HDF5 store and '
+                                                 'compress every node.')
+    parser.add_argument('path', help='HDF5 file, replaced by the repacked store unless --output is given')
+    parser.add_argument('--output', default=None, help='file of the repacked store')
+    parser.add_argument('--complevel', type=int, default=5, help='compression level from 0 to 9')
+    parser.add_argument('--complib', default='blosc:zstd', help="compression library, e.g. 'blosc:zstd' or 'zlib'")
+    args = parser.parse_args()
+    repack(args.path, complevel=args.complevel, complib=args.complib, output_path=args.output)
@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from tools.bar_aggregation import aggregate_bars, bar_interval
+
+
+class TestBarAggregation(unittest.TestCase):
+    def setUp(self):
+        # 1min bars of two days from the pre-market to the after-hours, with a missing minute
+        index = pd.DatetimeIndex(np.concatenate([
+            pd.date_range(f'{day} 04:00', f'{day} 19:59', freq='1min') for day in ['2024-01-04', '2024-01-05']
+        ]), name='datetime').drop(pd.Timestamp('2024-01-04 09:31'))
+        close = np.arange(len(index), dtype=float)
+        self.df = pd.DataFrame({
+            'open': close - 0.5, 'high': close + 1, 'low': close - 1, 'close': close, 'volume': 10,
+        }, index=index)
+
+    def test_bar_interval(self):
+        self.assertEqual(bar_interval('15min'), pd.Timedelta(minutes=15))
+        self.assertEqual(bar_interval('1day'), pd.Timedelta(days=1))
+
+    def test_regular_session(self):
+        bars = aggregate_bars(self.df, '60min')
+        # 9:30 to 15:30 each day, the last bar holds the 30 minutes before the close
+        self.assertEqual(len(bars), 14)
+        self.assertEqual(bars.index[0], pd.Timestamp('2024-01-04 09:30'))
+        self.assertEqual(bars.index[6], pd.Timestamp('2024-01-04 15:30'))
+        self.assertEqual(bars['bar_count'].tolist()[:7], [59, 60, 60, 60, 60, 60, 30])
+        first_hour = self.df.loc['2024-01-04 09:30':'2024-01-04 10:29']
+        self.assertEqual(bars['open'].iloc[0], first_hour['open'].iloc[0])
+        self.assertEqual(bars['high'].iloc[0], first_hour['high'].max())
+        self.assertEqual(bars['low'].iloc[0], first_hour['low'].min())
+        self.assertEqual(bars['close'].iloc[0], first_hour['close'].iloc[-1])
+        self.assertEqual(bars['volume'].iloc[0], 590)
+
+    def test_daily_bars(self):
+        regular = aggregate_bars(self.df, '1day')
+        extended = aggregate_bars(self.df, '1day', session='extended')
+        self.assertEqual(regular.index.tolist(), [pd.Timestamp('2024-01-04'), pd.Timestamp('2024-01-05')])
+        self.assertEqual(regular['bar_count'].tolist(), [389, 390])
+        self.assertEqual(extended['bar_count'].tolist(), [959, 960])
+        self.assertEqual(regular['close'].iloc[0], self.df.loc['2024-01-04 15:59', 'close'])
+        self.assertEqual(extended['close'].iloc[0], self.df.loc['2024-01-04 19:59', 'close'])
+
+    def test_matches_resample(self):
+        bars = aggregate_bars(self.df, '5min', session='extended')
+        resampled = self.df.resample('5min').agg(
+            {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}).dropna()
+        pd.testing.assert_frame_equal(bars.drop(columns='bar_count'), resampled, check_freq=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
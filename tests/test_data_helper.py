@@ -0,0 +1,178 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from tools.data_helper import add_shifted_columns, build_lag_matrix, lag_view, process_data
+from tools.feature_cache import FeatureCache
+from tools.pattern_helper import calculate_ichimoku
+
+
+def make_prices(seed, start='2015-01-01', end='2019-12-31'):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, end, name='date')
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, len(dates))))
+    df = pd.DataFrame({
+        'open': close * (1 + rng.normal(0, 0.005, len(dates))),
+        'high': close * (1 + np.abs(rng.normal(0, 0.01, len(dates)))),
+        'low': close * (1 - np.abs(rng.normal(0, 0.01, len(dates)))),
+        'close': close,
+        'volume': rng.integers(10 ** 5, 10 ** 7, len(dates)).astype(float),
+        'dividend_amount': np.where(rng.random(len(dates)) < 0.02, 0.5, 0.0),
+    }, index=dates)
+    return calculate_ichimoku(df)
+
+
+def make_events(seed, start='2014-01-01', end='2019-12-31'):
+    rng = np.random.default_rng(seed)
+    earnings = pd.date_range(start, end, freq='QS') + pd.Timedelta(days=25, hours=20)
+    dividends = pd.date_range(start, end, freq='QS') + pd.Timedelta(days=40, hours=12)
+    return pd.DataFrame({
+        'eventType': ['chartEvent/earnings'] * len(earnings) + ['chartEvent/dividends'] * len(dividends),
+        'dateTimestamp': earnings.append(dividends),
+        'epsActual': rng.normal(1, 0.1, len(earnings) + len(dividends)),
+    })
+
+
+def make_study_data(path, symbols, details_path, end='2019-12-31'):
+    with pd.HDFStore(path, mode='w') as store:
+        for i, ind in enumerate(['SPY', 'QQQ', 'DIA']):
+            store.put(f'indices/{ind}', make_prices(100 + i).loc[:end], format='table', data_columns=True)
+        for i, symbol in enumerate(symbols):
+            store.put(f'prices/{symbol}', make_prices(i).loc[:end], format='table', data_columns=True)
+            if symbol != 'NOEV':
+                store.put(f'events/{symbol}', make_events(i), format='table', data_columns=True)
+    pd.DataFrame({'Ticker': symbols, 'Sector': 'Technology'}).set_index('Ticker').to_csv(details_path)
+
+
+class TestProcessData(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.data_path = os.path.join(cls.tmp_dir, 'study_data.h5')
+        cls.details_path = os.path.join(cls.tmp_dir, 'details.csv')
+        cls.symbols = ['AAA', 'BBB', 'CCC', 'NOEV', 'DDD']
+        make_study_data(cls.data_path, cls.symbols, cls.details_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_parallel_matches_serial(self):
+        df_dict, dropped_symbols = process_data(self.data_path, details_path=self.details_path)
+        parallel_df_dict, parallel_dropped_symbols = process_data(
+            self.data_path, workers=2, details_path=self.details_path)
+
+        self.assertEqual(dropped_symbols, ['/prices/NOEV'])
+        self.assertEqual(parallel_dropped_symbols, dropped_symbols)
+        self.assertEqual(list(parallel_df_dict.keys()), list(df_dict.keys()))
+        for key, df in df_dict.items():
+            self.assertGreater(df.shape[0], 0)
+            pd.testing.assert_frame_equal(parallel_df_dict[key], df)
+
+    def test_feature_cache(self):
+        cache = FeatureCache(os.path.join(self.tmp_dir, 'feature_cache'))
+        df_dict, _ = process_data(self.data_path, details_path=self.details_path, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 4))
+
+        cached_df_dict, _ = process_data(self.data_path, workers=2, details_path=self.details_path, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (4, 4))
+        for key, df in df_dict.items():
+            pd.testing.assert_frame_equal(cached_df_dict[key], df)
+
+        # changed parameters miss, and only the invalidated symbol is recomputed
+        process_data(self.data_path, details_path=self.details_path, cache=cache, shift_step=5)
+        self.assertEqual(cache.misses, 8)
+        self.assertEqual(cache.invalidate('AAA'), 1)
+        process_data(self.data_path, details_path=self.details_path, cache=cache, shift_step=5)
+        self.assertEqual((cache.hits, cache.misses), (7, 9))
+
+        cache.max_bytes = cache.stats['bytes'] // 2
+        cache.evict()
+        self.assertLessEqual(cache.stats['bytes'], cache.max_bytes)
+        self.assertGreater(cache.evictions, 0)
+        cache.invalidate()
+        self.assertEqual(cache.stats['entries'], 0)
+
+    def test_incremental_update_matches_full_rebuild(self):
+        previous_path = os.path.join(self.tmp_dir, 'previous_study_data.h5')
+        make_study_data(previous_path, self.symbols, self.details_path, end='2019-12-20')
+        # a dividend later rescales the adjusted history of one symbol, which requires a full rebuild
+        with pd.HDFStore(previous_path, mode='a') as store:
+            store.put('prices/BBB', store['prices/BBB'] * 0.99, format='table', data_columns=True)
+        previous_df_dict, _ = process_data(previous_path, details_path=self.details_path)
+
+        df_dict, dropped_symbols = process_data(self.data_path, details_path=self.details_path)
+        updated_df_dict, updated_dropped_symbols = process_data(
+            self.data_path, details_path=self.details_path, previous_df_dict=previous_df_dict)
+
+        self.assertEqual(updated_dropped_symbols, dropped_symbols)
+        for key, df in df_dict.items():
+            self.assertGreater(df.index[-1], previous_df_dict[key].index[-1])
+            pd.testing.assert_frame_equal(updated_df_dict[key], df, check_exact=True, check_freq=False)
+
+    def test_date_range_pushdown(self):
+        df_dict, _ = process_data(self.data_path, details_path=self.details_path)
+        start, end = '2018-06-01', '2019-06-30'
+        ranged_df_dict, _ = process_data(
+            self.data_path, details_path=self.details_path, start=start, end=end, price_columns=[])
+
+        for key, df in df_dict.items():
+            ranged_df = ranged_df_dict[key]
+            self.assertNotIn('open', ranged_df.columns)
+            # the warm-up leaves only the decayed seed of the recursive indicators
+            expected = df.loc[(df.index >= ranged_df.index[0]) & (df.index <= ranged_df.index[-1]), ranged_df.columns]
+            pd.testing.assert_frame_equal(ranged_df, expected, rtol=1e-9, check_freq=False)
+            self.assertEqual(ranged_df.index[0], pd.Timestamp('2018-05-31 16:00', tz='US/Eastern'))
+            self.assertEqual(ranged_df.index[-1], pd.Timestamp('2019-06-27 16:00', tz='US/Eastern'))
+
+    def test_feature_cache_date_range(self):
+        df_dict, _ = process_data(self.data_path, details_path=self.details_path)
+        cache = FeatureCache(os.path.join(self.tmp_dir, 'date_range_cache'))
+        # entries of another start date or other price columns are rebuilt, not extended
+        for kwargs in [{'start': '2018-06-01'}, {}, {'price_columns': []}, {}]:
+            cached_df_dict, _ = process_data(self.data_path, details_path=self.details_path, cache=cache, **kwargs)
+        for key, df in df_dict.items():
+            pd.testing.assert_frame_equal(cached_df_dict[key], df, check_freq=False)
+
+        ranged_df_dict, _ = process_data(self.data_path, details_path=self.details_path, start='2018-06-01')
+        updated_df_dict, _ = process_data(self.data_path, details_path=self.details_path,
+                                          previous_df_dict=ranged_df_dict)
+        for key, df in df_dict.items():
+            pd.testing.assert_frame_equal(updated_df_dict[key], df, check_freq=False)
+
+
+class TestLagMatrix(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.df = pd.DataFrame(rng.normal(size=(50, 3)), columns=['a', 'b', 'c'])
+        self.df.iloc[5, 1] = np.nan
+
+    def test_matches_shift(self):
+        lags = [1, 3, 10, -2, 0, 60]
+        lag_df = build_lag_matrix(self.df, ['a', 'b'], lags)
+        self.assertEqual(list(lag_df.columns), [f'{c}_shifted_{lag}' for c in ['a', 'b'] for lag in lags])
+        for column_name in ['a', 'b']:
+            for lag in lags:
+                pd.testing.assert_series_equal(
+                    lag_df[f'{column_name}_shifted_{lag}'], self.df[column_name].shift(lag), check_names=False)
+
+        self.assertEqual(build_lag_matrix(self.df, ['a'], [1], dtype=np.float32)['a_shifted_1'].dtype, np.float32)
+
+    def test_add_shifted_columns(self):
+        df, new_columns = add_shifted_columns(self.df.copy(), ['a', 'c'], 4, shift_step=5)
+        self.assertEqual(new_columns, [f'{c}_shifted_{n * 5}' for c in ['a', 'c'] for n in range(1, 5)])
+        self.assertEqual(list(df.columns), ['a', 'b', 'c'] + new_columns)
+        pd.testing.assert_series_equal(df['c_shifted_20'], self.df['c'].shift(20), check_names=False)
+
+    def test_lag_view(self):
+        view = lag_view(self.df['b'].values, 4, lag_step=3)
+        self.assertEqual(view.shape, (50, 4))
+        for n in range(1, 5):
+            np.testing.assert_array_equal(view[:, n - 1], self.df['b'].shift(n * 3).values)
+
+
+if __name__ == '__main__':
+    unittest.main()
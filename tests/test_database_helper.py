@@ -0,0 +1,27 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from tools.database_helper import bulk_upsert
+
+
+class TestBulkUpsert(unittest.TestCase):
+    def test_integers_only_for_integer_columns(self):
+        cur = mock.Mock()
+        cur.description = [mock.Mock(type_code=23), mock.Mock(type_code=701), mock.Mock(type_code=20)]
+        for column, name in zip(cur.description, ['id', 'big', 'volume']):
+            column.name = name
+        cur.rowcount = 2
+        copied = []
+        cur.copy_expert.side_effect = lambda sql, output: copied.append(output.getvalue())
+        df = pd.DataFrame({'id': [1, 2], 'big': [2.0 ** 63, 3.0], 'volume': [100.0, np.nan]})
+
+        bulk_upsert(cur, df, 'quotes')
+
+        self.assertEqual(copied, ['1,9.223372036854776e+18,100\n2,3.0,\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
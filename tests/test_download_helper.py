@@ -0,0 +1,117 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from tools.download_helper import download_and_save, parse_time_series
+from tools.response_cache import ResponseCache
+
+payload = {
+    'Meta Data': {
+        '1. Information': 'Daily Time Series with Splits and Dividend Events',
+        '2. Symbol': 'IBM',
+        '3. Last Refreshed': '2024-01-03',
+        '4. Output Size': 'Compact',
+        '5. Time Zone': 'US/Eastern',
+    },
+    'Time Series (Daily)': {
+        date: {'1. open': '10.0', '2. high': '11.0', '3. low': '9.5', '4. close': str(close),
+               '5. adjusted close': str(close), '6. volume': '1000', '7. dividend amount': '0.0000',
+               '8. split coefficient': '1.0'}
+        for date, close in [('2024-01-03', 10.5), ('2024-01-02', 10.25)]
+    },
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        symbol = parse_qs(urlparse(self.path).query)['symbol'][0]
+        with server.lock:
+            server.open_requests += 1
+            server.max_open_requests = max(server.max_open_requests, server.open_requests)
+            server.calls[symbol] = server.calls.get(symbol, 0) + 1
+            calls = server.calls[symbol]
+        time.sleep(0.05)
+        status, body = 200, payload
+        if symbol == 'NOTE' and calls == 1:
+            body = {'Note': 'API call frequency exceeded'}
+        elif symbol == 'BUSY' and calls == 1:
+            status = 429
+        elif symbol == 'BAD':
+            body = {'Error Message': 'Invalid API call'}
+        with server.lock:
+            server.open_requests -= 1
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+
+class TestDownloadHelper(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.open_requests = 0
+        self.server.max_open_requests = 0
+        self.server.calls = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/query'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_parse_time_series(self):
+        data, meta_data = parse_time_series(payload)
+        self.assertEqual(meta_data['2. Symbol'], 'IBM')
+        self.assertEqual(data.index.name, 'date')
+        self.assertEqual(data.index[0], pd.Timestamp('2024-01-03'))
+        self.assertEqual(data['4. close'].tolist(), [10.5, 10.25])
+        self.assertEqual(data['8. split coefficient'].dtype, float)
+
+    def test_download_and_save(self):
+        symbols = [f'S{i}' for i in range(10)] + ['NOTE', 'BUSY', 'BAD']
+        saved = {}
+        failed_symbols = download_and_save(
+            symbols,
+            lambda downloader, symbol: downloader.get_daily_adjusted(symbol, outputsize='compact'),
+            lambda symbol, data, meta_data: saved.__setitem__(symbol, data),
+            api_key='test', requests_per_minute=6000, concurrency=3, backoff=0.01, url=self.url)
+
+        self.assertEqual(list(failed_symbols), ['BAD'])
+        self.assertEqual(sorted(saved), sorted(set(symbols) - {'BAD'}))
+        # throttled requests are retried once
+        self.assertEqual(self.server.calls['NOTE'], 2)
+        self.assertEqual(self.server.calls['BUSY'], 2)
+        self.assertEqual(self.server.calls['BAD'], 1)
+        self.assertLessEqual(self.server.max_open_requests, 3)
+        self.assertGreater(self.server.max_open_requests, 1)
+
+    def test_download_and_save_cached(self):
+        symbols = ['S0', 'S1', 'S2']
+
+        def download(cache):
+            saved = {}
+            failed_symbols = download_and_save(
+                symbols,
+                lambda downloader, symbol: downloader.get_daily_adjusted(symbol, outputsize='compact'),
+                lambda symbol, data, meta_data: saved.__setitem__(symbol, data),
+                api_key='test', requests_per_minute=6000, concurrency=3, backoff=0.01, url=self.url, cache=cache)
+            return saved, failed_symbols
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            download(ResponseCache(cache_dir))
+            saved, failed_symbols = download(ResponseCache(cache_dir, offline=True))
+        self.assertEqual(failed_symbols, {})
+        self.assertEqual(sorted(saved), symbols)
+        # the second download was served from the cache
+        self.assertEqual(self.server.calls, {symbol: 1 for symbol in symbols})
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from tools.download_planner import get_last_dates_hdf5, get_work_queue, plan_downloads, plan_report
+
+
+class TestDownloadPlanner(unittest.TestCase):
+    def setUp(self):
+        self.last_dates = pd.DataFrame({
+            'last_date': pd.to_datetime(['2024-01-05', None, '2023-12-29', '2023-06-01', '2024-01-04']),
+            'row_count': [5000, 0, 4000, 3000, 2000],
+            'readjust': [False, False, False, False, True],
+        }, index=pd.Index(['CURRENT', 'NEW', 'UPDATE', 'GAP', 'SPLIT'], name='symbol'))
+
+    def test_plan_downloads(self):
+        # Saturday, the last business day is Friday 2024-01-05
+        plan = plan_downloads(self.last_dates, as_of='2024-01-06')
+        self.assertEqual(plan['outputsize'].tolist(), [None, 'full', 'compact', 'full', 'full'])
+        self.assertEqual(plan['reason'].tolist(), ['current', 'new', 'update', 'gap', 'readjust'])
+        self.assertEqual(plan['missing_days'].tolist(), [0, 0, 5, 156, 1])
+        self.assertEqual(plan.loc['UPDATE', 'download_rows'], 100)
+        self.assertEqual(plan.loc['SPLIT', 'download_rows'], 2001)
+
+        self.assertEqual(get_work_queue(plan), [
+            ('full', True, ['SPLIT']),
+            ('full', False, ['NEW', 'GAP']),
+            ('compact', False, ['UPDATE']),
+        ])
+        self.assertIn('4 API calls for 5 tickers', plan_report(plan))
+
+    def test_get_last_dates_hdf5(self):
+        dates = pd.bdate_range('2024-01-01', periods=30, name='date')
+        df = pd.DataFrame({'close': np.arange(30.0)}, index=dates)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.h5')
+            with pd.HDFStore(path, mode='w') as store:
+                store.put('prices/AAA', df, format='table', data_columns=True)
+            last_dates = get_last_dates_hdf5(path, 'prices', ['AAA', 'BBB'])
+        self.assertEqual(last_dates.loc['AAA', 'last_date'], dates[-1])
+        self.assertEqual(last_dates.loc['AAA', 'row_count'], 30)
+        self.assertTrue(pd.isna(last_dates.loc['BBB', 'last_date']))
+        self.assertEqual(last_dates.loc['BBB', 'row_count'], 0)
@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+import pandas as pd
+import pytz
+
+from tools.data_helper import days_since_earnings, get_earnings_dates
+from tools.event_helper import align_event_dates, calculate_event_features
+
+
+def make_events_df():
+    return pd.DataFrame({
+        'eventType': ['chartEvent/earnings', 'chartEvent/dividends', 'chartEvent/earnings',
+                      'chartEvent/split', 'chartEvent/earnings', 'chartEvent/dividends'],
+        'dateTimestamp': pd.to_datetime([
+            '2020-01-28 21:30', '2020-02-07 12:00', '2020-04-30 20:30',
+            '2020-08-31 12:00', '2020-07-30 20:30', '2020-05-08 12:00',
+        ]),
+    })
+
+
+def make_prices_df():
+    dates = pd.bdate_range('2020-01-01', '2020-12-31', tz='US/Eastern') + pd.Timedelta(hours=16)
+    return pd.DataFrame({'close': np.arange(len(dates), dtype=float)}, index=dates)
+
+
+class TestEventHelper(unittest.TestCase):
+    def setUp(self):
+        self.events_df = make_events_df()
+        self.df = make_prices_df()
+
+    def test_earnings_dates_match_per_row_conversion(self):
+        earnings = self.events_df.loc[self.events_df['eventType'] == 'chartEvent/earnings', 'dateTimestamp']
+        eastern = pytz.timezone('US/Eastern')
+        expected = earnings.apply(pytz.utc.localize).apply(lambda x: x.astimezone(eastern))
+        pd.testing.assert_series_equal(get_earnings_dates(self.events_df), expected, check_dtype=False)
+
+    def test_days_since_matches_per_row_filter(self):
+        earnings_dates = get_earnings_dates(self.events_df)
+        days_since, _ = align_event_dates(self.df.index, earnings_dates)
+
+        for date, value in zip(self.df.index, days_since):
+            past_earnings_dates = earnings_dates[earnings_dates <= date]
+            if past_earnings_dates.empty:
+                self.assertTrue(np.isnan(value))
+            else:
+                self.assertEqual(value, (date - past_earnings_dates.max()).days + 1)
+            self.assertTrue(np.array_equal(days_since_earnings(date, earnings_dates), value, equal_nan=True))
+
+    def test_days_until_next_event(self):
+        features = calculate_event_features(self.df.index, self.events_df)
+        # split on 2020-08-31 12:00 UTC is 08:00 ET, before the 16:00 close of the same day
+        self.assertEqual(features.loc['2020-08-28 16:00', 'days_until_split'], 3)
+        self.assertEqual(features.loc['2020-08-31 16:00', 'days_since_split'], 1)
+        self.assertTrue(features.loc['2020-09-01':, 'days_until_split'].isna().all())
+        self.assertTrue(features.loc[:'2020-01-28', 'days_since_earnings'].isna().all())
+
+    def test_no_events(self):
+        days_since, days_until = align_event_dates(self.df.index, pd.Series([], dtype='datetime64[ns, UTC]'))
+        self.assertTrue(np.isnan(days_since).all())
+        self.assertTrue(np.isnan(days_until).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
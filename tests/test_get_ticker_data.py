@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from tools.get_ticker_data import QuoteBatchWriter, ReadjustmentError, download_and_save_hdf5, intraday_columns
+
+
+def month_quotes(month, close):
+    index = pd.date_range(f'{month}-03 09:30', periods=3, freq='5min', name='date')
+    return pd.DataFrame({'1. open': close, '2. high': close, '3. low': close, '4. close': close, '5. volume': 100},
+                        index=index)
+
+
+class TestQuoteBatchWriter(unittest.TestCase):
+    def test_metadata_of_each_download(self):
+        cur = mock.Mock()
+        cur.fetchall.return_value = [('AAA', 1), ('BBB', 2)]
+        meta_data = {'1. Information': 'Intraday (5min) open, high, low, close prices and volume',
+                     '3. Last Refreshed': '2024-02-29 19:55:00', '4. Interval': '5min',
+                     '5. Output Size': 'Full size', '6. Time Zone': 'US/Eastern'}
+        writer = QuoteBatchWriter(mock.Mock(), cur, 'stock_quotes_5min', intraday_columns, date_column='datetime',
+                                  interval=None, meta_keys=('3. Last Refreshed', '5. Output Size', '6. Time Zone'),
+                                  batch_size=3)
+
+        # two months of the same ticker in one batch, like a backfill of few tickers
+        with mock.patch('tools.get_ticker_data.execute_values', return_value=[(11,), (12,), (13,)]) as insert, \
+                mock.patch('tools.get_ticker_data.bulk_upsert', return_value=9) as upsert:
+            writer('AAA', month_quotes('2024-01', 1.0), meta_data)
+            writer('BBB', month_quotes('2024-01', 2.0), meta_data)
+            writer('AAA', month_quotes('2024-02', 3.0), meta_data)
+
+        metadata = insert.call_args.args[2]
+        self.assertEqual([row[0] for row in metadata], [1, 2, 1])
+        df = upsert.call_args.args[1]
+        self.assertEqual(df.groupby(['ticker_id', 'close'])['metadata_id'].unique().map(list).to_dict(),
+                         {(1, 1.0): [11], (2, 2.0): [12], (1, 3.0): [13]})
+        self.assertEqual(writer.failed_symbols, {})
+
+
+class TestDownloadAndSaveHdf5(unittest.TestCase):
+    def test_readjusted_symbols_by_exception(self):
+        def save_hdf5(writer, directory, symbol, data, merge=False):
+            if symbol == 'AAA':
+                raise ReadjustmentError('split on 2024-02-01')
+
+        readjust_symbols = set()
+        with mock.patch('tools.get_ticker_data.TimeSeries') as time_series, \
+                mock.patch('tools.get_ticker_data.HDF5BatchWriter'), \
+                mock.patch('tools.get_ticker_data.save_hdf5', side_effect=save_hdf5), \
+                mock.patch('tools.get_ticker_data.time.sleep'):
+            time_series.return_value.get_daily_adjusted.return_value = (month_quotes('2024-02', 1.0), {})
+            failed_symbols = download_and_save_hdf5(['AAA', 'BBB'], 'quotes.h5', 'daily', outputsize='compact',
+                                                    readjust_symbols=readjust_symbols)
+
+        self.assertEqual(readjust_symbols, {'AAA'})
+        self.assertEqual(failed_symbols, {'AAA': 'split on 2024-02-01'})
+
+
+if __name__ == '__main__':
+    unittest.main()
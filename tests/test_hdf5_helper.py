@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from tools.hdf5_helper import HDF5BatchWriter, first_difference, repack
+
+
+def make_prices(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    return pd.DataFrame({'close': close, 'volume': rng.integers(10 ** 5, 10 ** 7, n).astype(float)},
+                        index=pd.bdate_range('2020-01-01', periods=n, name='date'))
+
+
+class TestHDF5Helper(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'data.h5')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_first_difference(self):
+        df = make_prices()
+        self.assertEqual(first_difference(df.iloc[:200], df), 200)
+        changed = df.copy()
+        changed.iloc[150:, 0] *= 0.5
+        self.assertEqual(first_difference(df.iloc[:200], changed), 150)
+        self.assertEqual(first_difference(df, df.iloc[:100]), 100)
+        self.assertEqual(first_difference(df, df[['close']]), 0)
+
+    def test_write(self):
+        df = make_prices()
+        with HDF5BatchWriter(self.path, verbose=False) as writer:
+            self.assertEqual(writer.write('prices/AAA', df.iloc[:250]), 250)
+            # only the new rows are appended
+            self.assertEqual(writer.write('prices/AAA', df), 50)
+            self.assertEqual(writer.write('prices/AAA', df), 0)
+            # the rows from the first changed one are replaced
+            changed = df.copy()
+            changed.iloc[-30:, 0] += 1
+            self.assertEqual(writer.write('prices/AAA', changed), 30)
+            self.assertEqual(writer.get_report()['rows'].tolist(), [250, 50, 0, 30])
+        pd.testing.assert_frame_equal(pd.read_hdf(self.path, 'prices/AAA'), changed, check_freq=False)
+        with pd.HDFStore(self.path) as store:
+            self.assertEqual(store.get_storer('prices/AAA').table.filters.complib, 'blosc:zstd')
+
+    def test_write_longer_strings(self):
+        events = pd.DataFrame({'eventType': ['chartEvent/split'], 'value': [1.0]})
+        more_events = pd.concat([events, pd.DataFrame({'eventType': ['chartEvent/dividends'], 'value': [2.0]})],
+                                ignore_index=True)
+        with HDF5BatchWriter(self.path, verbose=False) as writer:
+            writer.write('events/AAA', events)
+            # the stored strings are too short for the new row, the node is rewritten
+            self.assertEqual(writer.write('events/AAA', more_events), 2)
+        pd.testing.assert_frame_equal(pd.read_hdf(self.path, 'events/AAA'), more_events)
+
+    def test_repack(self):
+        with pd.HDFStore(self.path, mode='a') as store:
+            for symbol in ['AAA', 'BBB']:
+                store.put(f'prices/{symbol}', make_prices(3000), format='table', data_columns=True)
+            store.remove('prices/BBB')
+        size_before, size_after = repack(self.path)
+        self.assertLess(size_after, size_before)
+        pd.testing.assert_frame_equal(pd.read_hdf(self.path, 'prices/AAA'), make_prices(3000), check_freq=False)
@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from tools.intraday_backfill import BackfillCheckpoint, BackfillUnit, expected_bars, get_backfill_queue, \
+    get_months, plan_backfill
+
+
+class TestIntradayBackfill(unittest.TestCase):
+    def test_expected_bars(self):
+        # 23 business days in March 2023, 78 bars of 5 minutes per session
+        self.assertEqual(expected_bars('2023-03', '5min'), 23 * 78)
+        self.assertEqual(expected_bars('2023-03', '60min'), 23 * 7)
+
+    def test_plan_backfill(self):
+        months = get_months('2023-11', '2024-01')
+        self.assertEqual(months, ['2023-11', '2023-12', '2024-01'])
+        stored_rows = {
+            BackfillUnit('AAA', '5min', '2023-11'): expected_bars('2023-11', '5min'),
+            BackfillUnit('BBB', '5min', '2023-11'): 100,
+            BackfillUnit('AAA', '5min', '2024-01'): expected_bars('2024-01', '5min'),
+        }
+        completed = {BackfillUnit('BBB', '5min', '2023-12'): 0}
+        plan = plan_backfill(['AAA', 'BBB'], months, ['5min'], stored_rows, completed, as_of='2024-01-15')
+
+        self.assertEqual(plan['reason'].tolist(), ['stored', 'partial', 'new', 'checkpoint', 'current', 'current'])
+        self.assertEqual(get_backfill_queue(plan), [
+            BackfillUnit('BBB', '5min', '2023-11'),
+            BackfillUnit('AAA', '5min', '2023-12'),
+            BackfillUnit('AAA', '5min', '2024-01'),
+            BackfillUnit('BBB', '5min', '2024-01'),
+        ])
+
+    def test_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'backfill', 'checkpoint.jsonl')
+            BackfillCheckpoint(path).add([(BackfillUnit('AAA', '1min', '2023-01'), 8000)])
+            with open(path, 'a') as f:
+                # line cut off by a crash
+                f.write('{"symbol": "BBB", "inter')
+            checkpoint = BackfillCheckpoint(path)
+            self.assertEqual(checkpoint.completed, {BackfillUnit('AAA', '1min', '2023-01'): 8000})
+            checkpoint.add([(BackfillUnit('BBB', '1min', '2023-01'), 0)])
+            self.assertEqual(len(BackfillCheckpoint(path).completed), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
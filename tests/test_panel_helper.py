@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+import pandas as pd
+import talib
+
+from tools.panel_helper import (build_panel, calculate_panel_ichimoku, calculate_panel_macd, calculate_panel_mfi,
+                                calculate_panel_rmi, calculate_panel_rsi)
+from tools.pattern_helper import calculate_ichimoku, calculate_rmi, ichimoku_lines
+
+
+def make_df_dict(number_of_symbols=6, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2018-01-01', periods=400)
+    df_dict = {}
+    for i in range(number_of_symbols):
+        # listings, delistings and a suspension leave gaps in the panel
+        symbol_dates = dates[rng.integers(0, 100):len(dates) - rng.integers(0, 50)]
+        if i == 1:
+            symbol_dates = symbol_dates[:100].append(symbol_dates[120:])
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, len(symbol_dates))))
+        df_dict[f'S{i}'] = pd.DataFrame({
+            'high': close * (1 + np.abs(rng.normal(0, 0.01, len(symbol_dates)))),
+            'low': close * (1 - np.abs(rng.normal(0, 0.01, len(symbol_dates)))),
+            'close': close,
+            'volume': rng.integers(10 ** 5, 10 ** 7, len(symbol_dates)).astype(float),
+        }, index=symbol_dates)
+    return df_dict
+
+
+class TestPanelHelper(unittest.TestCase):
+    def setUp(self):
+        self.df_dict = make_df_dict()
+        self.symbols, self.dates, self.panel = build_panel(self.df_dict, ['high', 'low', 'close', 'volume'])
+
+    def assert_matches(self, panel_values, expected, tolerance=0.0):
+        for row, symbol in enumerate(self.symbols):
+            df = self.df_dict[symbol]
+            values = pd.Series(panel_values[row], index=self.dates)
+            self.assertTrue(values.drop(df.index).isna().all())
+            np.testing.assert_allclose(values.loc[df.index].values, np.asarray(expected(df), dtype=float),
+                                       rtol=tolerance, atol=tolerance)
+
+    def test_build_panel(self):
+        self.assertEqual(self.panel['close'].shape, (len(self.df_dict), len(self.dates)))
+        df = self.df_dict['S1']
+        np.testing.assert_array_equal(pd.Series(self.panel['close'][1], index=self.dates).loc[df.index], df['close'])
+
+    def test_rsi_mfi_macd_match_talib(self):
+        self.assert_matches(calculate_panel_rsi(self.panel['close']),
+                            lambda df: talib.RSI(df['close'], timeperiod=14), tolerance=1e-12)
+        self.assert_matches(
+            calculate_panel_mfi(self.panel['high'], self.panel['low'], self.panel['close'], self.panel['volume']),
+            lambda df: talib.MFI(df['high'], df['low'], df['close'], df['volume'], timeperiod=14))
+        macd = calculate_panel_macd(self.panel['close'])
+        for i in range(3):
+            self.assert_matches(macd[i], lambda df: talib.MACD(df['close'], 12, 26, 9)[i], tolerance=1e-12)
+
+    def test_rmi_matches_calculate_rmi(self):
+        self.assert_matches(calculate_panel_rmi(self.panel['close']), lambda df: calculate_rmi(df['close'], 14, 5))
+
+    def test_ichimoku_matches_calculate_ichimoku(self):
+        ichimoku = calculate_panel_ichimoku(self.panel['high'], self.panel['low'], 7, 22, 44)
+        for line in ichimoku_lines:
+            self.assert_matches(ichimoku[line], lambda df: calculate_ichimoku(df.copy(), False, 7, 22, 44)[line])
+
+
+if __name__ == '__main__':
+    unittest.main()
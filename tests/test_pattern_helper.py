@@ -0,0 +1,70 @@
+import json
+import unittest
+import numpy as np
+import pandas as pd
+
+from tools.pattern_helper import IchimokuState, calculate_ichimoku, calculate_ichimoku_sweep, ichimoku_lines
+
+
+def make_bars(seed=0, n=300):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    df = pd.DataFrame({
+        'high': close * (1 + np.abs(rng.normal(0, 0.01, n))),
+        'low': close * (1 - np.abs(rng.normal(0, 0.01, n))),
+        'close': close,
+    }, index=pd.bdate_range('2019-01-01', periods=n))
+    df.iloc[120, 0] = np.nan
+    df.iloc[200, 1] = np.nan
+    return df
+
+
+class TestIchimokuState(unittest.TestCase):
+    def setUp(self):
+        self.df = make_bars()
+        self.expected = calculate_ichimoku(self.df)[IchimokuState.columns]
+
+    def test_matches_calculate_ichimoku(self):
+        streamed = IchimokuState().update_batch(self.df)
+        pd.testing.assert_frame_equal(streamed, self.expected, check_exact=True)
+
+        state = IchimokuState(conversion_period=5, base_period=10, span_b_period=20)
+        expected = calculate_ichimoku(self.df, conversion_period=5, base_period=10, span_b_period=20)
+        pd.testing.assert_frame_equal(state.update_batch(self.df), expected[IchimokuState.columns], check_exact=True)
+
+    def test_update_returns_latest_bar(self):
+        state = IchimokuState()
+        for date, row in self.df.iterrows():
+            values = state.update(row['high'], row['low'])
+        self.assertEqual(values, self.expected.iloc[-1].to_dict())
+
+    def test_resume_from_serialized_state(self):
+        state = IchimokuState()
+        head = state.update_batch(self.df.iloc[:150])
+        state = IchimokuState.from_dict(json.loads(json.dumps(state.to_dict())))
+        tail = state.update_batch(self.df.iloc[150:])
+        pd.testing.assert_frame_equal(pd.concat([head, tail]), self.expected, check_exact=True)
+
+
+class TestIchimokuSweep(unittest.TestCase):
+    def setUp(self):
+        self.df = make_bars(n=250)
+        self.period_grid = [(9, 26, 52), (5, 10, 20), (7, 30, 60), (9, 26, 130), (26, 9, 52)]
+
+    def test_matches_calculate_ichimoku(self):
+        result = calculate_ichimoku_sweep(self.df, self.period_grid)
+        self.assertEqual(result.shape, (len(self.period_grid), len(self.df), 4))
+        for i, (conversion_period, base_period, span_b_period) in enumerate(self.period_grid):
+            expected = calculate_ichimoku(self.df.copy(), conversion_period=conversion_period,
+                                          base_period=base_period, span_b_period=span_b_period)
+            np.testing.assert_array_equal(result[i], expected[ichimoku_lines].to_numpy())
+
+    def test_as_frame(self):
+        frame = calculate_ichimoku_sweep(self.df, self.period_grid, as_frame=True)
+        self.assertEqual(frame.columns.names, ['conversion_period', 'base_period', 'span_b_period', 'line'])
+        expected = calculate_ichimoku(self.df.copy(), conversion_period=5, base_period=10, span_b_period=20)
+        pd.testing.assert_frame_equal(frame[(5, 10, 20)], expected[ichimoku_lines], check_names=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
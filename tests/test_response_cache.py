@@ -0,0 +1,78 @@
+import os
+import tempfile
+import time
+import unittest
+
+from tools.response_cache import CacheMissError, ResponseCache, request_key
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp.name
+        self.params = {'function': 'TIME_SERIES_DAILY_ADJUSTED', 'symbol': 'IBM', 'outputsize': 'full'}
+        self.payload = {'Meta Data': {'2. Symbol': 'IBM'}, 'Time Series (Daily)': {'2024-01-02': {'4. close': '1'}}}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_request_key(self):
+        key = request_key('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM', self.params)
+        # credentials and the order of the parameters do not change the key
+        self.assertEqual(key, request_key('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM',
+                                          dict(reversed(list(self.params.items())), apikey='secret')))
+        self.assertNotEqual(key, request_key('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM',
+                                             dict(self.params, outputsize='compact')))
+        self.assertNotEqual(key, request_key('finviz', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM', self.params))
+
+    def test_get_put(self):
+        cache = ResponseCache(self.cache_dir)
+        self.assertIsNone(cache.get('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM', self.params))
+        cache.put('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM', self.params, self.payload)
+        self.assertEqual(cache.get('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM', self.params), self.payload)
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['entries'], 1)
+
+    def test_ttl_and_offline(self):
+        cache = ResponseCache(self.cache_dir, ttl=3600)
+        cache.put('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM', self.params, self.payload)
+        path = cache._entries()[0][1]
+        two_hours_ago = time.time() - 7200
+        os.utime(path, (two_hours_ago, two_hours_ago))
+        self.assertIsNone(cache.get('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM', self.params))
+
+        # offline the expired response is still served and a missing one is an error
+        offline_cache = ResponseCache(self.cache_dir, ttl=3600, offline=True)
+        self.assertEqual(offline_cache.get('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM', self.params),
+                         self.payload)
+        with self.assertRaises(CacheMissError):
+            offline_cache.get('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'MSFT', self.params)
+
+    def test_evict(self):
+        cache = ResponseCache(self.cache_dir)
+        for i, symbol in enumerate(['A', 'B', 'C']):
+            cache.put('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', symbol, self.params, self.payload)
+            path = cache._path('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', symbol, self.params)
+            os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+        size = cache.stats['bytes'] // 3
+        cache.max_bytes = 2 * size
+        cache.evict()
+        self.assertEqual(cache.evictions, 1)
+        # the oldest response is removed first
+        self.assertIsNone(cache.get('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'A', self.params))
+        self.assertIsNotNone(cache.get('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'C', self.params))
+        self.assertEqual(cache.invalidate('alpha_vantage'), 2)
+
+    def test_evict_on_put(self):
+        cache = ResponseCache(self.cache_dir)
+        cache.put('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'A', self.params, self.payload)
+        # the running total of the written bytes evicts once the cache outgrows max_bytes
+        cache.max_bytes = int(3.5 * cache.stats['bytes'])
+        for symbol in ['B', 'C']:
+            cache.put('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', symbol, self.params, self.payload)
+        self.assertEqual(cache.evictions, 0)
+        cache.put('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'D', self.params, self.payload)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'A', self.params))
+        self.assertEqual(cache.stats['bytes'], cache._bytes)
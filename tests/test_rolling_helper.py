@@ -0,0 +1,63 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from tools.rolling_helper import rolling_calendar_extrema, rolling_window_extremum
+
+
+class TestRollingCalendarExtrema(unittest.TestCase):
+    def test_matches_pandas_rolling(self):
+        rng = np.random.default_rng(0)
+        index = pd.bdate_range('2010-01-01', '2015-12-31', tz='US/Eastern')
+        # drop random days to get irregular gaps, as holidays do
+        index = index[rng.random(len(index)) > 0.1] + pd.Timedelta(hours=16)
+        close = pd.Series(rng.normal(100, 10, len(index)), index=index)
+        close.iloc[rng.integers(0, len(index), 50)] = np.nan
+        close.iloc[100:130] = np.nan
+
+        windows_days = [1, 5, 14, 28, 365, 1000]
+        rolling_max, rolling_min = rolling_calendar_extrema(close.values, close.index, windows_days)
+
+        for column, days in enumerate(windows_days):
+            expected_max = close.rolling(window=f'{days}D').max().values
+            expected_min = close.rolling(window=f'{days}D').min().values
+            np.testing.assert_array_equal(rolling_max[:, column], expected_max)
+            np.testing.assert_array_equal(rolling_min[:, column], expected_min)
+
+    def test_requires_sorted_index(self):
+        index = pd.DatetimeIndex(['2020-01-02', '2020-01-01'])
+        with self.assertRaises(ValueError):
+            rolling_calendar_extrema([1.0, 2.0], index, [14])
+
+
+class TestRollingWindowExtremum(unittest.TestCase):
+    def test_matches_pandas_rolling(self):
+        rng = np.random.default_rng(1)
+        values = pd.Series(rng.normal(100, 10, 300))
+        values.iloc[rng.integers(0, 300, 10)] = np.nan
+
+        windows = [1, 2, 9, 26, 52, 64, 400]
+        rolling_max = rolling_window_extremum(values.values, windows, np.maximum)
+        rolling_min = rolling_window_extremum(values.values, windows, np.minimum)
+        for column, window in enumerate(windows):
+            np.testing.assert_array_equal(rolling_max[:, column], values.rolling(window).max().values)
+            np.testing.assert_array_equal(rolling_min[:, column], values.rolling(window).min().values)
+
+    def test_rolls_down_the_rows(self):
+        rng = np.random.default_rng(2)
+        values = pd.DataFrame(rng.normal(100, 10, (120, 4)))
+        values.iloc[rng.integers(0, 120, 6), rng.integers(0, 4, 6)] = np.nan
+
+        windows = [3, 26, 52]
+        rolling_max = rolling_window_extremum(values.values, windows, np.maximum)
+        self.assertEqual(rolling_max.shape, (120, 3, 4))
+        for column, window in enumerate(windows):
+            np.testing.assert_array_equal(rolling_max[:, column], values.rolling(window).max().values)
+
+    def test_requires_positive_windows(self):
+        with self.assertRaises(ValueError):
+            rolling_window_extremum([1.0, 2.0], [0], np.maximum)
+
+
+if __name__ == '__main__':
+    unittest.main()
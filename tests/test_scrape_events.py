@@ -0,0 +1,235 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from tools.response_cache import ResponseCache
+from tools.scrape_events import EventBatchWriter, main, parse_quote_page, write_events
+
+fixture_path = os.path.join(os.path.dirname(__file__), 'fixtures', 'finviz_quote.html')
+with open(fixture_path) as f:
+    quote_page = f.read()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Stand-in for Finviz serving the saved quote page to a logged in session."""
+    def log_message(self, *args):
+        pass
+
+    def redirect(self, location, cookie=None):
+        self.send_response(302)
+        self.send_header('Location', location)
+        if cookie:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        with self.server.lock:
+            self.server.logins += 1
+        if form.get('email') == ['user'] and form.get('password') == ['secret']:
+            self.redirect('/', 'session=ok; Path=/')
+        else:
+            self.redirect('/login.ashx')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/quote.ashx':
+            return self.send_page(url.path)
+        if 'session=ok' not in self.headers.get('Cookie', ''):
+            return self.redirect('/login.ashx')
+        server = self.server
+        symbol = parse_qs(url.query)['t'][0]
+        with server.lock:
+            server.open_requests += 1
+            server.max_open_requests = max(server.max_open_requests, server.open_requests)
+            server.calls[symbol] = server.calls.get(symbol, 0) + 1
+            calls = server.calls[symbol]
+        time.sleep(0.05)
+        with server.lock:
+            server.open_requests -= 1
+        if symbol == 'BUSY' and calls == 1:
+            self.send_response(429)
+            self.end_headers()
+            return
+        page = quote_page.replace('TICKER', symbol) if symbol != 'MISSING' else '<html>Not found</html>'
+        self.send_page(page)
+
+    def send_page(self, page):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.end_headers()
+        self.wfile.write(page.encode())
+
+
+class TestScrapeEvents(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.logins = 0
+        self.server.open_requests = 0
+        self.server.max_open_requests = 0
+        self.server.calls = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.fetcher_kwargs = {
+            'url': f'{base_url}/quote.ashx',
+            'login_url': f'{base_url}/login_submit.ashx',
+            'requests_per_minute': 6000,
+            'concurrency': 3,
+            'backoff': 0.01,
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_parse_quote_page(self):
+        data = parse_quote_page(quote_page)
+        self.assertEqual(data['ticker'], 'TICKER')
+        self.assertEqual([event['eventType'] for event in data['chartEvents']],
+                         ['chartEvent/earnings', 'chartEvent/dividends', 'chartEvent/split'])
+        with self.assertRaises(ValueError):
+            parse_quote_page('<html>Not found</html>')
+
+    def test_main_http(self):
+        symbols = [f'S{i}' for i in range(8)] + ['BUSY', 'MISSING']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'events.h5')
+            failed_symbols = main(symbols, save_type='hdf5', path=path, username='user', password='secret',
+                                  **self.fetcher_kwargs)
+            with pd.HDFStore(path, mode='r') as store:
+                events = {key.split('/')[-1]: store[key] for key in store.keys()}
+
+        self.assertEqual(list(failed_symbols), ['MISSING'])
+        self.assertEqual(sorted(events), sorted(set(symbols) - {'MISSING'}))
+        self.assertEqual(events['S0']['eventType'].tolist()[-1], 'chartEvent/split')
+        self.assertEqual(events['S0']['dateTimestamp'].iloc[-1], pd.Timestamp('2020-08-31'))
+        # one login for all pages, the throttled page is retried once
+        self.assertEqual(self.server.logins, 1)
+        self.assertEqual(self.server.calls['BUSY'], 2)
+        self.assertLessEqual(self.server.max_open_requests, 3)
+        self.assertGreater(self.server.max_open_requests, 1)
+
+    def test_failed_login(self):
+        with tempfile.TemporaryDirectory() as directory:
+            failed_symbols = main(['S0', 'S1'], save_type='hdf5', path=os.path.join(directory, 'events.h5'),
+                                  username='user', password='wrong', **self.fetcher_kwargs)
+        self.assertEqual(sorted(failed_symbols), ['S0', 'S1'])
+        self.assertIn('login failed', failed_symbols['S0'])
+        # the login is not posted again for the second ticker
+        self.assertEqual(self.server.logins, 1)
+        self.assertEqual(self.server.calls, {})
+
+
+type_to_table = {
+    'chartEvent/earnings': 'earnings',
+    'chartEvent/dividends': 'dividends',
+    'chartEvent/split': 'split',
+}
+
+
+def chart_events(extra_events=()):
+    events = pd.DataFrame(parse_quote_page(quote_page)['chartEvents'] + list(extra_events))
+    events['dateTimestamp'] = pd.to_datetime(events['dateTimestamp'], unit='s')
+    return events
+
+
+class TestEventBatchWriter(unittest.TestCase):
+    def setUp(self):
+        self.written = []
+
+        def bulk_upsert(cur, df, table, **kwargs):
+            self.written.append((table, df))
+            return len(df)
+
+        patcher = mock.patch('tools.scrape_events.bulk_upsert', side_effect=bulk_upsert)
+        self.bulk_upsert = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_write_events(self):
+        unknown_events = Counter()
+        events = chart_events([{'eventType': 'chartEvent/unknown', 'dateTimestamp': 1598832000}])
+        row_count = write_events(mock.Mock(), events.assign(ticker_id=7), type_to_table, unknown_events)
+
+        self.assertEqual(row_count, 3)
+        self.assertEqual(unknown_events, Counter({'chartEvent/unknown': 1}))
+        tables = dict(self.written)
+        self.assertEqual(list(tables), ['earnings', 'dividends', 'split'])
+        self.assertEqual(list(tables['earnings'].columns), [
+            'ticker_id', 'date_timestamp', 'fiscal_period', 'fiscal_end_date', 'eps_actual', 'eps_estimate',
+            'eps_reported_actual', 'eps_reported_estimate', 'sales_actual', 'sales_estimate'])
+        self.assertEqual(tables['earnings']['eps_actual'].tolist(), [1.46])
+        self.assertEqual(tables['dividends'].columns.tolist(), ['ticker_id', 'date_timestamp', 'ordinary', 'special'])
+        self.assertEqual(tables['split'][['factor_from', 'factor_to']].values.tolist(), [[1, 4]])
+        self.assertEqual(tables['split']['date_timestamp'].tolist(), [pd.Timestamp('2020-08-31')])
+        # existing events are kept
+        for call in self.bulk_upsert.call_args_list:
+            self.assertEqual(call.kwargs, {'conflict_columns': ('ticker_id', 'date_timestamp'), 'update': False})
+
+    def test_batch(self):
+        conn, cur = mock.Mock(), mock.Mock()
+        cur.fetchall.return_value = [('AAA', 1), ('BBB', 2)]
+        writer = EventBatchWriter(conn, cur, type_to_table, batch_size=3)
+        writer('AAA', chart_events([{'eventType': 'chartEvent/unknown', 'dateTimestamp': 1598832000}]))
+        writer('BBB', chart_events())
+        self.assertEqual(self.written, [])
+        writer('NOPE', chart_events())
+
+        # one COPY per event type for the batch and one commit
+        self.assertEqual([table for table, _ in self.written], ['earnings', 'dividends', 'split'])
+        for _, df in self.written:
+            self.assertEqual(df['ticker_id'].tolist(), [1, 2])
+        conn.commit.assert_called_once()
+        self.assertEqual(writer.unknown_events, Counter({'chartEvent/unknown': 1}))
+        self.assertEqual(writer.failed_symbols, {'NOPE': 'Ticker not found'})
+
+    def test_failed_batch(self):
+        conn, cur = mock.Mock(), mock.Mock()
+        cur.fetchall.return_value = [('AAA', 1)]
+        self.bulk_upsert.side_effect = ValueError('COPY failed')
+        writer = EventBatchWriter(conn, cur, type_to_table)
+        writer('AAA', chart_events())
+        with self.assertRaises(Exception):
+            writer.flush()
+        conn.rollback.assert_called_once()
+        self.assertEqual(writer.failed_symbols, {'AAA': 'COPY failed'})
+
+    def test_main_selenium_records_failed_batches(self):
+        conn, cur = mock.Mock(), mock.Mock()
+        cur.fetchall.side_effect = [[('BBB', 2)], [('AAA', 1)]]
+
+        def bulk_upsert(cur, df, table, **kwargs):
+            if (df['ticker_id'] == 2).any():
+                raise ValueError('COPY failed')
+            return len(df)
+        self.bulk_upsert.side_effect = bulk_upsert
+
+        class SingleTickerWriter(EventBatchWriter):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs, batch_size=1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            # the pages are served from the cache, so no browser is started
+            cache = ResponseCache(directory)
+            for symbol in ['AAA', 'BBB']:
+                cache.put('finviz', 'quote', symbol, {'p': 'd'}, parse_quote_page(quote_page))
+            with mock.patch('tools.scrape_events.EventBatchWriter', SingleTickerWriter):
+                failed_symbols = main(['BBB', 'AAA'], save_type='psql', conn=conn, cur=cur, cache=cache,
+                                      backend='selenium', tables={'earnings_table': 'earnings',
+                                                                  'dividends_table': 'dividends',
+                                                                  'split_table': 'split'})
+        self.assertEqual(list(failed_symbols), ['BBB'])
+        self.assertIn('COPY failed', failed_symbols['BBB'])
+        conn.commit.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from tools.data_helper import filter_data, get_signal_index
+from tools.pattern_helper import convert_to_polarity
+from tools.signal_helper import SignalRule, register_signal_rule, signal_rules
+
+
+def make_signal_df(seed, n=500):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'crossover_indicator': rng.choice([-1.0, 0.0, 1.0, np.nan], n),
+        'crossover_difference': rng.normal(size=n),
+        'close_diff_senkou_span_a_percent': rng.normal(size=n),
+        'close_diff_senkou_span_b_percent': rng.normal(size=n),
+    }, index=pd.bdate_range('2020-01-01', periods=n))
+    df.iloc[::7, 2] = np.nan
+    return df
+
+
+class TestSignalRules(unittest.TestCase):
+    def setUp(self):
+        self.df = make_signal_df(0)
+
+    def test_builtin_rules_match_boolean_masks(self):
+        df = self.df
+        bullish = (
+                (df['crossover_indicator'] == -1) &
+                (df['crossover_difference'] > 0) &
+                (df['close_diff_senkou_span_a_percent'] > 0) &
+                (df['close_diff_senkou_span_b_percent'] > 0)
+        )
+        bearish = (
+                (df['crossover_indicator'] == -1) &
+                (df['crossover_difference'] < 0) &
+                (df['close_diff_senkou_span_a_percent'] < 0) &
+                (df['close_diff_senkou_span_b_percent'] < 0)
+        )
+        expected = {
+            'bullish_cloud_crossover': bullish,
+            'bearish_cloud_crossover': bearish,
+            'bullish_and_bearish_cloud_crossover': bullish | bearish,
+        }
+        for name, mask in expected.items():
+            self.assertGreater(mask.sum(), 0)
+            pd.testing.assert_series_equal(get_signal_index(df, name), mask)
+            numpy_rule = SignalRule(signal_rules[name].expression, use_numexpr=False)
+            pd.testing.assert_series_equal(numpy_rule(df), mask)
+        pd.testing.assert_frame_equal(filter_data(df), df.loc[bullish])
+
+    def test_precedence_and_keywords(self):
+        df = self.df
+        rule = SignalRule('not crossover_difference > 0 and (crossover_indicator == 1 or crossover_indicator != -1)')
+        expected = ~(df['crossover_difference'] > 0) & (
+                (df['crossover_indicator'] == 1) | (df['crossover_indicator'] != -1))
+        pd.testing.assert_series_equal(rule(df), expected)
+        self.assertEqual(rule.columns, ['crossover_difference', 'crossover_indicator'])
+
+        rule = SignalRule('close_diff_senkou_span_a_percent >= close_diff_senkou_span_b_percent | ~(1e-1 < crossover_difference)')
+        expected = (df['close_diff_senkou_span_a_percent'] >= df['close_diff_senkou_span_b_percent']) | ~(
+                0.1 < df['crossover_difference'])
+        pd.testing.assert_series_equal(rule(df), expected)
+
+    def test_panel_evaluation(self):
+        df_dict = {'/prices/A': self.df, '/prices/B': make_signal_df(1, n=321), '/prices/C': self.df.iloc[:0]}
+        signals = signal_rules['bullish_cloud_crossover'].evaluate_panel(df_dict)
+        self.assertEqual(list(signals.keys()), list(df_dict.keys()))
+        for key, df in df_dict.items():
+            pd.testing.assert_series_equal(signals[key], get_signal_index(df, 'bullish_cloud_crossover'))
+
+    def test_registration_and_errors(self):
+        register_signal_rule('test_positive_difference', 'crossover_difference > 0')
+        pd.testing.assert_series_equal(get_signal_index(self.df, 'test_positive_difference'),
+                                       self.df['crossover_difference'] > 0, check_names=False)
+        signal_rules.pop('test_positive_difference')
+        with self.assertRaises(Exception):
+            get_signal_index(self.df, 'not_a_rule')
+        for expression in ['crossover_difference >', 'crossover_difference & 1', '(a > 0', 'a > 0 b', 'a $ 1']:
+            with self.assertRaises(Exception):
+                SignalRule(expression)
+
+    def test_vectorized_polarity(self):
+        values = pd.Series([2.5, -0.1, 0.0, -0.0, np.nan, 7.0])
+        pd.testing.assert_series_equal(convert_to_polarity(values), values.apply(convert_to_polarity))
+        self.assertEqual(list(np.signbit(convert_to_polarity(values.values))), [False, True, False, False, False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
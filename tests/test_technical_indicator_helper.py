@@ -0,0 +1,47 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from tools.technical_indicator_helper import TI_WARMUP_ROWS, calculate_technical_indicators, needs_full_recompute
+
+
+def make_adjusted_quotes(n=1500, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'date': pd.bdate_range('2015-01-01', periods=n).date,
+        'open': close * (1 + rng.normal(0, 0.005, n)),
+        'high': close * (1 + np.abs(rng.normal(0, 0.01, n))),
+        'low': close * (1 - np.abs(rng.normal(0, 0.01, n))),
+        'close': close,
+        'volume': rng.integers(10 ** 5, 10 ** 7, n).astype(float),
+    })
+
+
+class TestTechnicalIndicatorHelper(unittest.TestCase):
+    def test_warmup_matches_full_history(self):
+        df = make_adjusted_quotes()
+        full_ti_df = calculate_technical_indicators(df)
+        self.assertEqual(full_ti_df.columns[0], 'id')
+        self.assertNotIn('close', full_ti_df.columns)
+
+        # rows after the watermark computed from the warm-up window only
+        last_processed = 1400
+        window = df.iloc[last_processed - TI_WARMUP_ROWS:].reset_index(drop=True)
+        ti_df = calculate_technical_indicators(window).iloc[TI_WARMUP_ROWS:]
+        expected = full_ti_df.iloc[last_processed:]
+        self.assertFalse(ti_df.isna().any().any())
+        np.testing.assert_allclose(ti_df.to_numpy(dtype=float), expected.to_numpy(dtype=float), rtol=1e-10)
+
+    def test_needs_full_recompute(self):
+        self.assertTrue(needs_full_recompute(None, 1.0, 10))
+        watermark = ('2020-01-02', 10, 2.0, 10)
+        self.assertFalse(needs_full_recompute(watermark, 2.0, 10))
+        # a new split or quotes added before the last processed date
+        self.assertTrue(needs_full_recompute(watermark, 4.0, 10))
+        self.assertTrue(needs_full_recompute(watermark, 2.0, 11))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,260 @@
+import time
+import pandas as pd
+
+from tools.database_helper import create_month_partitions, is_partitioned
+
+# session hours of the US/Eastern timestamps of Alpha Vantage, bars are labelled by their start
+sessions = {
+    'regular': ('09:30', '16:00'),
+    'extended': ('04:00', '20:00'),
+}
+bar_columns = ['open', 'high', 'low', 'close', 'volume', 'bar_count']
+
+
+def bar_interval(interval):
+    """Length of the bars of an interval such as '5min', '60min' or '1day'."""
+    return pd.Timedelta(interval.replace('day', 'D'))
+
+
+def bar_origin(interval, session='regular'):
+    """
+    Timestamp the bars are aligned to: intraday bars of the regular session start at the open, extended session
+    bars at the start of the pre-market and daily bars at midnight.
+    """
+    if bar_interval(interval) >= pd.Timedelta('1D'):
+        return pd.Timestamp('2000-01-03')
+    return pd.Timestamp(f'2000-01-03 {sessions[session][0]}')
+
+
+def in_session(index, session='regular'):
+    """Boolean mask of the timestamps within the session hours."""
+    start, end = sessions[session]
+    minutes = index.hour * 60 + index.minute
+    start_hour, start_minute = map(int, start.split(':'))
+    end_hour, end_minute = map(int, end.split(':'))
+    return (minutes >= start_hour * 60 + start_minute) & (minutes < end_hour * 60 + end_minute)
+
+
+def aggregate_bars(df, interval, session='regular'):
+    """
+    Aggregate OHLCV bars of one ticker to a longer interval.
+
+    Bars outside the session are left out. Only bins holding bars are returned, so there are no empty bars
+    overnight, on weekends or on holidays.
+
+    Args:
+        df: pandas DataFrame with the columns open, high, low, close and volume indexed by the bar start time,
+            e.g. the 1min quotes of get_ticker_data.create_intraday_table
+        interval: str, interval of the aggregated bars, e.g. '15min' or '1day'
+        session: str, 'regular' or 'extended' (default is 'regular')
+
+    Returns:
+        pandas DataFrame with the columns open, high, low, close, volume and bar_count (number of aggregated bars)
+        indexed by the bar start time
+    """
+    df = df.sort_index()
+    df = df[in_session(df.index, session)]
+    length = bar_interval(interval)
+    origin = bar_origin(interval, session)
+    bins = origin + (df.index - origin) // length * length
+    bars = df.groupby(bins, sort=True).agg(
+        open=('open', 'first'),
+        high=('high', 'max'),
+        low=('low', 'min'),
+        close=('close', 'last'),
+        volume=('volume', 'sum'),
+        bar_count=('close', 'size'),
+    )
+    bars.index.name = df.index.name
+    return bars
+
+
+def bar_table_name(table_prefix, interval, session='regular'):
+    suffix = '' if session == 'regular' else f'_{session}'
+    return f'{table_prefix}_bars_{interval}{suffix}'
+
+
+def create_bar_tables(conn, cur, source_table, intervals, session='regular', table_prefix='stock_quotes',
+                      reference_table='tickers'):
+    """
+    Create the tables of the bars aggregated from an intraday table and the watermark table of the aggregation.
+
+    The bar tables are partitioned by month like the intraday tables. A BRIN index on the metadata_id of the
+    source table finds the quotes saved after the watermark, as quotes are appended in the order they are saved.
+
+    Returns:
+        dict of the bar tables keyed by interval
+    """
+    watermark_table = f'{table_prefix}_bars_watermark'
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {watermark_table} (
+            bar_table TEXT PRIMARY KEY,
+            source_table TEXT NOT NULL,
+            last_metadata_id INT NOT NULL
+        );
+    """)
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS {source_table}_metadata_brin ON {source_table} USING brin (metadata_id)
+    """)
+    bar_tables = {}
+    for interval in intervals:
+        bar_table = bar_table_name(table_prefix, interval, session)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {bar_table} (
+                ticker_id INT NOT NULL,
+                datetime TIMESTAMP NOT NULL,
+                open FLOAT,
+                high FLOAT,
+                low FLOAT,
+                close FLOAT,
+                volume BIGINT,
+                bar_count INT NOT NULL,
+                FOREIGN KEY (ticker_id) REFERENCES {reference_table}(ticker_id),
+                PRIMARY KEY (ticker_id, datetime)
+            ) PARTITION BY RANGE (datetime);
+        """)
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS {bar_table}_datetime_brin ON {bar_table} USING brin (datetime)
+        """)
+        bar_tables[interval] = bar_table
+    conn.commit()
+    return bar_tables
+
+
+def update_bars(conn, cur, source_table, bar_table, interval, session='regular', table_prefix='stock_quotes',
+                full=False):
+    """
+    Bring the bars of an interval aggregated from an intraday table up to date.
+
+    The watermark table remembers the last metadata id of the source quotes that were aggregated. Every quote
+    saved since then belongs to a metadata row with a higher id, whether it extends the history or fills an
+    older month. Only the days of the tickers holding such quotes are aggregated again from all their source
+    quotes, in a single statement binning the quotes with date_bin (PostgreSQL 14 or later). Quotes committed by another connection
+    with a lower metadata id after the update are picked up by the next full update.
+
+    Args:
+        source_table: str, intraday table, e.g. 'stock_quotes_1min'
+        bar_table: str, table of create_bar_tables
+        interval: str, interval of the bars, e.g. '15min' or '1day'
+        session: str, 'regular' or 'extended' (default is 'regular')
+        full: boolean, aggregate every source quote (default is False)
+
+    Returns:
+        int, number of written bars
+    """
+    start = time.perf_counter()
+    watermark_table = f'{table_prefix}_bars_watermark'
+    cur.execute(f"SELECT last_metadata_id FROM {watermark_table} WHERE bar_table = %s", (bar_table,))
+    row = cur.fetchone()
+    last_metadata_id = 0 if full or row is None else row[0]
+    cur.execute(f"SELECT coalesce(max(metadata_id), 0) FROM {table_prefix}_metadata")
+    new_metadata_id = cur.fetchone()[0]
+
+    session_start, session_end = sessions[session]
+    params = {
+        'length': bar_interval(interval).to_pytimedelta(),
+        'origin': bar_origin(interval, session).to_pydatetime(),
+        'session_start': session_start,
+        'session_end': session_end,
+        'last_metadata_id': last_metadata_id,
+        'new_metadata_id': new_metadata_id,
+    }
+
+    def session_filter(alias):
+        return f'{alias}datetime::time >= %(session_start)s::time AND {alias}datetime::time < %(session_end)s::time'
+
+    # the sessions end before midnight, so the bars of a day hold the quotes of that day only and the stale bars
+    # are found as one range of quotes per ticker and day
+    cur.execute(f"""
+        CREATE TEMP TABLE stale_days ON COMMIT DROP AS
+        SELECT DISTINCT ticker_id, date_trunc('day', datetime) AS day
+        FROM {source_table}
+        WHERE metadata_id > %(last_metadata_id)s AND metadata_id <= %(new_metadata_id)s AND {session_filter('')}
+    """, params)
+    cur.execute("ANALYZE stale_days")
+    if is_partitioned(cur, bar_table):
+        cur.execute("SELECT DISTINCT date_trunc('month', day) FROM stale_days")
+        create_month_partitions(cur, bar_table, [month for month, in cur.fetchall()])
+    cur.execute(f"""
+        WITH bars AS (
+            SELECT
+                q.ticker_id,
+                date_bin(%(length)s, q.datetime, %(origin)s) AS datetime,
+                (array_agg(q.open ORDER BY q.datetime))[1] AS open,
+                max(q.high) AS high,
+                min(q.low) AS low,
+                (array_agg(q.close ORDER BY q.datetime DESC))[1] AS close,
+                sum(q.volume) AS volume,
+                count(*) AS bar_count
+            FROM
+                stale_days AS s
+                INNER JOIN {source_table} AS q ON q.ticker_id = s.ticker_id
+                    AND q.datetime >= s.day AND q.datetime < s.day + interval '1 day'
+            WHERE
+                {session_filter('q.')}
+            GROUP BY
+                1, 2
+        ), upserted_bars AS (
+            INSERT INTO {bar_table} (ticker_id, datetime, open, high, low, close, volume, bar_count)
+            SELECT ticker_id, datetime, open, high, low, close, volume, bar_count FROM bars
+            ON CONFLICT (ticker_id, datetime) DO UPDATE SET
+            open = EXCLUDED.open,
+            high = EXCLUDED.high,
+            low = EXCLUDED.low,
+            close = EXCLUDED.close,
+            volume = EXCLUDED.volume,
+            bar_count = EXCLUDED.bar_count
+            RETURNING 1
+        ), upserted_watermark AS (
+            INSERT INTO {watermark_table} (bar_table, source_table, last_metadata_id)
+            VALUES (%(bar_table)s, %(source_table)s, %(new_metadata_id)s)
+            ON CONFLICT (bar_table) DO UPDATE SET
+            source_table = EXCLUDED.source_table,
+            last_metadata_id = EXCLUDED.last_metadata_id
+        )
+        SELECT count(*) FROM upserted_bars
+    """, {**params, 'bar_table': bar_table, 'source_table': source_table})
+    row_count = cur.fetchone()[0]
+    conn.commit()
+    seconds = time.perf_counter() - start
+    print(f'{bar_table}: {row_count} bars aggregated from {source_table} in {seconds:.2f} s')
+    return row_count
+
+
+def update_all_bars(conn, cur, source_interval='1min', intervals=('5min', '15min', '30min', '60min', '1day'),
+                    sessions_to_update=('regular',), table_prefix='stock_quotes', reference_table='tickers',
+                    full=False):
+    """
+    Aggregate the quotes of the finest stored interval to every interval and session.
+
+    Returns:
+        dict of the number of written bars keyed by bar table
+    """
+    source_table = f'{table_prefix}_{source_interval}'
+    row_counts = {}
+    for session in sessions_to_update:
+        bar_tables = create_bar_tables(conn, cur, source_table, intervals, session=session,
+                                       table_prefix=table_prefix, reference_table=reference_table)
+        for interval, bar_table in bar_tables.items():
+            row_counts[bar_table] = update_bars(conn, cur, source_table, bar_table, interval, session=session,
+                                                table_prefix=table_prefix, full=full)
+    return row_counts
+
+
+def get_bars(cur, bar_table, ticker_id, start=None, end=None):
+    """
+    Read the aggregated bars of a ticker, e.g. to calculate technical indicators on them.
+
+    Returns:
+        pandas DataFrame with the columns of aggregate_bars indexed by datetime
+    """
+    cur.execute(f"""
+        SELECT datetime, {', '.join(bar_columns)}
+        FROM {bar_table}
+        WHERE ticker_id = %s AND datetime >= coalesce(%s, '-infinity'::timestamp)
+            AND datetime < coalesce(%s, 'infinity'::timestamp)
+        ORDER BY datetime
+    """, (ticker_id, start, end))
+    df = pd.DataFrame(cur.fetchall(), columns=['datetime'] + bar_columns).set_index('datetime')
+    df.index = pd.to_datetime(df.index)
+    return df
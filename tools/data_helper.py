@@ -1,23 +1,32 @@
-import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import os
 import pandas as pd
-import pytz
 from statsmodels.tsa.stattools import adfuller
 import talib
 
+from tools.event_helper import align_event_dates, event_types, get_event_dates
+from tools.feature_cache import fingerprint
 from tools.json_helper import load_dict_from_json
 from tools.pattern_helper import convert_to_polarity, calculate_rmi
+from tools.rolling_helper import rolling_calendar_extrema
+from tools.signal_helper import get_signal_rule
+
+# Columns of the stored prices that the features are computed from
+REQUIRED_PRICE_COLUMNS = ['high', 'low', 'close', 'volume', 'dividend_amount',
+                          'tenkan_sen', 'kijun_sen', 'senkou_span_a', 'senkou_span_b']
+EVENT_COLUMNS = ['eventType', 'dateTimestamp']
+# Bars after which the seed of RSI, MACD and RMI has decayed below float precision
+RECURSIVE_INDICATOR_WARMUP_BARS = 400
 
 
 def days_since_earnings(date, earnings_dates):
     """Function to get days since last earnings date"""
     # TECH DEBT: confirm ET in earnings dates
     # TECH DEBT: need total trading days instead of calendar days.
-    past_earnings_dates = earnings_dates[earnings_dates <= date]
-    if not past_earnings_dates.empty:
-        last_earnings_date = past_earnings_dates.max()
-        return (date - last_earnings_date).days + 1
+    days_since, _ = align_event_dates([date], earnings_dates)
+    if days_since[0] == days_since[0]:
+        return int(days_since[0])
     else:
         return np.NaN
 
@@ -29,57 +38,75 @@ def get_dataframe_keys(data_path):
     return dataframe_keys
 
 
+def eastern_close_index(index):
+    """Treat naive dates as UTC, convert to eastern and set the end of trading day (4 PM EST)"""
+    eastern_time = pd.DatetimeIndex(index).tz_localize('UTC').tz_convert('US/Eastern')
+    # set 16:00:00 on the eastern wall clock date
+    end_of_day = eastern_time.tz_localize(None).normalize() + pd.Timedelta(hours=16)
+    return end_of_day.tz_localize('US/Eastern')
+
+
 def make_index_eastern(df):
     """Convert time to eastern and end of trading day (4 PM EST, ignore early trading day)"""
-    utc_time = pd.Series(df.index).apply(pytz.utc.localize)
-    eastern = pytz.timezone('US/Eastern')
-    eastern_time = utc_time.apply(lambda x: x.astimezone(eastern))
-    new_time = datetime.time(16, 0, 0)  # Setting time to 16:00:00
-    df.index = eastern_time.apply(
-        lambda x: x.replace(hour=new_time.hour, minute=new_time.minute, second=new_time.second)
-    )
+    df.index = eastern_close_index(df.index)
     return df
 
 
 def get_earnings_dates(df):
-    earnings_dates = df.loc[df['eventType'] == 'chartEvent/earnings', 'dateTimestamp']
-    # Make it timezone aware
-    utc_time = earnings_dates.apply(pytz.utc.localize)
-    # Eastern timezone
-    eastern = pytz.timezone('US/Eastern')
-    # Convert to Eastern Time
-    earnings_dates_eastern_time = utc_time.apply(lambda x: x.astimezone(eastern))
+    return get_event_dates(df, event_types['earnings'])
 
-    return earnings_dates_eastern_time
-
-
-def process_data(data_path, number_of_shifts=13, spy_number_of_shifts=13, shift_step=10):
-    week_multiplier = 2
-    high_low_rolling_calendar_days = range(week_multiplier * 7, 13 * week_multiplier * 7, week_multiplier * 7)
 
-    dropna_cols = [
-        'close_price_diff_1_day', 'crossover_indicator',
-        'rsi', 'rmi', 'mfi', 'macd', 'macd_signal', 'macd_hist', 'days_since_earnings',
-        'close_to_365_day_high', 'close_to_365_day_low',
-        'volume_percent_of_2_week_total', 'dividend_amount_to_close',
-    ]
+def get_warmup_days(number_of_shifts=13, shift_step=10):
+    """
+    Calendar days of raw history needed before the first bar whose features are wanted.
 
-    # Use reduced data file for testing
-    if os.environ.get('TEST_ENV') == 'true':
-        data_path = '../../../res/data/s_and_p_study_data_TESTING.h5'
+    Covers the 365 day rolling high/low, the largest shift and RECURSIVE_INDICATOR_WARMUP_BARS for
+    RSI, MACD and RMI. Ichimoku lines are stored with the prices and need no warm-up.
+    """
+    warmup_bars = max(number_of_shifts * shift_step, RECURSIVE_INDICATOR_WARMUP_BARS)
+    # about 252 trading days per 365 calendar days, plus two weeks for holidays
+    return max(365, int(np.ceil(warmup_bars * 365 / 252)) + 14)
 
-    s_and_p_details = pd.read_csv('../../../res/indices/s_and_p_500_details.csv', index_col=0)
 
-    dataframe_keys = get_dataframe_keys(data_path)
-    prices_dataframe_keys = [k for k in dataframe_keys if 'prices/' in k]
-    events_dataframe_keys = [k for k in dataframe_keys if 'events/' in k]
-    index_dataframe_keys = [k for k in dataframe_keys if 'indices/' in k]
+def load_frame(store, key, columns=None, start=None, end=None):
+    """
+    Load a table format frame, pushing the column selection and date range down to PyTables.
+
+    :param store: open pandas HDFStore
+    :param key: key of the frame
+    :param columns: List of columns to read, in stored order, all columns when None
+    :param start: first date of the index to read, inclusive
+    :param end: last date of the index to read, inclusive
+    :return: DataFrame
+    """
+    where = []
+    if start is not None:
+        where.append(f"index >= '{pd.Timestamp(start)}'")
+    if end is not None:
+        where.append(f"index <= '{pd.Timestamp(end)}'")
+    if columns is not None:
+        stored_columns = store.get_storer(key).non_index_axes[0][1]
+        columns = [c for c in stored_columns if c in set(columns)]
+    return store.select(key, where=where or None, columns=columns)
+
+
+def build_index_features(store, spy_number_of_shifts=13, shift_step=10, start=None, end=None):
+    """
+    Build the index ETF (SPY/QQQ/DIA) feature block shared by every symbol.
 
+    :param store: open pandas HDFStore containing 'indices/{ETF}' frames
+    :param spy_number_of_shifts: Number of shifted columns to add for each index feature
+    :param shift_step: The step size for each shift
+    :param start: first stored date to read, including warm-up
+    :param end: last stored date to read
+    :return: DataFrame of index features and List of index feature column names
+    """
     index_dfs = []
     ind_features = []
     for ind in ['SPY', 'QQQ', 'DIA']:
 
-        ind_df = pd.read_hdf(data_path, f'indices/{ind}')
+        ind_df = load_frame(store, f'indices/{ind}', columns=['close', 'tenkan_sen', 'kijun_sen', 'senkou_span_a',
+                                                              'senkou_span_b'], start=start, end=end)
         ind_df = make_index_eastern(ind_df)
 
         ind_df.loc[:, f'{ind}_close_diff_tenkan_sen_percent'] = (ind_df['close'] - ind_df['tenkan_sen']) / ind_df['tenkan_sen']
@@ -108,98 +135,400 @@ def process_data(data_path, number_of_shifts=13, spy_number_of_shifts=13, shift_
     for df_temp in index_dfs[1:]:
         ind_df = pd.merge(ind_df, df_temp, left_index=True, right_index=True, how='outer')
 
-    df_dict = {}
-    dropped_symbols = []
+    return ind_df[ind_features], ind_features
 
-    for key in prices_dataframe_keys:
-        # print(key)
-        symbol = key.split('/')[-1]
-        df = pd.read_hdf(data_path, key)
-        df = make_index_eastern(df)
 
-        df = df.merge(ind_df[ind_features], left_index=True, right_index=True, how='left')
+def calculate_full_history_features(df):
+    """
+    Features whose values depend on the whole history of the symbol, through recursive smoothing
+    or running sums, rather than on a fixed lookback.
 
-        # tech debt: perform this conversion when saving events to h5
-        # get earnings dates
-        events_key = f'/events/{symbol}'
-        if events_key in events_dataframe_keys:
-            events_df = pd.read_hdf(data_path, events_key)
-            earnings_dates_eastern_time = get_earnings_dates(events_df)
-        else:
-            dropped_symbols.append(key)
-            print(f"Dropped {key} because it did not have event data.")
-            continue
-
-        # tech debt: change to days UNTIL earnings. Requires alpha vantage to get date. Need solution for when date is unknown...
-        # Apply the function to each date in df
-        df['days_since_earnings'] = df.index.map(lambda date: days_since_earnings(date, earnings_dates_eastern_time))
-        df['days_since_earnings'].astype(float)
-
-        # introduce sector info, need to make one-hots
-        df['sector'] = s_and_p_details.Sector.get(symbol, 'UNKNOWN')
-
-        # Introduce seasonality
-        df.loc[:, 'month'] = df.index.month
-        df['month'] = df['month'].astype(float)
-
-        # Technical Indicators
-        df['rsi'] = talib.RSI(df['close'], timeperiod=14)
-        df['mfi'] = talib.MFI(high=df['high'], low=df['low'], close=df['close'], volume=df['volume'], timeperiod=14)
-        df['rmi'] = calculate_rmi(df['close'], time_period=14, momentum_period=5)
-
-        macd = talib.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
-        df['macd'] = macd[0]
-        df['macd_signal'] = macd[1]
-        df['macd_hist'] = macd[2]
-
-        df['close_price_diff_1_day'] = df['close'].pct_change()
-
-        df.loc[:, 'crossover_difference'] = df['tenkan_sen'] - df['kijun_sen']
-        # -1 when crossover occurs, 1 when no change of sign, otherwise 0 if crossover_difference is 0
-        df.loc[:, 'crossover_indicator'] = (
-            (df['crossover_difference'] * df['crossover_difference'].shift(1)).apply(
-                convert_to_polarity)
-        )
-
-        # Relative Volume
-        df['volume_percent_of_2_week_total'] = 100 * df['volume'] / df['volume'].rolling(window='14D').sum()
-        # Relative Dividend
-        df['dividend_amount_to_close'] = 100 * df['dividend_amount'] / df['close']
-
-        # (close - feature) / feature from Ichimoku cloud
-        df.loc[:, 'close_diff_tenkan_sen_percent'] = (df['close'] - df['tenkan_sen']) / df['tenkan_sen']
-        df.loc[:, 'close_diff_kijun_sen_percent'] = (df['close'] - df['kijun_sen']) / df['kijun_sen']
-        df.loc[:, 'close_diff_senkou_span_a_percent'] = (df['close'] - df['senkou_span_a']) / df['senkou_span_a']
-        df.loc[:, 'close_diff_senkou_span_b_percent'] = (df['close'] - df['senkou_span_b']) / df['senkou_span_b']
-
-        cloud_features = ['close_diff_tenkan_sen_percent', 'close_diff_kijun_sen_percent',
-                        'close_diff_senkou_span_a_percent', 'close_diff_senkou_span_b_percent']
-        dropna_cols.extend(cloud_features)
-
-        df, shift_cloud_features = add_shifted_columns(df, cloud_features, number_of_shifts, shift_step=shift_step)
-        dropna_cols.extend(shift_cloud_features)
-
-        # Calculate the 52-week high for each date
-        # Compute the current close relative to the 52-week high
-        df['close_to_365_day_high'] = df['close'] / df['close'].rolling(window='365D').max()
-        # Calculate the 52-week low for each date
-        # Compute the current close relative to the 52-week low
-        df['close_to_365_day_low'] = df['close'] / df['close'].rolling(window='365D').min()
-
-        for days in high_low_rolling_calendar_days:
-            col_high = f'close_to_{days}_day_high'
-            col_low = f'close_to_{days}_day_low'
-            df[col_high] = df['close'] / df['close'].rolling(window=f'{days}D').max()
-            df[col_low] = df['close'] / df['close'].rolling(window=f'{days}D').min()
+    :param df: Pandas DataFrame of prices
+    :return: DataFrame of rsi, mfi, rmi, macd, macd_signal, macd_hist and volume_percent_of_2_week_total
+    """
+    features = pd.DataFrame(index=df.index)
+    features['rsi'] = talib.RSI(df['close'], timeperiod=14)
+    features['mfi'] = talib.MFI(high=df['high'], low=df['low'], close=df['close'], volume=df['volume'], timeperiod=14)
+    features['rmi'] = calculate_rmi(df['close'], time_period=14, momentum_period=5)
+
+    macd = talib.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
+    features['macd'] = macd[0]
+    features['macd_signal'] = macd[1]
+    features['macd_hist'] = macd[2]
+
+    # Relative Volume
+    features['volume_percent_of_2_week_total'] = 100 * df['volume'] / df['volume'].rolling(window='14D').sum()
+    return features
+
+
+def calculate_symbol_features(df, earnings_dates, ind_df, ind_features, sector, number_of_shifts=13, shift_step=10):
+    """
+    Engineer the features of a single symbol.
+
+    :param df: Pandas DataFrame of prices with an eastern time index
+    :param earnings_dates: Series of timezone aware earnings dates
+    :param ind_df: DataFrame of index features from build_index_features
+    :param ind_features: List of index feature column names
+    :param sector: Sector of the symbol
+    :param number_of_shifts: Number of shifted columns to add for each cloud feature
+    :param shift_step: The step size for each shift
+    :return: DataFrame with features and List of columns that must not be null
+    """
+    week_multiplier = 2
+    high_low_rolling_calendar_days = range(week_multiplier * 7, 13 * week_multiplier * 7, week_multiplier * 7)
+
+    dropna_cols = [
+        'close_price_diff_1_day', 'crossover_indicator',
+        'rsi', 'rmi', 'mfi', 'macd', 'macd_signal', 'macd_hist', 'days_since_earnings',
+        'close_to_365_day_high', 'close_to_365_day_low',
+        'volume_percent_of_2_week_total', 'dividend_amount_to_close',
+    ]
+
+    df = df.merge(ind_df[ind_features], left_index=True, right_index=True, how='left')
+
+    # tech debt: change to days UNTIL earnings. Requires alpha vantage to get date. Need solution for when date is unknown...
+    days_since, _ = align_event_dates(df.index, earnings_dates)
+    # keep integer days when every bar has a past earnings date
+    df['days_since_earnings'] = days_since if np.isnan(days_since).any() else days_since.astype(int)
+
+    # introduce sector info, need to make one-hots
+    df['sector'] = sector
+
+    # Introduce seasonality
+    df.loc[:, 'month'] = df.index.month
+    df['month'] = df['month'].astype(float)
+
+    # Technical Indicators
+    full_history_features = calculate_full_history_features(df)
+    for column in ['rsi', 'mfi', 'rmi', 'macd', 'macd_signal', 'macd_hist']:
+        df[column] = full_history_features[column]
+
+    df['close_price_diff_1_day'] = df['close'].pct_change()
+
+    df.loc[:, 'crossover_difference'] = df['tenkan_sen'] - df['kijun_sen']
+    # -1 when crossover occurs, 1 when no change of sign, otherwise 0 if crossover_difference is 0
+    df.loc[:, 'crossover_indicator'] = convert_to_polarity(
+        df['crossover_difference'] * df['crossover_difference'].shift(1)
+    )
+
+    # Relative Volume
+    df['volume_percent_of_2_week_total'] = full_history_features['volume_percent_of_2_week_total']
+    # Relative Dividend
+    df['dividend_amount_to_close'] = 100 * df['dividend_amount'] / df['close']
+
+    # (close - feature) / feature from Ichimoku cloud
+    df.loc[:, 'close_diff_tenkan_sen_percent'] = (df['close'] - df['tenkan_sen']) / df['tenkan_sen']
+    df.loc[:, 'close_diff_kijun_sen_percent'] = (df['close'] - df['kijun_sen']) / df['kijun_sen']
+    df.loc[:, 'close_diff_senkou_span_a_percent'] = (df['close'] - df['senkou_span_a']) / df['senkou_span_a']
+    df.loc[:, 'close_diff_senkou_span_b_percent'] = (df['close'] - df['senkou_span_b']) / df['senkou_span_b']
+
+    cloud_features = ['close_diff_tenkan_sen_percent', 'close_diff_kijun_sen_percent',
+                    'close_diff_senkou_span_a_percent', 'close_diff_senkou_span_b_percent']
+    dropna_cols.extend(cloud_features)
+
+    df, shift_cloud_features = add_shifted_columns(df, cloud_features, number_of_shifts, shift_step=shift_step)
+    dropna_cols.extend(shift_cloud_features)
+
+    # Current close relative to the rolling calendar day highs and lows, the 365 day (52-week) window first
+    rolling_days = [365] + list(high_low_rolling_calendar_days)
+    rolling_high, rolling_low = rolling_calendar_extrema(df['close'].values, df.index, rolling_days)
+    for column, days in enumerate(rolling_days):
+        col_high = f'close_to_{days}_day_high'
+        col_low = f'close_to_{days}_day_low'
+        df[col_high] = df['close'].values / rolling_high[:, column]
+        df[col_low] = df['close'].values / rolling_low[:, column]
+        if days != 365:
             dropna_cols.extend([col_high, col_low])
 
-        if df.shape[0] > 0:
-            df_dict[key] = df.dropna(
-                subset=dropna_cols + ind_features
-            ).copy()
-        else:
+    return df, dropna_cols + ind_features
+
+
+def update_symbol_features(previous_df, df, earnings_dates, ind_df, ind_features, sector, number_of_shifts=13,
+                           shift_step=10, start_eastern=None):
+    """
+    Append the features of new bars to previously computed features of a single symbol.
+
+    Windowed features are computed only for the new bars plus the lookback they need: the largest
+    shift in rows and the 365 calendar day high/low window. Features in calculate_full_history_features
+    depend on the whole history and are recomputed over it, which is a single vectorized pass each.
+    The result is identical to calculate_symbol_features on df followed by the same dropna.
+
+    :param previous_df: DataFrame returned for this symbol by an earlier process_data run
+    :param df: Pandas DataFrame of all prices, including the new bars, with an eastern time index
+    :param earnings_dates: Series of timezone aware earnings dates
+    :param ind_df: DataFrame of index features from build_index_features
+    :param ind_features: List of index feature column names
+    :param sector: Sector of the symbol
+    :param number_of_shifts: Number of shifted columns to add for each cloud feature
+    :param shift_step: The step size for each shift
+    :param start_eastern: first date features are kept from, as in process_data. All history when None.
+    :return: DataFrame of features, or None when previous_df no longer matches the inputs (for example
+        after a dividend or split rescaled the adjusted history, or when it was engineered from another
+        date range or other price columns) and a full rebuild is required
+    """
+    if previous_df.empty or not previous_df.index.isin(df.index).all():
+        return None
+    # features engineered with other parameters
+    if not set(ind_features).issubset(previous_df.columns):
+        return None
+    if (previous_df['sector'] != sector).any():
+        return None
+
+    # chikou_span is the close shifted into the past, so it fills in for earlier bars as new bars arrive
+    raw_columns = [c for c in df.columns if c != 'chikou_span']
+    if not set(raw_columns).issubset(previous_df.columns):
+        return None
+    if not previous_df[raw_columns].equals(df.loc[previous_df.index, raw_columns]):
+        return None
+    previous_ind_df = ind_df.reindex(previous_df.index)[ind_features]
+    if not previous_df[ind_features].equals(previous_ind_df):
+        return None
+
+    # features engineered from a shorter history, e.g. a later start date, miss rows a full rebuild keeps.
+    # The features only look back, so the bars before previous_df tell which rows those are.
+    first_position = df.index.get_loc(previous_df.index[0])
+    if first_position > 0:
+        head_df, dropna_cols = calculate_symbol_features(
+            df.iloc[:first_position].copy(), earnings_dates, ind_df, ind_features, sector,
+            number_of_shifts=number_of_shifts, shift_step=shift_step)
+        if start_eastern is not None:
+            head_df = head_df.loc[head_df.index >= start_eastern]
+        if not head_df.dropna(subset=dropna_cols).empty:
+            return None
+
+    last_date = previous_df.index[-1]
+    first_new_position = df.index.searchsorted(last_date, side='right')
+    if first_new_position == len(df.index):
+        return previous_df
+
+    # rows needed by the shifted columns, pct_change and crossover_indicator
+    row_lookback = max(number_of_shifts * shift_step, 1)
+    # calendar days needed by the largest rolling high/low window
+    first_new_date = df.index[first_new_position]
+    start_position = min(
+        max(first_new_position - row_lookback, 0),
+        df.index.searchsorted(first_new_date - pd.Timedelta(days=365), side='right'),
+    )
+
+    tail_df, dropna_cols = calculate_symbol_features(
+        df.iloc[start_position:].copy(), earnings_dates, ind_df, ind_features, sector,
+        number_of_shifts=number_of_shifts, shift_step=shift_step)
+    if list(tail_df.columns) != list(previous_df.columns):
+        return None
+    full_history_features = calculate_full_history_features(df)
+    for column in full_history_features.columns:
+        tail_df[column] = full_history_features.loc[tail_df.index, column]
+
+    new_df = tail_df.iloc[first_new_position - start_position:].dropna(subset=dropna_cols)
+    new_df = new_df.astype(previous_df.dtypes.to_dict())
+
+    previous_df = previous_df.copy()
+    if 'chikou_span' in df.columns:
+        previous_df['chikou_span'] = df.loc[previous_df.index, 'chikou_span']
+    return pd.concat([previous_df, new_df])
+
+
+def process_symbol(store, key, context, previous_df=None):
+    """
+    Read and engineer the features of one symbol from an open HDFStore.
+
+    :param store: open pandas HDFStore with 'prices/' and 'events/' frames
+    :param key: key of the prices frame, e.g. '/prices/AAPL'
+    :param context: dict of shared inputs built by process_data
+    :param previous_df: features of the symbol from an earlier run, only new bars are computed when it still
+        matches the stored prices
+    :return: DataFrame of features, or None and the reason the symbol was dropped
+    """
+    symbol = key.split('/')[-1]
+
+    # tech debt: perform this conversion when saving events to h5
+    # get earnings dates
+    events_key = f'/events/{symbol}'
+    if events_key not in context['events_dataframe_keys']:
+        return None, f"Dropped {key} because it did not have event data."
+
+    df = load_frame(store, key, columns=context['price_columns'], start=context['load_start'], end=context['end'])
+    events_df = load_frame(store, events_key, columns=EVENT_COLUMNS)
+    sector = context['sectors'].get(symbol, 'UNKNOWN')
+
+    cache = context.get('cache')
+    if cache is not None:
+        cache_key = fingerprint(df, events_df, sector=sector, **context['cache_params'])
+        cached_df = cache.get(symbol, cache_key)
+        if cached_df is not None:
+            return cached_df, None
+        if previous_df is None:
+            previous_df = cache.get_latest(symbol, context['history_params'])
+
+    df = make_index_eastern(df)
+    earnings_dates_eastern_time = get_earnings_dates(events_df)
+
+    if previous_df is not None:
+        updated_df = update_symbol_features(
+            previous_df, df, earnings_dates_eastern_time, context['ind_df'], context['ind_features'], sector,
+            number_of_shifts=context['number_of_shifts'], shift_step=context['shift_step'],
+            start_eastern=context['start_eastern'])
+        if updated_df is not None:
+            updated_df = updated_df.loc[updated_df.index >= context['start_eastern']]
+            if cache is not None:
+                cache.put(symbol, cache_key, updated_df, context['history_params'])
+            return updated_df, None
+
+    df, dropna_cols = calculate_symbol_features(
+        df, earnings_dates_eastern_time, context['ind_df'], context['ind_features'], sector,
+        number_of_shifts=context['number_of_shifts'], shift_step=context['shift_step'])
+
+    # drop the warm-up bars
+    df = df.loc[df.index >= context['start_eastern']]
+
+    if df.shape[0] > 0:
+        df = df.dropna(subset=dropna_cols).copy()
+        if cache is not None:
+            cache.put(symbol, cache_key, df, context['history_params'])
+        return df, None
+    else:
+        return None, f"Dropped {key} because it is an empty dataframe"
+
+
+def process_symbols(data_path, keys, context, previous_df_dict=None):
+    """Process symbols with a single read-only store handle. Failures are returned instead of raised."""
+    previous_df_dict = previous_df_dict or {}
+    results = []
+    with pd.HDFStore(data_path, mode='r') as store:
+        for key in keys:
+            try:
+                df, message = process_symbol(store, key, context, previous_df=previous_df_dict.get(key))
+            except Exception as e:
+                df, message = None, f"Dropped {key} because processing failed: {e!r}"
+            results.append((key, df, message))
+    return results
+
+
+_worker_context = None
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _process_shard(data_path, keys, previous_df_dict):
+    cache = _worker_context.get('cache')
+    if cache is not None:
+        cache.reset_stats()
+    results = process_symbols(data_path, keys, _worker_context, previous_df_dict=previous_df_dict)
+    return results, cache.stats if cache is not None else None
+
+
+def process_data(data_path, number_of_shifts=13, spy_number_of_shifts=13, shift_step=10, workers=1,
+                 details_path='../../../res/indices/s_and_p_500_details.csv', cache=None, previous_df_dict=None,
+                 start=None, end=None, price_columns=None):
+    """
+    Engineer features for every symbol in the HDF5 data file.
+
+    :param data_path: path to the HDF5 file with 'prices/', 'events/' and 'indices/' frames
+    :param number_of_shifts: Number of shifted columns to add for each cloud feature
+    :param spy_number_of_shifts: Number of shifted columns to add for each index feature
+    :param shift_step: The step size for each shift
+    :param workers: Number of processes to shard symbols across, 1 processes serially
+    :param details_path: csv with the sector of each symbol
+    :param cache: optional FeatureCache, symbols whose inputs and parameters are unchanged are loaded from it
+        and the latest entry of a changed symbol is updated incrementally
+    :param previous_df_dict: optional df_dict of an earlier run, only bars added since are computed for its symbols
+    :param start: first stored date to engineer features for, the warm-up the features need before it is read
+        automatically. All history when None.
+    :param end: last stored date to read
+    :param price_columns: price columns to read besides REQUIRED_PRICE_COLUMNS, all stored columns when None
+    :return: dict of DataFrames keyed by prices key and List of dropped keys
+    """
+    # Use reduced data file for testing
+    if os.environ.get('TEST_ENV') == 'true':
+        data_path = '../../../res/data/s_and_p_study_data_TESTING.h5'
+
+    s_and_p_details = pd.read_csv(details_path, index_col=0)
+
+    if start is not None:
+        load_start = pd.Timestamp(start) - pd.Timedelta(days=get_warmup_days(
+            max(number_of_shifts, spy_number_of_shifts), shift_step))
+        start_eastern = eastern_close_index([start])[0]
+    else:
+        load_start = None
+        start_eastern = pd.Timestamp.min.tz_localize('US/Eastern')
+    if price_columns is not None:
+        price_columns = REQUIRED_PRICE_COLUMNS + [c for c in price_columns if c not in REQUIRED_PRICE_COLUMNS]
+
+    with pd.HDFStore(data_path, mode='r') as store:
+        dataframe_keys = store.keys()
+        ind_df, ind_features = build_index_features(
+            store, spy_number_of_shifts, shift_step=shift_step, start=load_start, end=end)
+
+    prices_dataframe_keys = [k for k in dataframe_keys if 'prices/' in k]
+    events_dataframe_keys = [k for k in dataframe_keys if 'events/' in k]
+
+    context = {
+        'ind_df': ind_df,
+        'ind_features': ind_features,
+        'sectors': s_and_p_details.Sector,
+        'events_dataframe_keys': set(events_dataframe_keys),
+        'number_of_shifts': number_of_shifts,
+        'shift_step': shift_step,
+        'cache': cache,
+        'price_columns': price_columns,
+        'load_start': load_start,
+        'start_eastern': start_eastern,
+        'end': end,
+    }
+    if cache is not None:
+        context['cache_params'] = {
+            'index_features': fingerprint(ind_df),
+            'number_of_shifts': number_of_shifts,
+            'spy_number_of_shifts': spy_number_of_shifts,
+            'shift_step': shift_step,
+            'start': start,
+        }
+        # entries of another date range or other price columns cannot be updated incrementally
+        context['history_params'] = {
+            'start': None if start is None else str(pd.Timestamp(start)),
+            'price_columns': price_columns,
+        }
+
+    previous_df_dict = previous_df_dict or {}
+    if workers > 1:
+        results = {}
+        # several shards per worker keeps the pool balanced when symbol history lengths differ
+        shards = [prices_dataframe_keys[i::workers * 4] for i in range(workers * 4)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(context,)) as executor:
+            futures = {
+                executor.submit(_process_shard, data_path, shard,
+                                {k: previous_df_dict[k] for k in shard if k in previous_df_dict}): shard
+                for shard in shards if shard
+            }
+            for future in as_completed(futures):
+                try:
+                    shard_results, cache_stats = future.result()
+                except Exception as e:
+                    shard_results, cache_stats = [(key, None, f"Dropped {key} because its worker failed: {e!r}")
+                                                  for key in futures[future]], None
+                if cache_stats is not None:
+                    cache.merge_stats(cache_stats)
+                for key, df, message in shard_results:
+                    results[key] = (df, message)
+        results = [(key, *results[key]) for key in prices_dataframe_keys]
+    else:
+        results = process_symbols(data_path, prices_dataframe_keys, context, previous_df_dict=previous_df_dict)
+
+    df_dict = {}
+    dropped_symbols = []
+    for key, df, message in results:
+        if df is None:
             dropped_symbols.append(key)
-            print(f"Dropped {key} because it is an empty dataframe")
+            print(message)
+        else:
+            df_dict[key] = df
+
+    if cache is not None:
+        cache.evict()
+        print(f"Feature cache: {cache.stats}")
     return df_dict, dropped_symbols
 
 
@@ -210,52 +539,58 @@ def filter_data(df, signal_rule='bullish_cloud_crossover'):
 
 
 def get_signal_index(df, signal_rule):
-    if signal_rule == 'bullish_cloud_crossover':
-        # Train when bullish crossover signal is present
-        # If crossover_indicator == -1
-        # and crossover_difference > 0
-        # and signal closes above cloud
-        # then LONG signal
-        idx = (
-                (df['crossover_indicator'] == -1) &
-                (df['crossover_difference'] > 0) &
-                (df['close_diff_senkou_span_a_percent'] > 0) &
-                (df['close_diff_senkou_span_b_percent'] > 0)
-        )
-    elif signal_rule == 'bearish_cloud_crossover':
-        # Train when bearish crossover signal is present
-        # If crossover_indicator == -1
-        # and crossover_difference < 0
-        # and signal closes below cloud
-        # then SHORT signal
-        idx = (
-                (df['crossover_indicator'] == -1) &
-                (df['crossover_difference'] < 0) &
-                (df['close_diff_senkou_span_a_percent'] < 0) &
-                (df['close_diff_senkou_span_b_percent'] < 0)
-        )
-    elif signal_rule == 'bullish_and_bearish_cloud_crossover':
-        # Need to determine target
-        idx = (
-                (
-                        (df['crossover_indicator'] == -1) &
-                        (df['crossover_difference'] > 0) &
-                        (df['close_diff_senkou_span_a_percent'] > 0) &
-                        (df['close_diff_senkou_span_b_percent'] > 0)
-                ) |
-                (
-                        (df['crossover_indicator'] == -1) &
-                        (df['crossover_difference'] < 0) &
-                        (df['close_diff_senkou_span_a_percent'] < 0) &
-                        (df['close_diff_senkou_span_b_percent'] < 0)
-                )
-        )
-    else:
-        raise Exception(f'Unknown signal rule {signal_rule}')
-    return idx
+    """
+    Boolean index of the rows of df where a signal rule fires.
+
+    :param df: Pandas DataFrame of features
+    :param signal_rule: name of a rule registered with tools.signal_helper.register_signal_rule
+    :return: boolean Series aligned with df
+    """
+    return get_signal_rule(signal_rule)(df)
+
+
+def build_lag_matrix(df, column_names, lags, dtype=np.float64):
+    """
+    Builds lagged copies of multiple columns as a single contiguous block.
+
+    :param df: Pandas DataFrame
+    :param column_names: List of column names to be lagged
+    :param lags: Iterable of integer lags, positive lags shift values down like DataFrame.shift
+    :param dtype: dtype of the block, e.g. np.float32 to halve memory
+    :return: DataFrame of the lagged columns named '{column_name}_shifted_{lag}', ordered by column then lag
+    """
+    lags = list(lags)
+    values = df[column_names].to_numpy(dtype=dtype)
+    n = values.shape[0]
+    block = np.full((n, len(column_names), len(lags)), np.nan, dtype=dtype)
+    for j, lag in enumerate(lags):
+        if 0 <= lag < n:
+            block[lag:, :, j] = values[:n - lag]
+        elif -n < lag < 0:
+            block[:n + lag, :, j] = values[-lag:]
+    columns = [f"{column_name}_shifted_{lag}" for column_name in column_names for lag in lags]
+    return pd.DataFrame(block.reshape(n, -1), index=df.index, columns=columns)
+
+
+def lag_view(values, number_of_lags, lag_step=1):
+    """
+    Read-only strided view of lags lag_step, 2 * lag_step, ..., number_of_lags * lag_step of a 1-D array.
+
+    Only the NaN padded copy of values is allocated, the lag matrix itself is a view into it.
+
+    :param values: 1-D numpy array of floats
+    :param number_of_lags: Number of lags
+    :param lag_step: The step size for each lag
+    :return: numpy array view of shape (len(values), number_of_lags), column n - 1 holds lag n * lag_step
+    """
+    max_lag = number_of_lags * lag_step
+    padded = np.concatenate([np.full(max_lag, np.nan), np.asarray(values, dtype=float)])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, max_lag + 1)
+    # the last element of each window is the current value, lag k sits k elements before it
+    return windows[:, max_lag - lag_step::-lag_step]
 
 
-def add_shifted_columns(df, column_names, number_of_shifts, shift_step=1):
+def add_shifted_columns(df, column_names, number_of_shifts, shift_step=1, dtype=np.float64):
     """
     Adds shifted columns to the DataFrame for multiple columns with a specified shift step.
 
@@ -263,16 +598,14 @@ def add_shifted_columns(df, column_names, number_of_shifts, shift_step=1):
     :param column_names: List of column names to be shifted
     :param number_of_shifts: Number of shifted columns to add for each column
     :param shift_step: The step size for each shift
+    :param dtype: dtype of the shifted columns
     :return: DataFrame and List of newly added column names
     """
-    new_columns = []
-    for column_name in column_names:
-        for n in range(1, number_of_shifts + 1):
-            shift_amount = n * shift_step
-            shifted_column_name = f"{column_name}_shifted_{shift_amount}"
-            df[shifted_column_name] = df[column_name].shift(shift_amount)
-            new_columns.append(shifted_column_name)
-    return df.copy(), new_columns
+    lags = [n * shift_step for n in range(1, number_of_shifts + 1)]
+    lag_df = build_lag_matrix(df, column_names, lags, dtype=dtype)
+    new_columns = list(lag_df.columns)
+    df = df.drop(columns=[c for c in new_columns if c in df.columns])
+    return pd.concat([df, lag_df], axis=1), new_columns
 
 
 def evaluate_for_stationary_series(target: pd.Series, test_threshold=0.05):
@@ -1,5 +1,48 @@
+from contextlib import contextmanager
+import gzip
+from io import StringIO
 import os
 import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
+import re
+import threading
+import time
+
+# type OIDs of smallint, integer and bigint in the cursor description
+INTEGER_TYPE_OIDS = (21, 23, 20)
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """
+    Thread safe connection pool that waits for a free connection instead of raising PoolError when all
+    maxconn connections are in use.
+    """
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._available = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        self._available.acquire()
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._available.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._available.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, its open transaction is rolled back when it is returned without a commit."""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
 
 
 def get_ticker_id(cur, ticker_symbol, reference_table='tickers'):
@@ -31,6 +74,159 @@ def get_all_ticker_symbols(cur, reference_table='tickers'):
     return [s[0] for s in ticker_symbols]
 
 
+def bulk_upsert(cur, df, table, conflict_columns=('id',), update=True, update_columns=None):
+    """
+    Insert a DataFrame into a table in one round trip, merging rows that already exist.
+
+    The rows are copied into a temporary staging table shaped like the target table and merged with a single
+    INSERT ... SELECT ... ON CONFLICT. The caller commits, the staging table is dropped on commit.
+
+    Args:
+        cur: psycopg2 cursor
+        df: pandas DataFrame whose columns are columns of table
+        table: str, target table name
+        conflict_columns: tuple of the columns of the unique constraint to merge on (default is ('id',))
+        update: boolean, update the existing rows, otherwise keep them (default is True)
+        update_columns: list of the columns to update, all columns except conflict_columns when None
+
+    Returns:
+        int, number of inserted or updated rows
+    """
+    if df.empty:
+        return 0
+    start = time.perf_counter()
+    columns = df.columns.tolist()
+    column_list = ', '.join(columns)
+    # qualified with the temporary schema so a permanent table of the same name is never dropped or used
+    staging_table = f"pg_temp.{table.split('.')[-1]}_staging"
+
+    cur.execute(f"DROP TABLE IF EXISTS {staging_table}")
+    cur.execute(f"""
+        CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS
+        SELECT {column_list} FROM {table} WITH NO DATA
+    """)
+
+    # float columns of integer table columns (e.g. volume with missing values) are written without a decimal
+    # point so they can be copied, float table columns keep their values as they are
+    cur.execute(f"SELECT {column_list} FROM {staging_table} LIMIT 0")
+    integer_columns = {column.name for column in cur.description if column.type_code in INTEGER_TYPE_OIDS}
+    df = df.copy()
+    for column in columns:
+        if column in integer_columns and pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype('Int64')
+    output = StringIO()
+    df.to_csv(output, header=False, index=False)
+    output.seek(0)
+    cur.copy_expert(f"COPY {staging_table} ({column_list}) FROM STDIN WITH (FORMAT csv)", output)
+
+    update_columns = [c for c in (update_columns or columns) if c not in conflict_columns]
+    if update and update_columns:
+        conflict_action = 'DO UPDATE SET ' + ', '.join(f'{c} = EXCLUDED.{c}' for c in update_columns)
+    else:
+        conflict_action = 'DO NOTHING'
+    cur.execute(f"""
+        INSERT INTO {table} ({column_list})
+        SELECT {column_list} FROM {staging_table}
+        ON CONFLICT ({', '.join(conflict_columns)}) {conflict_action}
+    """)
+    row_count = cur.rowcount
+
+    seconds = time.perf_counter() - start
+    print(f'{table}: {row_count} of {len(df)} rows upserted in {seconds:.2f} s ({len(df) / seconds:.0f} rows/s)')
+    return row_count
+
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    result = cur.fetchone()
+    return bool(result and result[0])
+
+
+def month_partition_name(table, month):
+    return f'{table}_{month.year}_{month.month:02d}'
+
+
+def create_month_partitions(cur, table, datetimes, ticker_partitions=0):
+    """
+    Create the monthly partitions of a table partitioned by range of datetime that hold the given datetimes.
+
+    Args:
+        datetimes: datetimes to be inserted
+        ticker_partitions: int, number of partitions of each month by hash of ticker_id, none when 0 (default is 0)
+
+    Returns:
+        list of the names of the created partitions
+    """
+    months = pd.DatetimeIndex(datetimes).to_period('M').unique()
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (table,))
+    existing_partitions = {name for name, in cur.fetchall()}
+    created_partitions = []
+    for month in months:
+        partition = month_partition_name(table, month)
+        if partition in existing_partitions:
+            continue
+        sub_partitioning = ' PARTITION BY HASH (ticker_id)' if ticker_partitions else ''
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table}
+            FOR VALUES FROM ('{month.start_time}') TO ('{(month + 1).start_time}'){sub_partitioning}
+        """)
+        for remainder in range(ticker_partitions):
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {partition}_h{remainder} PARTITION OF {partition}
+                FOR VALUES WITH (MODULUS {ticker_partitions}, REMAINDER {remainder})
+            """)
+        created_partitions.append(partition)
+    return created_partitions
+
+
+def archive_partitions(conn, cur, table, before, archive_dir=None, archive_schema='archive'):
+    """
+    Detach the monthly partitions of a table that only hold quotes before a date and archive them.
+
+    The months are read from the range bounds of the partitions, so other partitions, e.g. a default partition,
+    are left alone.
+
+    Args:
+        table: str, partitioned table, optionally schema qualified
+        before: date, partitions of the months that end before it are archived, e.g. '2024-01-01' archives 2023
+        archive_dir: str, directory to export each partition to as gzip compressed CSV before it is dropped,
+            partitions are moved to archive_schema when None
+        archive_schema: str, schema of the detached partitions (default is 'archive')
+
+    Returns:
+        list of the names of the archived partitions
+    """
+    cur.execute("""
+        SELECT n.nspname, c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+    """, (table,))
+    before = pd.Timestamp(before)
+    archived_partitions = []
+    for schema, partition, bound in cur.fetchall():
+        # FOR VALUES FROM ('2023-01-01 00:00:00') TO ('2023-02-01 00:00:00'), DEFAULT or MAXVALUE bounds do not match
+        upper_bound = re.search(r"TO \('([^']+)'\)", bound)
+        if upper_bound is None or pd.Timestamp(upper_bound.group(1)) > before:
+            continue
+        qualified_partition = f'{schema}.{partition}'
+        cur.execute(f"ALTER TABLE {table} DETACH PARTITION {qualified_partition}")
+        if archive_dir is not None:
+            os.makedirs(archive_dir, exist_ok=True)
+            with gzip.open(os.path.join(archive_dir, f'{partition}.csv.gz'), 'wt') as f:
+                cur.copy_expert(f"COPY (SELECT * FROM {qualified_partition}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+            cur.execute(f"DROP TABLE {qualified_partition}")
+        else:
+            cur.execute(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}")
+            cur.execute(f"ALTER TABLE {qualified_partition} SET SCHEMA {archive_schema}")
+        conn.commit()
+        archived_partitions.append(partition)
+    return archived_partitions
+
+
 def update_reference_table(conn, cur, directory, filename_to_index, reference_table='tickers'):
     # Loop through each CSV file in the directory
     for filename in os.listdir(directory):
@@ -39,29 +235,20 @@ def update_reference_table(conn, cur, directory, filename_to_index, reference_ta
 
             # Read CSV file into DataFrame
             df = pd.read_csv(file_path)
+            df = pd.DataFrame({
+                column: df[csv_column] if csv_column in df.columns else None
+                for column, csv_column in [('ticker_symbol', 'Ticker'), ('company', 'Company'),
+                                           ('sector', 'Sector'), ('industry', 'Industry')]
+            })
             if filename in filename_to_index.keys():
                 index_col = filename_to_index[filename]
-                # Insert data from DataFrame into the database
-                for index, row in df.iterrows():
-                    cur.execute(
-                        f"""
-                            INSERT INTO {reference_table} (ticker_symbol, company, sector, industry, {index_col})
-                            VALUES (%s, %s, %s, %s, %s)
-                            ON CONFLICT (ticker_symbol) DO UPDATE SET
-                            {index_col} = EXCLUDED.{index_col}
-                        """,
-                        (row.get('Ticker'), row.get('Company'), row.get('Sector'), row.get('Industry'), True)
-                    )
+                df[index_col] = True
+                # Insert data from DataFrame into the database, flagging the index membership of existing tickers
+                bulk_upsert(cur, df.drop_duplicates('ticker_symbol', keep='last'), reference_table,
+                            conflict_columns=('ticker_symbol',), update_columns=[index_col])
             else:
-                for index, row in df.iterrows():
-                    cur.execute(
-                        f"""
-                            INSERT INTO {reference_table} (ticker_symbol, company, sector, industry)
-                            VALUES (%s, %s, %s, %s)
-                            ON CONFLICT (ticker_symbol) DO NOTHING
-                        """,
-                        (row.get('Ticker'), row.get('Company'), row.get('Sector'), row.get('Industry'))
-                    )
+                bulk_upsert(cur, df.drop_duplicates('ticker_symbol'), reference_table,
+                            conflict_columns=('ticker_symbol',), update=False)
             conn.commit()
 
 
@@ -73,7 +260,11 @@ def create_stock_database_tables(conn, cur):
         'earnings_table': 'earnings',
         'dividends_table': 'dividends',
         'split_table': 'split',
-        'meta_data_table': f'{table_prefix}_metadata'
+        'meta_data_table': f'{table_prefix}_metadata',
+        'stock_quotes_daily_adj_table': f'{table_prefix}_daily_adj',
+        'adj_state_table': f'{table_prefix}_daily_adj_state',
+        'stock_quotes_daily_ti_table': f'{table_prefix}_daily_adj_ti',
+        'ti_watermark_table': f'{table_prefix}_daily_adj_ti_watermark',
     }
     reference_table = tables['reference_table']
 
@@ -131,7 +322,7 @@ def create_stock_database_tables(conn, cur):
     """)
     conn.commit()
 
-    stock_quotes_daily_adj_table = f"{tables['stock_quotes_daily_table']}_adj"
+    stock_quotes_daily_adj_table = tables['stock_quotes_daily_adj_table']
     cur.execute(f"""
             CREATE TABLE IF NOT EXISTS {stock_quotes_daily_adj_table} (
                 id INTEGER NOT NULL,
@@ -142,12 +333,26 @@ def create_stock_database_tables(conn, cur):
                 close FLOAT,
                 volume FLOAT,
                 PRIMARY KEY (id),
-                FOREIGN KEY (id) REFERENCES {994}(id)
+                FOREIGN KEY (id) REFERENCES {stock_quotes_daily_table}(id)
             );
         """)
     conn.commit()
 
-    stock_quotes_daily_ti_table = f"{stock_quotes_daily_adj_table}_ti"
+    # last adjusted quote of each ticker, so only new quotes and tickers with new splits are adjusted
+    adj_state_table = tables['adj_state_table']
+
+    cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {adj_state_table} (
+            ticker_id INT PRIMARY KEY,
+            last_date DATE NOT NULL,
+            split_product FLOAT NOT NULL,
+            row_count INTEGER NOT NULL,
+            FOREIGN KEY (ticker_id) REFERENCES {reference_table}(ticker_id)
+        );
+        """)
+    conn.commit()
+
+    stock_quotes_daily_ti_table = tables['stock_quotes_daily_ti_table']
 
     cur.execute(f"""
             CREATE TABLE IF NOT EXISTS {stock_quotes_daily_ti_table} (
@@ -171,6 +376,21 @@ def create_stock_database_tables(conn, cur):
         """)
     conn.commit()
 
+    # last processed quote of each ticker, so technical indicators can be updated incrementally
+    ti_watermark_table = tables['ti_watermark_table']
+
+    cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ti_watermark_table} (
+            ticker_id INT PRIMARY KEY,
+            last_date DATE NOT NULL,
+            last_id INTEGER NOT NULL,
+            split_product FLOAT NOT NULL,
+            row_count INTEGER NOT NULL,
+            FOREIGN KEY (ticker_id) REFERENCES {reference_table}(ticker_id)
+        );
+        """)
+    conn.commit()
+
     earnings_table = tables['earnings_table']
 
     cur.execute(f"""
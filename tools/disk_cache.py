@@ -0,0 +1,114 @@
+import glob
+import os
+
+
+class DiskCache:
+    """
+    Base of the on-disk caches: one file per entry in a subdirectory of cache_dir, hit/miss/eviction counts and
+    eviction of the least recently modified entries once the cache grows beyond max_bytes.
+
+    The size of the cache is counted once from the directory and then kept as a running total of the entries
+    this process writes and removes, so a write does not scan the directory. Only when the total exceeds
+    max_bytes are the entries listed again and the oldest removed until the cache is back under low_water of
+    max_bytes. Entries written by other processes are counted at that eviction.
+
+    Subclasses name the entry files, e.g. {cache_dir}/{group}/{key}{suffix}, and write them through _replace.
+    """
+    suffix = ''
+    # fraction of max_bytes an eviction on write frees the cache down to, so a full cache is not evicted on
+    # every write
+    low_water = 0.9
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._bytes = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def merge_stats(self, stats):
+        """Add hit/miss/eviction counts collected by a copy of the cache, e.g. in a worker process."""
+        self.hits += stats['hits']
+        self.misses += stats['misses']
+        self.evictions += stats['evictions']
+
+    @property
+    def stats(self):
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, _, size in entries),
+        }
+
+    def _group_dir(self, group):
+        return os.path.join(self.cache_dir, group)
+
+    def _entries(self, group=None):
+        """(mtime, path, size) of the entries of a group, of every group when None."""
+        group_dir = glob.escape(self._group_dir(group)) if group else os.path.join(glob.escape(self.cache_dir), '*')
+        entries = []
+        for path in glob.glob(os.path.join(group_dir, f'*{self.suffix}')):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _replace(self, tmp_path, path):
+        """Move a written entry into place and evict when the running total of the cache exceeds max_bytes."""
+        size = os.path.getsize(tmp_path)
+        try:
+            replaced_size = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced_size = 0
+        os.replace(tmp_path, path)
+        if self._bytes is None:
+            self._bytes = sum(size for _, _, size in self._entries())
+        else:
+            self._bytes += size - replaced_size
+        if self._bytes > self.max_bytes:
+            self.evict(self.low_water * self.max_bytes)
+
+    def invalidate(self, group=None):
+        """
+        Remove cached entries.
+
+        Args:
+            group: str, remove only the entries of this group, all entries when None
+
+        Returns:
+            int, number of removed entries
+        """
+        return sum(self._remove(path) for _, path, _ in self._entries(group))
+
+    def evict(self, max_bytes=None):
+        """Remove the least recently modified entries until the cache fits in max_bytes (default is max_bytes)."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        total_bytes = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total_bytes <= max_bytes:
+                break
+            if self._remove(path):
+                self.evictions += 1
+            total_bytes -= size
+        self._bytes = total_bytes
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        if self._bytes is not None:
+            self._bytes -= size
+        return True
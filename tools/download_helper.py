@@ -0,0 +1,228 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import time
+import aiohttp
+import pandas as pd
+
+ALPHA_VANTAGE_URL = 'https://www.alphavantage.co/query'
+# keys of Alpha Vantage responses that carry a throttling message instead of data
+throttle_keys = ['Note', 'Information']
+
+
+class ThrottledError(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    Rate limiter that allows requests_per_minute on average with bursts of up to capacity requests.
+
+    Args:
+        requests_per_minute: float, sustained request rate
+        capacity: int, number of requests that may be made at once after an idle period (default is the
+            requests of one second, at least 1)
+    """
+    def __init__(self, requests_per_minute, capacity=None):
+        self.rate = requests_per_minute / 60
+        self.capacity = capacity or max(1, int(self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        """Wait until a request may be made and take its token."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def parse_time_series(payload):
+    """
+    Convert an Alpha Vantage TIME_SERIES_* JSON payload to the format of alpha_vantage's TimeSeries with
+    output_format='pandas'.
+
+    Returns:
+        data: pandas DataFrame with columns such as '1. open' indexed by a DatetimeIndex named date, newest first
+        meta_data: dict of the 'Meta Data' section
+    """
+    meta_data = payload['Meta Data']
+    time_series_key = next(key for key in payload if key != 'Meta Data')
+    data = pd.DataFrame.from_dict(payload[time_series_key], orient='index', dtype='float')
+    data.index.name = 'date'
+    data.index = pd.to_datetime(data.index)
+    return data, meta_data
+
+
+class RateLimitedSession:
+    """
+    Asynchronous HTTP client sharing one session, and its connection pool and cookies, between all requests.
+
+    Requests are spaced by a token bucket of requests_per_minute and at most concurrency requests are open at
+    once. Throttled requests (ThrottledError, connection errors and timeouts) are retried with exponential
+    backoff.
+
+    Args:
+        requests_per_minute: float, sustained request rate
+        concurrency: int, maximum number of open requests
+        max_retries: int, retries of a throttled request before giving up
+        backoff: float, seconds to wait before the first retry, doubled for each further retry
+        timeout: float, seconds before a request fails
+        cache: ResponseCache of the responses, nothing is cached when None
+    """
+    def __init__(self, requests_per_minute, concurrency, max_retries, backoff, timeout, cache):
+        self.bucket = TokenBucket(requests_per_minute)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.requests = 0
+        self.retries = 0
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        # cookies of hosts given by IP address are kept too, e.g. of a local stub server in tests
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                             cookie_jar=aiohttp.CookieJar(unsafe=True))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def _with_retries(self, request, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await request(*args)
+            except (ThrottledError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise ThrottledError(f'Gave up after {self.max_retries} retries: {e}') from e
+                self.retries += 1
+                # jitter keeps concurrent retries from hitting the server at the same moment
+                await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random() / 2))
+
+
+class AlphaVantageDownloader(RateLimitedSession):
+    """
+    Asynchronous Alpha Vantage client sharing one HTTP session between all requests.
+
+    Requests are spaced by a token bucket of requests_per_minute and at most concurrency requests are open at
+    once. Throttled requests (HTTP 429, server errors or a 'Note'/'Information' message instead of data) are
+    retried with exponential backoff. With a cache (tools.response_cache.ResponseCache) responses downloaded
+    before are served from disk without a request.
+
+    Usage:
+        async with AlphaVantageDownloader(requests_per_minute=75) as downloader:
+            data, meta_data = await downloader.get_daily_adjusted('IBM')
+
+    Args:
+        api_key: str, Alpha Vantage API key (default is the ALPHAVANTAGE_API_KEY environment variable)
+        requests_per_minute: float, request rate allowed by the API key (default is 75)
+        concurrency: int, maximum number of open requests (default is 8)
+        max_retries: int, retries of a throttled request before giving up (default is 5)
+        backoff: float, seconds to wait before the first retry, doubled for each further retry (default is 2.0)
+        url: str, API endpoint, e.g. of a local stub server in tests
+        timeout: float, seconds before a request fails (default is 60)
+        cache: ResponseCache of the responses, nothing is cached when None
+    """
+    def __init__(self, api_key=None, requests_per_minute=75, concurrency=8, max_retries=5, backoff=2.0,
+                 url=ALPHA_VANTAGE_URL, timeout=60, cache=None):
+        super().__init__(requests_per_minute, concurrency, max_retries, backoff, timeout, cache)
+        self.api_key = api_key or os.environ.get('ALPHAVANTAGE_API_KEY')
+        self.url = url
+
+    async def _request(self, params):
+        await self.bucket.acquire()
+        async with self._semaphore:
+            self.requests += 1
+            async with self.session.get(self.url, params=params) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise ThrottledError(f'HTTP {response.status}')
+                response.raise_for_status()
+                payload = await response.json(content_type=None)
+        if 'Error Message' in payload:
+            raise ValueError(payload['Error Message'])
+        for key in throttle_keys:
+            if key in payload:
+                raise ThrottledError(payload[key])
+        return payload
+
+    async def query(self, **params):
+        """
+        Request the JSON payload of an API function, e.g. query(function='TIME_SERIES_DAILY_ADJUSTED', symbol='IBM').
+        """
+        params = {key: value for key, value in params.items() if value not in (None, '')}
+        if self.cache is not None:
+            payload = self.cache.get('alpha_vantage', params['function'], params.get('symbol'), params)
+            if payload is not None:
+                return payload
+        params['apikey'] = self.api_key
+        payload = await self._with_retries(self._request, params)
+        if self.cache is not None:
+            self.cache.put('alpha_vantage', params['function'], params.get('symbol'), params, payload)
+        return payload
+
+    async def get_daily_adjusted(self, symbol, outputsize='full'):
+        payload = await self.query(function='TIME_SERIES_DAILY_ADJUSTED', symbol=symbol, outputsize=outputsize)
+        return parse_time_series(payload)
+
+    async def get_intraday(self, symbol, interval='1min', outputsize='compact', month='', extended_hours='false'):
+        payload = await self.query(function='TIME_SERIES_INTRADAY', symbol=symbol, interval=interval,
+                                   outputsize=outputsize, month=month, extended_hours=extended_hours)
+        return parse_time_series(payload)
+
+
+async def _download_and_save(symbols, fetch, save, downloader):
+    loop = asyncio.get_running_loop()
+    failed_symbols = {}
+    # saving runs on one thread so a database connection is never used concurrently, and downloads
+    # continue while it writes
+    with ThreadPoolExecutor(max_workers=1) as save_executor:
+        async def download_and_save_symbol(symbol):
+            try:
+                data, meta_data = await fetch(downloader, symbol)
+                await loop.run_in_executor(save_executor, save, symbol, data, meta_data)
+            except Exception as e:
+                failed_symbols[symbol] = str(e)
+                print(f'{symbol} failed: {e}')
+
+        async with downloader:
+            await asyncio.gather(*(download_and_save_symbol(symbol) for symbol in symbols))
+    return failed_symbols
+
+
+def download_and_save(symbols, fetch, save, downloader=None, **downloader_kwargs):
+    """
+    Download the data of many symbols concurrently and save each one as soon as it arrives.
+
+    Args:
+        symbols: list of ticker symbols
+        fetch: coroutine function (downloader, symbol) returning (data, meta_data),
+            e.g. lambda downloader, symbol: downloader.get_daily_adjusted(symbol)
+        save: function (symbol, data, meta_data), e.g. writing to HDF5 or Postgres
+        downloader: RateLimitedSession to download with, e.g. a scrape_events.FinvizFetcher (default is an
+            AlphaVantageDownloader)
+        **downloader_kwargs: arguments of AlphaVantageDownloader such as requests_per_minute and concurrency
+
+    Returns:
+        dict of error messages keyed by the symbols that could not be downloaded or saved
+    """
+    downloader = downloader or AlphaVantageDownloader(**downloader_kwargs)
+    start = time.perf_counter()
+    failed_symbols = asyncio.run(_download_and_save(symbols, fetch, save, downloader))
+    seconds = time.perf_counter() - start
+    cache_hits = f', {downloader.cache.hits} from cache' if downloader.cache is not None else ''
+    print(f'{len(symbols) - len(failed_symbols)}/{len(symbols)} symbols in {seconds:.1f} s, '
+          f'{downloader.requests} requests, {downloader.retries} retries{cache_hits}')
+    return failed_symbols
@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+
+# trading days returned by an Alpha Vantage request with outputsize='compact'
+COMPACT_ROWS = 100
+# rows assumed for the full history of a ticker that is not stored yet
+FULL_ROWS_ESTIMATE = 5000
+
+plan_columns = ['outputsize', 'reason', 'last_date', 'missing_days', 'download_rows', 'new_rows']
+
+
+def get_last_dates_sql(cur, tables, symbols=None, as_of=None):
+    """
+    Read the stored daily history of each ticker.
+
+    Returns:
+        pandas DataFrame indexed by ticker symbol with the columns
+            last_date: date of the last stored quote, NaT if nothing is stored
+            row_count: number of stored quotes
+            readjust: boolean, a split or dividend changed the adjusted history after the last full download,
+                either in the stored quotes or in the split and dividend events up to as_of
+    """
+    as_of = pd.Timestamp(as_of or pd.Timestamp.today()).date()
+    symbol_filter = 'WHERE t.ticker_symbol = ANY(%(symbols)s)' if symbols is not None else ''
+    cur.execute(f"""
+        WITH last_quote AS (
+            SELECT ticker_id, max(date) AS last_date, count(*) AS row_count
+            FROM {tables['stock_quotes_daily_table']}
+            GROUP BY ticker_id
+        ),
+        last_full AS (
+            -- quotes adjusted up to this date were downloaded in full
+            SELECT ticker_id, max(last_refreshed)::date AS last_full_date
+            FROM {tables['meta_data_table']}
+            WHERE interval = '1day' AND output_size ILIKE 'full%%'
+            GROUP BY ticker_id
+        ),
+        last_event AS (
+            SELECT ticker_id, max(date) AS last_event_date
+            FROM {tables['stock_quotes_daily_table']}
+            WHERE split_coefficient <> 1 OR dividend_amount <> 0
+            GROUP BY ticker_id
+        ),
+        pending_event AS (
+            -- events that are not in the stored quotes yet
+            SELECT e.ticker_id, max(e.date_timestamp)::date AS pending_event_date
+            FROM (
+                SELECT ticker_id, date_timestamp FROM {tables['split_table']}
+                UNION ALL
+                SELECT ticker_id, date_timestamp FROM {tables['dividends_table']}
+            ) e
+            JOIN last_quote q ON q.ticker_id = e.ticker_id
+            WHERE e.date_timestamp::date > q.last_date AND e.date_timestamp::date <= %(as_of)s
+            GROUP BY e.ticker_id
+        )
+        SELECT t.ticker_symbol, q.last_date, coalesce(q.row_count, 0),
+            (e.last_event_date > coalesce(f.last_full_date, '-infinity'::date)
+             OR p.pending_event_date IS NOT NULL) IS TRUE
+        FROM {tables['reference_table']} t
+        LEFT JOIN last_quote q ON q.ticker_id = t.ticker_id
+        LEFT JOIN last_full f ON f.ticker_id = t.ticker_id
+        LEFT JOIN last_event e ON e.ticker_id = t.ticker_id
+        LEFT JOIN pending_event p ON p.ticker_id = t.ticker_id
+        {symbol_filter}
+        ORDER BY t.ticker_symbol
+    """, {'symbols': list(symbols) if symbols is not None else None, 'as_of': as_of})
+    last_dates = pd.DataFrame(cur.fetchall(), columns=['symbol', 'last_date', 'row_count', 'readjust'])
+    last_dates['last_date'] = pd.to_datetime(last_dates['last_date'])
+    last_dates = last_dates.set_index('symbol')
+    if symbols is not None:
+        # symbols missing from the reference table are left out
+        last_dates = last_dates.loc[[symbol for symbol in symbols if symbol in last_dates.index]]
+    return last_dates
+
+
+def get_last_dates_hdf5(path, directory, symbols):
+    """
+    Read the stored daily history of each ticker from an HDF5 store written by get_ticker_data.save_hdf5.
+
+    Stored prices are adjusted with the history known at download time, a changed adjustment is only found when
+    the new quotes are merged (see get_ticker_data.save_hdf5), so readjust is always False.
+    """
+    rows = []
+    with pd.HDFStore(path, mode='r') as store:
+        keys = set(store.keys())
+        for symbol in symbols:
+            key = f'/{directory}/{symbol}'
+            if key in keys:
+                row_count = store.get_storer(key).nrows
+                last_date = store.select(key, start=row_count - 1, columns=[]).index[-1] if row_count else pd.NaT
+            else:
+                row_count, last_date = 0, pd.NaT
+            rows.append((symbol, last_date, row_count, False))
+    last_dates = pd.DataFrame(rows, columns=['symbol', 'last_date', 'row_count', 'readjust'])
+    last_dates['last_date'] = pd.to_datetime(last_dates['last_date'])
+    return last_dates.set_index('symbol')
+
+
+def plan_downloads(last_dates, as_of=None, margin=5, compact_rows=COMPACT_ROWS, full_rows=FULL_ROWS_ESTIMATE):
+    """
+    Choose the output size of the daily download of each ticker from its stored history.
+
+    A ticker is downloaded in full when nothing is stored, when its adjusted history has to be replaced or
+    when more trading days are missing than a compact download returns. Tickers that are up to date as of the
+    last business day are skipped.
+
+    Args:
+        last_dates: DataFrame of get_last_dates_sql or get_last_dates_hdf5
+        as_of: date the quotes should be complete up to (default is today)
+        margin: int, missing trading days kept below compact_rows to allow for holidays (default is 5)
+
+    Returns:
+        pandas DataFrame indexed by ticker symbol with the columns
+            outputsize: 'compact', 'full' or None for skipped tickers
+            reason: 'new', 'readjust', 'gap', 'update' or 'current'
+            last_date: date of the last stored quote
+            missing_days: business days after last_date up to as_of
+            download_rows: expected rows of the response
+            new_rows: expected rows that are not stored yet
+    """
+    last_business_day = np.busday_offset(pd.Timestamp(as_of or pd.Timestamp.today()).date(), 0, roll='backward')
+    last_date = last_dates['last_date'].to_numpy(dtype='datetime64[D]')
+    stored = ~np.isnat(last_date)
+    missing_days = np.where(
+        stored, np.busday_count(np.where(stored, last_date, last_business_day) + 1, last_business_day + 1), 0)
+    missing_days = np.maximum(missing_days, 0)
+    row_count = last_dates['row_count'].to_numpy()
+    readjust = last_dates['readjust'].to_numpy(dtype=bool)
+
+    conditions = [~stored, readjust, missing_days > compact_rows - margin, missing_days > 0]
+    reason = np.select(conditions, ['new', 'readjust', 'gap', 'update'], 'current')
+    outputsize = np.select(conditions, ['full', 'full', 'full', 'compact'], None)
+    download_rows = np.select(conditions, [full_rows, row_count + missing_days, row_count + missing_days,
+                                           compact_rows], 0)
+    new_rows = np.where(stored, missing_days, full_rows)
+
+    return pd.DataFrame({
+        'outputsize': outputsize,
+        'reason': reason,
+        'last_date': last_dates['last_date'].to_numpy(),
+        'missing_days': missing_days,
+        'download_rows': download_rows,
+        'new_rows': new_rows,
+    }, index=last_dates.index)[plan_columns]
+
+
+def plan_daily_downloads_sql(cur, tables, symbols=None, as_of=None, **kwargs):
+    return plan_downloads(get_last_dates_sql(cur, tables, symbols, as_of=as_of), as_of=as_of, **kwargs)
+
+
+def plan_daily_downloads_hdf5(path, directory, symbols, as_of=None, **kwargs):
+    return plan_downloads(get_last_dates_hdf5(path, directory, symbols), as_of=as_of, **kwargs)
+
+
+def get_work_queue(plan):
+    """
+    Group the planned downloads into work items for the downloaders, full downloads first.
+
+    Returns:
+        list of (outputsize, readjust, symbols), readjust is True when the stored quotes are to be replaced
+    """
+    work_queue = []
+    for outputsize, readjust in [('full', True), ('full', False), ('compact', False)]:
+        selected = (plan['outputsize'] == outputsize) & ((plan['reason'] == 'readjust') == readjust)
+        if selected.any():
+            work_queue.append((outputsize, readjust, plan.index[selected].tolist()))
+    return work_queue
+
+
+def plan_report(plan, requests_per_minute=75):
+    """Summary of a download plan: API calls and rows per reason and the expected download time."""
+    summary = plan.groupby('reason').agg(
+        outputsize=('outputsize', 'first'),
+        tickers=('outputsize', 'size'),
+        api_calls=('outputsize', 'count'),
+        download_rows=('download_rows', 'sum'),
+        new_rows=('new_rows', 'sum'),
+    )
+    summary = summary.loc[[reason for reason in ['new', 'readjust', 'gap', 'update', 'current']
+                           if reason in summary.index]]
+    api_calls = int(summary['api_calls'].sum())
+    lines = [
+        summary.to_string(),
+        f'{api_calls} API calls for {len(plan)} tickers, {int(summary["download_rows"].sum())} rows downloaded, '
+        f'{int(summary["new_rows"].sum())} new rows, about {api_calls / requests_per_minute:.1f} minutes '
+        f'at {requests_per_minute} requests per minute',
+    ]
+    return '\n'.join(lines)
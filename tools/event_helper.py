@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+NANOSECONDS_PER_DAY = 24 * 60 * 60 * 10 ** 9
+
+event_types = {
+    'earnings': 'chartEvent/earnings',
+    'dividends': 'chartEvent/dividends',
+    'split': 'chartEvent/split',
+}
+
+
+def get_event_dates(df, event_type, tz='US/Eastern'):
+    """
+    Get the dates of one type of chart event converted from UTC to a target timezone.
+
+    Args:
+        df: pandas DataFrame, chart events with 'eventType' and 'dateTimestamp' (naive UTC) columns
+        event_type: str, event type as stored by Finviz, e.g. 'chartEvent/earnings'
+        tz: str, timezone to convert the event dates to (default is 'US/Eastern')
+
+    Returns:
+        pandas Series of timezone aware event dates, indexed like the matching rows of df
+    """
+    event_dates = pd.to_datetime(df.loc[df['eventType'] == event_type, 'dateTimestamp'])
+    return event_dates.dt.tz_localize('UTC').dt.tz_convert(tz)
+
+
+def _to_nanoseconds(dates):
+    """Nanoseconds since epoch (UTC for timezone aware input) of a sequence of dates"""
+    return pd.DatetimeIndex(dates).asi8
+
+
+def align_event_dates(dates, event_dates):
+    """
+    Align each date with the closest event on or before it and the closest event after it.
+
+    Events are sorted once and every date is located with a single binary search, so the cost is
+    O((bars + events) log events) instead of filtering all events for every bar.
+
+    Args:
+        dates: DatetimeIndex (or array-like of datetimes) to align, does not need to be sorted
+        event_dates: array-like of event datetimes, NaT values are ignored
+
+    Returns:
+        days_since: numpy array, calendar days since the last event, counting the day of the event as 1
+        days_until: numpy array, calendar days until the next event, counting the next day as 1
+        Both contain NaN where there is no event on that side of the date.
+    """
+    dates_ns = _to_nanoseconds(dates)
+    event_dates = pd.DatetimeIndex(event_dates)
+    events_ns = np.sort(event_dates[~event_dates.isna()].asi8)
+
+    days_since = np.full(dates_ns.shape, np.nan)
+    days_until = np.full(dates_ns.shape, np.nan)
+    if events_ns.size == 0:
+        return days_since, days_until
+
+    # position of the first event strictly after each date
+    next_position = np.searchsorted(events_ns, dates_ns, side='right')
+
+    has_past = next_position > 0
+    last_event_ns = events_ns[next_position[has_past] - 1]
+    days_since[has_past] = (dates_ns[has_past] - last_event_ns) // NANOSECONDS_PER_DAY + 1
+
+    has_future = next_position < events_ns.size
+    next_event_ns = events_ns[next_position[has_future]]
+    days_until[has_future] = (next_event_ns - dates_ns[has_future]) // NANOSECONDS_PER_DAY + 1
+
+    return days_since, days_until
+
+
+def calculate_event_features(dates, events_df, event_names=('earnings', 'dividends', 'split'), tz='US/Eastern'):
+    """
+    Calculate days since and days until each type of chart event for every date.
+
+    Args:
+        dates: DatetimeIndex, timezone aware dates of the price bars
+        events_df: pandas DataFrame, chart events with 'eventType' and 'dateTimestamp' columns
+        event_names: iterable of keys of event_types to calculate features for
+        tz: str, timezone the event dates are converted to before alignment
+
+    Returns:
+        pandas DataFrame indexed by dates with 'days_since_{name}' and 'days_until_{name}' columns
+    """
+    features = {}
+    for name in event_names:
+        event_dates = get_event_dates(events_df, event_types[name], tz=tz)
+        days_since, days_until = align_event_dates(dates, event_dates)
+        features[f'days_since_{name}'] = days_since
+        features[f'days_until_{name}'] = days_until
+    return pd.DataFrame(features, index=dates)
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import pandas as pd
+
+from tools.disk_cache import DiskCache
+
+# Bump when the feature engineering in data_helper changes so cached features are not reused
+FEATURE_VERSION = 1
+
+
+def fingerprint(*frames, **params):
+    """
+    Hash the content of DataFrames (values, index and column names) together with parameters.
+
+    Args:
+        *frames: pandas DataFrames or Series the output depends on
+        **params: JSON serializable parameters the output depends on
+
+    Returns:
+        str, hex digest identifying the inputs
+    """
+    h = hashlib.sha256()
+    for frame in frames:
+        h.update(pd.util.hash_pandas_object(frame, index=True).values.tobytes())
+        columns = frame.columns if isinstance(frame, pd.DataFrame) else [frame.name]
+        h.update(json.dumps([str(c) for c in columns]).encode())
+    h.update(json.dumps(dict(params, feature_version=FEATURE_VERSION), sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class FeatureCache(DiskCache):
+    """
+    On-disk cache of engineered features, one pickle per symbol named by the fingerprint of its inputs.
+
+    Entries are touched on read so eviction removes the least recently used entries first once the
+    cache grows beyond max_bytes. The cache can be shared by worker processes: entries are written
+    atomically and a missing file is treated as a miss.
+    """
+    suffix = '.pkl'
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        super().__init__(cache_dir, max_bytes)
+
+    def _path(self, symbol, key):
+        return os.path.join(self._group_dir(symbol), f'{key}{self.suffix}')
+
+    def get(self, symbol, key):
+        """Return the cached DataFrame for symbol if it was computed from inputs with this fingerprint."""
+        path = self._path(symbol, key)
+        try:
+            _, _, df = pd.read_pickle(path)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return df
+
+    def get_latest(self, symbol, params=None):
+        """
+        Return the most recent entry of symbol regardless of its fingerprint, e.g. to update it incrementally.
+
+        Args:
+            symbol: str
+            params: JSON serializable parameters the entry must have been stored with, e.g. the date range of
+                the history it was engineered from
+
+        Returns:
+            pandas DataFrame, None when there is no entry or it was engineered by other code or parameters
+        """
+        for _, path, _ in sorted(self._entries(symbol), reverse=True):
+            try:
+                feature_version, entry_params, df = pd.read_pickle(path)
+            except FileNotFoundError:
+                continue
+            # features engineered by older code or from another history cannot be extended
+            return df if feature_version == FEATURE_VERSION and entry_params == (params or {}) else None
+        return None
+
+    def put(self, symbol, key, df, params=None):
+        """Store the features of symbol with the params get_latest matches, replacing entries of older inputs."""
+        path = self._path(symbol, key)
+        for _, stale_path, _ in self._entries(symbol):
+            if stale_path != path:
+                self._remove(stale_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        pd.to_pickle((FEATURE_VERSION, params or {}, df), tmp_path)
+        self._replace(tmp_path, path)
+
+    def invalidate(self, symbol=None):
+        """
+        Remove cached entries.
+
+        Args:
+            symbol: str, remove only the entries of this symbol, all entries when None
+
+        Returns:
+            int, number of removed entries
+        """
+        return super().invalidate(symbol)
@@ -1,105 +1,382 @@
 from alpha_vantage.timeseries import TimeSeries
+import numpy as np
 import os
 import pandas as pd
 import psycopg2
+from psycopg2.extras import execute_values
 import time
 from tools import get_daily_adjusted_processed, calculate_ichimoku
-from tools.database_helper import get_ticker_id
+from tools.database_helper import bulk_upsert, create_month_partitions, is_partitioned
+from tools.download_helper import download_and_save
+from tools.hdf5_helper import HDF5BatchWriter
+from tools.intraday_backfill import BackfillCheckpoint, BackfillProgress, backfill_report, get_backfill_queue, \
+    get_months, get_stored_rows_sql, plan_backfill
+from tools.download_planner import get_work_queue, plan_daily_downloads_hdf5, plan_daily_downloads_sql, \
+    plan_report
 
 
 def main(symbols, path=None, table_prefix='stock_quotes', save_type='psql', outputsize='full',
-         conn=None, cur=None):
+         conn=None, cur=None, requests_per_minute=None, concurrency=8, dry_run=False, cache=None):
+    """
+    Download daily adjusted quotes and save them to HDF5 or Postgres.
 
+    Args:
+        outputsize: str, 'compact', 'full' or 'auto' to choose per ticker from the stored quotes (default is 'full')
+        requests_per_minute: float, download concurrently at this rate with tools.download_helper, one symbol
+            after another with the alpha_vantage client when None and no cache is given (default is None)
+        concurrency: int, maximum number of open requests when downloading concurrently (default is 8)
+        dry_run: boolean, only print the download plan of outputsize='auto' (default is False)
+        cache: tools.response_cache.ResponseCache serving responses downloaded before, e.g. after a crash
+    """
     if save_type == 'hdf5':
         index_etfs = ['SPY', 'QQQ', 'DIA', 'IWM']
-        download_and_save_hdf5(index_etfs, path, 'indices')
-        download_and_save_hdf5(symbols, path, 'prices')
+        download_and_save_hdf5(index_etfs, path, 'indices', outputsize=outputsize,
+                               requests_per_minute=requests_per_minute, concurrency=concurrency, dry_run=dry_run,
+                               cache=cache)
+        download_and_save_hdf5(symbols, path, 'prices', outputsize=outputsize,
+                               requests_per_minute=requests_per_minute, concurrency=concurrency, dry_run=dry_run,
+                               cache=cache)
     elif save_type == 'psql':
         download_and_save_daily_adjusted_sql(
             symbols, conn=conn, cur=cur,
             table_prefix=table_prefix,
             outputsize=outputsize, sleep_time=0.1,
+            requests_per_minute=requests_per_minute, concurrency=concurrency, dry_run=dry_run, cache=cache,
         )
     else:
         raise Exception('Unknown save type. Choose from "hdf5" or "psql"')
 
 
-def download_and_save_hdf5(symbols, path, directory, sleep_time=0.1, outputsize='full'):
-    for symbol in symbols:
-        print(symbol)
-        # get technical indicators
-        ts = TimeSeries(key=os.environ.get('ALPHAVANTAGE_API_KEY'), output_format='pandas')
-        data, meta_data = ts.get_daily_adjusted(symbol=symbol, outputsize=outputsize)
-        data = get_daily_adjusted_processed(data)
-        data = calculate_ichimoku(data)
-        # Create an HDF5 file (if it doesn't exist) and open it in append mode
-        with pd.HDFStore(path, mode='a') as store:
-            # Save each DataFrame to the store
-            store.put(f'{directory}/{symbol}', data, format='table', data_columns=True)
-        time.sleep(sleep_time)
+def save_hdf5(writer, directory, symbol, data, merge=False):
+    """
+    Save daily adjusted quotes to an HDF5 store, only the rows that changed are written.
+
+    Args:
+        writer: open tools.hdf5_helper.HDF5BatchWriter
+        merge: boolean, add the quotes to the stored ones instead of replacing them, e.g. after a compact
+            download. Raises ReadjustmentError when the adjusted close of the overlapping days changed, as the
+            stored history then needs a full download (default is False)
+    """
+    data = get_daily_adjusted_processed(data)
+    key = f'{directory}/{symbol}'
+    stored = writer.read(key, columns=data.columns.tolist()) if merge else None
+    if stored is not None:
+        overlap = stored.index.intersection(data.index)
+        if overlap.empty or not np.allclose(stored.loc[overlap, 'close'], data.loc[overlap, 'close'], rtol=1e-6):
+            raise ReadjustmentError(f'Adjusted history of {symbol} changed, download it with outputsize="full"')
+        data = pd.concat([stored[stored.index < data.index[0]], data])
+    data = calculate_ichimoku(data)
+    # the chikou span of the last stored rows and the new quotes are written
+    writer.write(key, data)
+
+
+class ReadjustmentError(Exception):
+    pass
+
+
+def download_and_save_hdf5(symbols, path, directory, sleep_time=0.1, outputsize='full', requests_per_minute=None,
+                           concurrency=8, dry_run=False, as_of=None, cache=None, complevel=5, complib='blosc:zstd',
+                           readjust_symbols=None):
+    """
+    Download daily adjusted quotes and save them to an HDF5 store kept open while saving, compressed with
+    complib at complevel.
+
+    With outputsize='auto' the output size of each ticker is chosen from the stored quotes as of as_of (default is
+    today), compact downloads are merged into the store and tickers whose adjusted history changed are downloaded
+    again in full.
+
+    Args:
+        readjust_symbols: set the symbols whose compact download raised ReadjustmentError are added to
+
+    Returns:
+        dict of error messages keyed by the symbols that could not be downloaded or saved, the download plan
+        when dry_run
+    """
+    if outputsize == 'auto':
+        plan = plan_daily_downloads_hdf5(path, directory, symbols, as_of=as_of)
+        print(plan_report(plan, requests_per_minute=requests_per_minute or 75))
+        if dry_run:
+            return plan
+        failed_symbols = {}
+        readjust_symbols = set()
+        for outputsize, _, work_symbols in get_work_queue(plan):
+            failed_symbols.update(download_and_save_hdf5(
+                work_symbols, path, directory, sleep_time=sleep_time, outputsize=outputsize,
+                requests_per_minute=requests_per_minute, concurrency=concurrency, cache=cache, complevel=complevel,
+                complib=complib, readjust_symbols=readjust_symbols))
+        if readjust_symbols:
+            for symbol in readjust_symbols:
+                failed_symbols.pop(symbol, None)
+            failed_symbols.update(download_and_save_hdf5(
+                sorted(readjust_symbols), path, directory, sleep_time=sleep_time, outputsize='full',
+                requests_per_minute=requests_per_minute, concurrency=concurrency, cache=cache, complevel=complevel,
+                complib=complib))
+        return failed_symbols
+
+    merge = outputsize == 'compact'
+    with HDF5BatchWriter(path, complevel=complevel, complib=complib) as writer:
+        def save(symbol, data, meta_data=None):
+            try:
+                save_hdf5(writer, directory, symbol, data, merge=merge)
+            except ReadjustmentError:
+                if readjust_symbols is not None:
+                    readjust_symbols.add(symbol)
+                raise
+
+        if requests_per_minute or cache is not None:
+            return download_and_save(
+                symbols,
+                lambda downloader, symbol: downloader.get_daily_adjusted(symbol, outputsize=outputsize),
+                save,
+                requests_per_minute=requests_per_minute or 75, concurrency=concurrency, cache=cache)
+
+        failed_symbols = {}
+        for symbol in symbols:
+            print(symbol)
+            # get technical indicators
+            ts = TimeSeries(key=os.environ.get('ALPHAVANTAGE_API_KEY'), output_format='pandas')
+            data, meta_data = ts.get_daily_adjusted(symbol=symbol, outputsize=outputsize)
+            try:
+                save(symbol, data, meta_data)
+            except ReadjustmentError as e:
+                failed_symbols[symbol] = str(e)
+            time.sleep(sleep_time)
+    return failed_symbols
+
+
+# database columns of the Alpha Vantage time series columns
+daily_adjusted_columns = {
+    '1. open': 'open',
+    '2. high': 'high',
+    '3. low': 'low',
+    '4. close': 'close',
+    '5. adjusted close': 'adjusted_close',
+    '6. volume': 'volume',
+    '7. dividend amount': 'dividend_amount',
+    '8. split coefficient': 'split_coefficient',
+}
+intraday_columns = {
+    '1. open': 'open',
+    '2. high': 'high',
+    '3. low': 'low',
+    '4. close': 'close',
+    '5. volume': 'volume',
+}
+
+
+class QuoteBatchWriter:
+    """
+    Save downloaded quotes of many tickers to Postgres with one metadata insert, one COPY and one commit per
+    batch of tickers. Quotes that are already stored are kept unless update is True.
+
+    Usage:
+        with QuoteBatchWriter(conn, cur, 'stock_quotes_daily', daily_adjusted_columns) as writer:
+            for symbol in symbols:
+                writer(symbol, *ts.get_daily_adjusted(symbol=symbol))
+
+    Args:
+        table: str, quote table with a unique (ticker_id, date_column) constraint
+        columns: dict of the database columns keyed by the columns of the downloaded data
+        date_column: str, 'date' for daily and 'datetime' for intraday quotes (default is 'date')
+        interval: str, interval stored in the metadata, the '4. Interval' of the metadata when None
+            (default is '1day')
+        meta_keys: tuple of the metadata keys of the last refreshed time, output size and time zone
+        batch_size: int, number of tickers written per transaction (default is 50)
+        max_rows: int, rows after which a batch is written even if it has fewer tickers (default is 500000)
+        update: boolean, replace stored quotes, e.g. after a split changed the adjusted history (default is False)
+        prepare: function (cur, df) called with the quotes of a batch before they are written, e.g. to create
+            the partitions they go to
+    """
+    def __init__(self, conn, cur, table, columns, table_prefix='stock_quotes', reference_table='tickers',
+                 date_column='date', interval='1day',
+                 meta_keys=('3. Last Refreshed', '4. Output Size', '5. Time Zone'), batch_size=50, max_rows=500000,
+                 update=False, prepare=None):
+        self.conn = conn
+        self.cur = cur
+        self.table = table
+        self.columns = columns
+        self.metadata_table = f'{table_prefix}_metadata'
+        self.reference_table = reference_table
+        self.date_column = date_column
+        self.interval = interval
+        self.meta_keys = meta_keys
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.update = update
+        self.prepare = prepare
+        self.pending = []
+        self.pending_rows = 0
+        self.failed_symbols = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def __call__(self, ticker_symbol, data, meta_data):
+        self.pending.append((ticker_symbol, data, meta_data))
+        self.pending_rows += len(data)
+        if len(self.pending) >= self.batch_size or self.pending_rows >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        """Write the pending tickers in one transaction, returns the number of inserted quotes."""
+        pending, self.pending, self.pending_rows = self.pending, [], 0
+        if not pending:
+            return 0
+        symbols = [ticker_symbol for ticker_symbol, _, _ in pending]
+        try:
+            row_count = self._write(pending)
+            self.conn.commit()
+            return row_count
+        except Exception as e:
+            self.conn.rollback()
+            for ticker_symbol in symbols:
+                self.failed_symbols[ticker_symbol] = str(e)
+            raise Exception(f'Saving {", ".join(symbols)} failed: {e}') from e
+
+    def _write(self, pending):
+        self.cur.execute(
+            f"SELECT ticker_symbol, ticker_id FROM {self.reference_table} WHERE ticker_symbol = ANY(%s)",
+            ([ticker_symbol for ticker_symbol, _, _ in pending],)
+        )
+        ticker_ids = dict(self.cur.fetchall())
+        for ticker_symbol, _, _ in pending:
+            if ticker_symbol not in ticker_ids:
+                print(f"Ticker not found for {ticker_symbol}.")
+                self.failed_symbols[ticker_symbol] = 'Ticker not found'
+        pending = [item for item in pending if item[0] in ticker_ids]
+        if not pending:
+            return 0
+
+        downloaded = pd.Timestamp.utcnow()
+        last_refreshed, output_size, time_zone = self.meta_keys
+        metadata = [
+            (ticker_ids[ticker_symbol], downloaded, meta_data['1. Information'], meta_data[last_refreshed],
+             self.interval or meta_data['4. Interval'], meta_data[output_size], meta_data[time_zone])
+            for ticker_symbol, _, meta_data in pending
+        ]
+        # a batch may hold several downloads of a ticker, e.g. the months of a backfill, so the metadata ids are
+        # matched by position: the rows of a single VALUES list are returned in order
+        metadata_ids = [metadata_id for metadata_id, in execute_values(
+            self.cur,
+            f"""
+            INSERT INTO {self.metadata_table} (ticker_id, datetime, information, last_refreshed, interval,
+                output_size, time_zone)
+            VALUES %s
+            RETURNING metadata_id
+            """,
+            metadata, page_size=len(metadata), fetch=True
+        )]
+
+        frames = []
+        for (ticker_symbol, data, _), metadata_id in zip(pending, metadata_ids):
+            df = data[list(self.columns)].rename(columns=self.columns)
+            df.insert(0, self.date_column, data.index)
+            df.insert(0, 'ticker_id', ticker_ids[ticker_symbol])
+            df.insert(2, 'metadata_id', metadata_id)
+            frames.append(df)
+        df = pd.concat(frames, ignore_index=True)
+        if self.prepare is not None:
+            self.prepare(self.cur, df)
+        return bulk_upsert(self.cur, df, self.table, conflict_columns=('ticker_id', self.date_column),
+                           update=self.update)
 
 
 def download_and_save_daily_adjusted_sql(
         symbols, conn, cur, table_prefix='stock_quotes',
         reference_table='tickers', outputsize='full',
-        sleep_time=0.1):
-    metadata_table = f'{table_prefix}_metadata'
-    stock_quotes_daily_table = f'{table_prefix}_daily'
-
-    meta_query = """
-                INSERT INTO {} (ticker_id, datetime, information, last_refreshed, interval, output_size, time_zone)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                RETURNING metadata_id
-                """.format(metadata_table)
-
-    query = """
-        INSERT INTO {} (ticker_id, date, metadata_id, open, high, low, close, adjusted_close, volume, 
-        dividend_amount, split_coefficient)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (ticker_id, date) DO NOTHING;
-        """.format(stock_quotes_daily_table)
-
-    for ticker_symbol in symbols:
-        print(ticker_symbol)
-        ticker_id = get_ticker_id(cur, ticker_symbol, reference_table=reference_table)
-
-        ts = TimeSeries(key=os.environ.get('ALPHAVANTAGE_API_KEY'), output_format='pandas')
-        data, meta_data = ts.get_daily_adjusted(symbol=ticker_symbol, outputsize=outputsize)
-
-        cur.execute(
-            meta_query,
-            (ticker_id, pd.Timestamp.utcnow(), meta_data['1. Information'],
-             meta_data['3. Last Refreshed'], '1day',
-             meta_data['4. Output Size'], meta_data['5. Time Zone'])
-        )
-        # Fetch the returned metadata_id
-        metadata_id = cur.fetchone()[0]
-        conn.commit()
+        sleep_time=0.1, requests_per_minute=None, concurrency=8, batch_size=50, update=False, dry_run=False,
+        as_of=None, cache=None):
+    """
+    Download daily adjusted quotes and save them batch_size tickers at a time.
 
-        # Insert data into PostgreSQL database
-        for index, row in data.iterrows():
-            cur.execute(
-                query,
-                (ticker_id, index, metadata_id, row['1. open'], row['2. high'], row['3. low'], row['4. close'],
-                 row['5. adjusted close'],
-                 row['6. volume'], row['7. dividend amount'], row['8. split coefficient'])
-            )
-        conn.commit()
-        time.sleep(sleep_time)
+    With outputsize='auto' the output size of each ticker is chosen from the stored quotes as of as_of (default is
+    today) and the stored quotes of tickers with a new split or dividend are replaced by a full download.
 
+    Returns:
+        dict of error messages keyed by the symbols that could not be downloaded or saved, the download plan
+        when dry_run
+    """
+    if outputsize == 'auto':
+        tables = {
+            'reference_table': reference_table,
+            'stock_quotes_daily_table': f'{table_prefix}_daily',
+            'meta_data_table': f'{table_prefix}_metadata',
+            'dividends_table': 'dividends',
+            'split_table': 'split',
+        }
+        plan = plan_daily_downloads_sql(cur, tables, symbols, as_of=as_of)
+        print(plan_report(plan, requests_per_minute=requests_per_minute or 75))
+        if dry_run:
+            return plan
+        failed_symbols = {}
+        for outputsize, readjust, work_symbols in get_work_queue(plan):
+            failed_symbols.update(download_and_save_daily_adjusted_sql(
+                work_symbols, conn, cur, table_prefix=table_prefix, reference_table=reference_table,
+                outputsize=outputsize, sleep_time=sleep_time, requests_per_minute=requests_per_minute,
+                concurrency=concurrency, batch_size=batch_size, update=readjust, cache=cache))
+        return failed_symbols
+
+    writer = QuoteBatchWriter(conn, cur, f'{table_prefix}_daily', daily_adjusted_columns,
+                              table_prefix=table_prefix, reference_table=reference_table, batch_size=batch_size,
+                              update=update)
+    with writer:
+        if requests_per_minute or cache is not None:
+            failed_symbols = download_and_save(
+                symbols,
+                lambda downloader, symbol: downloader.get_daily_adjusted(symbol, outputsize=outputsize),
+                writer, requests_per_minute=requests_per_minute or 75, concurrency=concurrency, cache=cache)
+        else:
+            failed_symbols = {}
+            for ticker_symbol in symbols:
+                print(ticker_symbol)
+                ts = TimeSeries(key=os.environ.get('ALPHAVANTAGE_API_KEY'), output_format='pandas')
+                data, meta_data = ts.get_daily_adjusted(symbol=ticker_symbol, outputsize=outputsize)
+                writer(ticker_symbol, data, meta_data)
+                time.sleep(sleep_time)
+    return {**failed_symbols, **writer.failed_symbols}
 
-def download_and_save_intraday_sql(
-        symbols, conn, cur, table_prefix='stock_quotes', reference_table='tickers', interval='1min', outputsize='compact', month='',
-        extended_hours='false',
-        sleep_time=0.1):
 
+def create_intraday_table(conn, cur, table_prefix='stock_quotes', reference_table='tickers', interval='1min',
+                          partitioned=True):
+    """
+    Create the table of intraday quotes of an interval.
+
+    Args:
+        partitioned: boolean, partition the table by month of datetime, the partitions are created by
+            create_month_partitions when quotes are saved. Tables created before stay as they are (default is True)
+    """
     metadata_table = f'{table_prefix}_metadata'
 
     stock_quotes_intraday_table = f'{table_prefix}_{interval}'
 
+    if not partitioned:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {stock_quotes_intraday_table} (
+                id SERIAL PRIMARY KEY,
+                ticker_id INT NOT NULL,
+                datetime TIMESTAMP NOT NULL,
+                metadata_id INT NOT NULL,
+                open FLOAT,
+                high FLOAT,
+                low FLOAT,
+                close FLOAT,
+                volume BIGINT,
+                FOREIGN KEY (ticker_id) REFERENCES {reference_table}(ticker_id),
+                FOREIGN KEY (metadata_id) REFERENCES {metadata_table}(metadata_id),
+                UNIQUE (ticker_id, datetime)
+            );
+        """)
+        conn.commit()
+        return stock_quotes_intraday_table
+
+    # unique constraints of a partitioned table include the partition key, so quotes are identified by
+    # (ticker_id, datetime) instead of a serial id
     cur.execute(f"""
         CREATE TABLE IF NOT EXISTS {stock_quotes_intraday_table} (
-            id SERIAL PRIMARY KEY,
             ticker_id INT NOT NULL,
             datetime TIMESTAMP NOT NULL,
             metadata_id INT NOT NULL,
@@ -110,48 +387,172 @@ def download_and_save_intraday_sql(
             volume BIGINT,
             FOREIGN KEY (ticker_id) REFERENCES {reference_table}(ticker_id),
             FOREIGN KEY (metadata_id) REFERENCES {metadata_table}(metadata_id),
-            UNIQUE (ticker_id, datetime)
-        );
+            PRIMARY KEY (ticker_id, datetime)
+        ) PARTITION BY RANGE (datetime);
+    """)
+    # quotes are inserted in datetime order, so a BRIN index of a few pages finds the blocks of a time range
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS {stock_quotes_intraday_table}_datetime_brin
+        ON {stock_quotes_intraday_table} USING brin (datetime)
     """)
     conn.commit()
+    return stock_quotes_intraday_table
 
-    meta_query = """
-            INSERT INTO {} (ticker_id, datetime, information, last_refreshed, interval, output_size, time_zone)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING metadata_id
-            """.format(metadata_table)
 
+def intraday_writer(conn, cur, table, table_prefix='stock_quotes', reference_table='tickers', batch_size=50,
+                    ticker_partitions=0):
+    """
+    QuoteBatchWriter of intraday quotes that creates the partitions of the months of the quotes while saving, each
+    divided into ticker_partitions partitions by hash of the ticker when given.
+    """
+    prepare = None
+    if is_partitioned(cur, table):
+        def prepare(cur, df):
+            create_month_partitions(cur, table, df['datetime'], ticker_partitions=ticker_partitions)
 
-    query = """
-        INSERT INTO {} (ticker_id, datetime, metadata_id, open, high, low, close, volume)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (ticker_id, datetime) DO NOTHING;
-        """.format(stock_quotes_intraday_table)
+    return QuoteBatchWriter(conn, cur, table, intraday_columns,
+                            table_prefix=table_prefix, reference_table=reference_table,
+                            date_column='datetime', interval=None,
+                            meta_keys=('3. Last Refreshed', '5. Output Size', '6. Time Zone'), batch_size=batch_size,
+                            prepare=prepare)
 
-    for ticker_symbol in symbols:
-        print(ticker_symbol)
-        ticker_id = get_ticker_id(cur, ticker_symbol, reference_table=reference_table)
 
-        ts = TimeSeries(key=os.environ.get('ALPHAVANTAGE_API_KEY'), output_format='pandas')
-        data, meta_data = ts.get_intraday(
-            symbol=ticker_symbol, interval=interval, outputsize=outputsize,
-            month=month, extended_hours=extended_hours)
+def download_and_save_intraday_sql(
+        symbols, conn, cur, table_prefix='stock_quotes', reference_table='tickers', interval='1min', outputsize='compact', month='',
+        extended_hours='false',
+        sleep_time=0.1, requests_per_minute=None, concurrency=8, batch_size=50, cache=None, ticker_partitions=0):
+    """
+    Download intraday quotes and save them batch_size tickers at a time.
 
-        cur.execute(
-            meta_query,
-            (ticker_id, pd.Timestamp.utcnow(), meta_data['1. Information'],
-             meta_data['3. Last Refreshed'], meta_data['4. Interval'],
-             meta_data['5. Output Size'], meta_data['6. Time Zone'])
-        )
-        # Fetch the returned metadata_id
-        metadata_id = cur.fetchone()[0]
-        conn.commit()
-        # Insert data into PostgreSQL database
-        for index, row in data.iterrows():
-            cur.execute(
-                query,
-                (ticker_id, index, metadata_id, row['1. open'], row['2. high'], row['3. low'], row['4. close'],
-                 row['5. volume'])
-            )
-        conn.commit()
-        time.sleep(sleep_time)
+    The partitions of the months of the quotes are created while saving (see intraday_writer).
+
+    Returns:
+        dict of error messages keyed by the symbols that could not be downloaded or saved
+    """
+    stock_quotes_intraday_table = create_intraday_table(conn, cur, table_prefix=table_prefix,
+                                                        reference_table=reference_table, interval=interval)
+    writer = intraday_writer(conn, cur, stock_quotes_intraday_table, table_prefix=table_prefix,
+                             reference_table=reference_table, batch_size=batch_size,
+                             ticker_partitions=ticker_partitions)
+    with writer:
+        if requests_per_minute or cache is not None:
+            failed_symbols = download_and_save(
+                symbols,
+                lambda downloader, symbol: downloader.get_intraday(
+                    symbol, interval=interval, outputsize=outputsize, month=month, extended_hours=extended_hours),
+                writer, requests_per_minute=requests_per_minute or 75, concurrency=concurrency, cache=cache)
+        else:
+            failed_symbols = {}
+            for ticker_symbol in symbols:
+                print(ticker_symbol)
+                ts = TimeSeries(key=os.environ.get('ALPHAVANTAGE_API_KEY'), output_format='pandas')
+                data, meta_data = ts.get_intraday(
+                    symbol=ticker_symbol, interval=interval, outputsize=outputsize,
+                    month=month, extended_hours=extended_hours)
+                writer(ticker_symbol, data, meta_data)
+                time.sleep(sleep_time)
+    return {**failed_symbols, **writer.failed_symbols}
+
+
+def backfill_intraday_sql(
+        symbols, conn, cur, start_month, end_month=None, intervals=('5min',), table_prefix='stock_quotes',
+        reference_table='tickers', checkpoint_path='res/intraday_backfill.jsonl', extended_hours='false',
+        requests_per_minute=75, concurrency=8, batch_size=50, min_coverage=0.5, ticker_partitions=0, cache=None,
+        dry_run=False, as_of=None):
+    """
+    Download the intraday history of many tickers one month at a time (see tools.intraday_backfill).
+
+    Every (ticker, interval, month) from start_month to end_month (default is this month) is a unit of work. Units
+    that are stored or recorded in the checkpoint file are skipped, the others are downloaded concurrently at
+    requests_per_minute and saved batch_size units per transaction. Saved units are appended to the checkpoint
+    after their transaction commits, so a stopped backfill resumes with the units that were not saved. Progress is
+    printed with the rows per second and the remaining time.
+
+    Args:
+        intervals: tuple of intervals, e.g. ('1min', '5min'), each stored in its own table (default is ('5min',))
+        checkpoint_path: str, JSON lines file of the saved units (default is 'res/intraday_backfill.jsonl')
+        min_coverage: float, share of the regular session bars of a month that have to be stored to skip it
+            (default is 0.5)
+        dry_run: boolean, only print the backfill plan (default is False)
+
+    Returns:
+        dict of error messages keyed by the BackfillUnits that could not be downloaded or saved, the backfill plan
+        when dry_run
+    """
+    months = get_months(start_month, end_month)
+    checkpoint = BackfillCheckpoint(checkpoint_path)
+    tables, stored_rows = {}, {}
+    for interval in intervals:
+        tables[interval] = create_intraday_table(conn, cur, table_prefix=table_prefix,
+                                                 reference_table=reference_table, interval=interval)
+        stored_rows.update(get_stored_rows_sql(cur, tables[interval], interval, symbols, months,
+                                               reference_table=reference_table))
+    conn.commit()
+    plan = plan_backfill(symbols, months, intervals, stored_rows, checkpoint.completed, as_of=as_of,
+                         min_coverage=min_coverage)
+    print(backfill_report(plan, requests_per_minute=requests_per_minute))
+    if dry_run:
+        return plan
+    units = get_backfill_queue(plan)
+    if not units:
+        return {}
+
+    writers = {interval: intraday_writer(conn, cur, table, table_prefix=table_prefix,
+                                         reference_table=reference_table, batch_size=batch_size,
+                                         ticker_partitions=ticker_partitions)
+               for interval, table in tables.items()}
+    pending_units = {interval: [] for interval in intervals}
+    failed_units = {}
+    progress = BackfillProgress(len(units))
+
+    def committed(interval):
+        unit_rows = pending_units[interval]
+        pending_units[interval] = []
+        writer = writers[interval]
+        for unit, _ in unit_rows:
+            if unit.symbol in writer.failed_symbols:
+                failed_units[unit] = writer.failed_symbols[unit.symbol]
+        # failures are kept per unit, later months of a ticker may still be saved
+        writer.failed_symbols.clear()
+        saved = [(unit, rows) for unit, rows in unit_rows if unit not in failed_units]
+        checkpoint.add(saved)
+        progress.update(units=len(saved), rows=sum(rows for _, rows in saved),
+                        failed=len(unit_rows) - len(saved))
+
+    def flush(interval, flush_writer):
+        try:
+            flush_writer()
+        except Exception as e:
+            for unit, _ in pending_units[interval]:
+                failed_units[unit] = str(e)
+            committed(interval)
+            raise
+        # the writer has no pending quotes after it committed a batch
+        if not writers[interval].pending:
+            committed(interval)
+
+    async def fetch(downloader, unit):
+        try:
+            return await downloader.get_intraday(unit.symbol, interval=unit.interval, outputsize='full',
+                                                 month=unit.month, extended_hours=extended_hours)
+        except Exception:
+            progress.update(failed=1)
+            raise
+
+    def save(unit, data, meta_data):
+        if data.empty:
+            # the ticker has no quotes in the month, e.g. before it was listed
+            checkpoint.add([(unit, 0)])
+            progress.update(units=1)
+            return
+        pending_units[unit.interval].append((unit, len(data)))
+        flush(unit.interval, lambda: writers[unit.interval](unit.symbol, data, meta_data))
+
+    failed_units.update(download_and_save(units, fetch, save, requests_per_minute=requests_per_minute,
+                                          concurrency=concurrency, cache=cache))
+    for interval, writer in writers.items():
+        try:
+            flush(interval, writer.flush)
+        except Exception as e:
+            print(e)
+    return failed_units
@@ -0,0 +1,126 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import tables
+
+
+def first_difference(stored, df):
+    """
+    Position of the first row where df differs from the stored frame (index or values), len(stored) when df only
+    adds rows after it.
+    """
+    if not stored.columns.equals(df.columns) or not stored.dtypes.equals(df.dtypes):
+        return 0
+    n = min(len(stored), len(df))
+    stored_head = stored.iloc[:n].reset_index()
+    head = df.iloc[:n].reset_index()
+    different = ~((stored_head == head) | (stored_head.isna() & head.isna()))
+    rows = np.flatnonzero(different.to_numpy().any(axis=1))
+    if len(rows):
+        return int(rows[0])
+    return n if len(df) >= len(stored) else len(df)
+
+
+class HDF5BatchWriter:
+    """
+    Write many table format frames to one HDF5 store while keeping it open, appending only what changed.
+
+    A frame written to an existing node is compared with the stored rows. Only the rows from the first difference
+    on are replaced, so a longer history with the same past is appended without rewriting the node. Nodes are
+    created compressed, nodes written before without compression are compressed by repack.
+
+    Only the index is indexed by default. Indexed data columns make appending slower than rewriting the node, as
+    every index is updated, and the frames are only queried by date (see data_helper.load_frame).
+
+    Usage:
+        with HDF5BatchWriter('data.h5') as writer:
+            for symbol, df in df_dict.items():
+                writer.write(f'prices/{symbol}', df)
+
+    Args:
+        path: str, HDF5 file
+        complevel: int, compression level from 0 (no compression) to 9 (default is 5)
+        complib: str, compression library, e.g. 'blosc:zstd', 'blosc:lz4' or 'zlib' (default is 'blosc:zstd')
+        data_columns: list of the columns to index or True for all columns of new nodes, existing nodes keep their
+            data columns (default is None)
+        verbose: boolean, print the rows, write time and file size of each frame (default is True)
+    """
+    def __init__(self, path, complevel=5, complib='blosc:zstd', data_columns=None, verbose=True):
+        self.path = path
+        self.complevel = complevel
+        self.complib = complib
+        self.data_columns = data_columns
+        self.verbose = verbose
+        self.store = None
+        self.report = []
+
+    def __enter__(self):
+        self.store = pd.HDFStore(self.path, mode='a', complevel=self.complevel, complib=self.complib)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.store.close()
+
+    def read(self, key, columns=None):
+        """Return the stored frame of key, None if it does not exist."""
+        if self.store.get_node(key) is None:
+            return None
+        return self.store.select(key, columns=columns)
+
+    def write(self, key, df):
+        """
+        Store df at key, replacing the stored rows from the first one that differs.
+
+        Returns:
+            int, number of written rows
+        """
+        start = time.perf_counter()
+        stored = self.read(key)
+        position = 0 if stored is None else first_difference(stored, df)
+        if stored is not None and position == 0:
+            self.store.remove(key)
+            stored = None
+        if stored is None:
+            self.store.put(key, df, format='table', data_columns=self.data_columns)
+        else:
+            if position < len(stored):
+                self.store.remove(key, start=position)
+            try:
+                self.store.append(key, df.iloc[position:], format='table', index=False)
+            except ValueError:
+                # the new rows do not fit the stored table, e.g. longer strings than stored before
+                self.store.remove(key)
+                position = 0
+                self.store.put(key, df, format='table', data_columns=self.data_columns)
+        self.store.flush()
+        seconds = time.perf_counter() - start
+        rows = len(df) - position
+        file_size = os.path.getsize(self.path)
+        self.report.append((key, rows, seconds, file_size))
+        if self.verbose:
+            print(f'{key}: {rows} of {len(df)} rows written in {seconds:.3f} s, file size {file_size / 1e6:.1f} MB')
+        return rows
+
+    def get_report(self):
+        """DataFrame of the rows, write time and file size after each written frame."""
+        return pd.DataFrame(self.report, columns=['key', 'rows', 'seconds', 'file_size']).set_index('key')
+
+
+def repack(path, complevel=5, complib='blosc:zstd', output_path=None):
+    """
+    Copy an HDF5 store to a new file, reclaiming the space of removed nodes and rows and compressing every node.
+
+    Args:
+        output_path: str, file of the repacked store, path is replaced when None
+
+    Returns:
+        tuple of the file size before and after repacking in bytes
+    """
+    size_before = os.path.getsize(path)
+    tmp_path = f'{output_path or path}.{os.getpid()}.tmp'
+    tables.copy_file(path, tmp_path, overwrite=True, filters=tables.Filters(complevel=complevel, complib=complib))
+    os.replace(tmp_path, output_path or path)
+    size_after = os.path.getsize(output_path or path)
+    print(f'{path}: {size_before / 1e6:.1f} MB repacked to {size_after / 1e6:.1f} MB')
+    return size_before, size_after
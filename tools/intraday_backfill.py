@@ -0,0 +1,194 @@
+from collections import namedtuple
+import datetime
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# minutes of the regular session from 9:30 to 16:00 US/Eastern
+SESSION_MINUTES = 390
+
+BackfillUnit = namedtuple('BackfillUnit', ['symbol', 'interval', 'month'])
+
+backfill_columns = ['symbol', 'interval', 'month', 'stored_rows', 'expected_rows', 'reason', 'download']
+
+
+def interval_minutes(interval):
+    return int(interval[:-len('min')])
+
+
+def expected_bars(month, interval):
+    """Bars of the regular session in a month of business days, holidays are not left out."""
+    month = pd.Period(month, freq='M')
+    business_days = np.busday_count(month.start_time.date(), (month + 1).start_time.date())
+    # the last bar of a session may be shorter than the interval, e.g. 15:30 to 16:00 of 60min bars
+    return int(business_days) * -(-SESSION_MINUTES // interval_minutes(interval))
+
+
+def get_months(start_month, end_month=None):
+    """Months from start_month to end_month (default is this month) as 'YYYY-MM' strings."""
+    end_month = end_month or pd.Timestamp.today()
+    return [str(month) for month in pd.period_range(start_month, end_month, freq='M')]
+
+
+def get_stored_rows_sql(cur, table, interval, symbols, months, reference_table='tickers'):
+    """
+    Count the stored quotes of each ticker and month of an intraday table.
+
+    Returns:
+        dict of row counts keyed by BackfillUnit, units without quotes are left out
+    """
+    start = pd.Period(min(months), freq='M').start_time
+    end = (pd.Period(max(months), freq='M') + 1).start_time
+    cur.execute(f"""
+        SELECT t.ticker_symbol, to_char(q.datetime, 'YYYY-MM'), count(*)
+        FROM {table} q
+        JOIN {reference_table} t ON t.ticker_id = q.ticker_id
+        WHERE t.ticker_symbol = ANY(%s) AND q.datetime >= %s AND q.datetime < %s
+        GROUP BY 1, 2
+    """, (list(symbols), start, end))
+    return {BackfillUnit(symbol, interval, month): row_count for symbol, month, row_count in cur.fetchall()}
+
+
+class BackfillCheckpoint:
+    """
+    Append-only JSON lines file of the units a backfill has saved, so a restarted backfill skips them.
+
+    Args:
+        path: str, checkpoint file, created with its directory when missing
+    """
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        self._line_open = False
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    self._line_open = not line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # last line cut off by a crash
+                        continue
+                    unit = BackfillUnit(record['symbol'], record['interval'], record['month'])
+                    self.completed[unit] = record['rows']
+
+    def add(self, unit_rows):
+        """Record saved units, unit_rows is a list of (BackfillUnit, rows)."""
+        if not unit_rows:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as f:
+            if self._line_open:
+                f.write('\n')
+                self._line_open = False
+            for unit, rows in unit_rows:
+                f.write(json.dumps({**unit._asdict(), 'rows': rows}) + '\n')
+                self.completed[unit] = rows
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def plan_backfill(symbols, months, intervals, stored_rows=None, completed=(), as_of=None, min_coverage=0.5):
+    """
+    Enumerate the (ticker, interval, month) units of a backfill and choose the ones to download.
+
+    A unit is skipped when it is in the checkpoint or when at least min_coverage of the regular session bars of
+    the month are stored. The month of as_of (default is today) is not over yet and always downloaded.
+
+    Units are ordered by month, oldest first, so quotes are saved in datetime order (see the BRIN index of
+    get_ticker_data.create_intraday_table) and one month partition is filled at a time.
+
+    Args:
+        stored_rows: dict of stored row counts keyed by BackfillUnit, e.g. of get_stored_rows_sql
+        completed: BackfillUnits saved before, e.g. BackfillCheckpoint.completed
+
+    Returns:
+        pandas DataFrame with a row per unit and the columns
+            symbol, interval, month: the unit
+            stored_rows: stored quotes of the unit
+            expected_rows: regular session bars of the month
+            reason: 'new', 'partial' or 'current' for downloaded units, 'stored' or 'checkpoint' for skipped ones
+            download: boolean, the unit is downloaded
+    """
+    stored_rows = stored_rows or {}
+    current_month = str(pd.Timestamp(as_of or pd.Timestamp.today()).to_period('M'))
+    rows = []
+    for month in sorted(months):
+        for interval in intervals:
+            expected_rows = expected_bars(month, interval)
+            for symbol in symbols:
+                unit = BackfillUnit(symbol, interval, month)
+                stored = stored_rows.get(unit, 0)
+                if month >= current_month:
+                    reason = 'current'
+                elif unit in completed:
+                    reason = 'checkpoint'
+                elif stored >= min_coverage * expected_rows:
+                    reason = 'stored'
+                else:
+                    reason = 'partial' if stored else 'new'
+                rows.append((symbol, interval, month, stored, expected_rows, reason,
+                             reason in ('new', 'partial', 'current')))
+    return pd.DataFrame(rows, columns=backfill_columns)
+
+
+def get_backfill_queue(plan):
+    """BackfillUnits to download in the order of the plan."""
+    return [BackfillUnit(*unit) for unit in plan.loc[plan['download'], ['symbol', 'interval', 'month']].itertuples(
+        index=False)]
+
+
+def backfill_report(plan, requests_per_minute=75):
+    """Summary of a backfill plan: units per reason and the expected download time."""
+    summary = plan.groupby('reason').agg(units=('download', 'size'), stored_rows=('stored_rows', 'sum'))
+    summary = summary.loc[[reason for reason in ['new', 'partial', 'current', 'stored', 'checkpoint']
+                           if reason in summary.index]]
+    api_calls = int(plan['download'].sum())
+    return '\n'.join([
+        summary.to_string(),
+        f'{api_calls} API calls for {len(plan)} units, about {api_calls / requests_per_minute:.1f} minutes '
+        f'at {requests_per_minute} requests per minute',
+    ])
+
+
+class BackfillProgress:
+    """
+    Count the finished units and saved rows of a backfill and print the rate and remaining time.
+
+    Updates may come from the download loop and the saving thread at once.
+
+    Args:
+        total_units: int, units to download
+        report_interval: float, seconds between printed reports (default is 30)
+    """
+    def __init__(self, total_units, report_interval=30):
+        self.total_units = total_units
+        self.report_interval = report_interval
+        self.units = 0
+        self.failed = 0
+        self.rows = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self._lock = threading.Lock()
+
+    def update(self, units=0, rows=0, failed=0):
+        with self._lock:
+            self.units += units + failed
+            self.failed += failed
+            self.rows += rows
+            now = time.perf_counter()
+            if now - self.last_report < self.report_interval and self.units < self.total_units:
+                return
+            self.last_report = now
+        print(self.report())
+
+    def report(self):
+        seconds = time.perf_counter() - self.start
+        remaining_units = self.total_units - self.units
+        eta = remaining_units * seconds / self.units if self.units else float('nan')
+        eta = str(datetime.timedelta(seconds=round(eta))) if np.isfinite(eta) else 'unknown'
+        return (f'{self.units}/{self.total_units} units ({self.failed} failed), {self.rows} rows in {seconds:.0f} s, '
+                f'{self.rows / max(seconds, 1e-9):.0f} rows/s, ETA {eta}')
@@ -81,7 +81,8 @@ def asymmetric_squared_error_objective(y_true, y_pred, weight_over=2, weight_und
 
 
 def train_test_split_timeseries(df_dict, target_cols, days_into_future, drop_cols, ohlc_col='close', min_date=None,
-                                test_length=1, test_date=None, drop_earnings=None):
+                                test_length=1, test_date=None, drop_earnings=None,
+                                signal_rule='bullish_cloud_crossover'):
     """"""
     df_full_list = []
     df_train_list = []
@@ -107,7 +108,7 @@ def train_test_split_timeseries(df_dict, target_cols, days_into_future, drop_col
         # filter data for signal before dropping columns
         df_full_list.append(df_temp)
 
-        df_temp = filter_data(df_temp, signal_rule='bullish_cloud_crossover')
+        df_temp = filter_data(df_temp, signal_rule=signal_rule)
 
         # remove earnings surprise element...
         if drop_earnings:
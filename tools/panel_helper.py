@@ -0,0 +1,300 @@
+import numpy as np
+import pandas as pd
+
+from tools.pattern_helper import ichimoku_lines
+from tools.rolling_helper import rolling_window_extremum
+
+
+def build_panel(df_dict, columns):
+    """
+    Align the columns of per-symbol DataFrames into symbols x dates arrays, NaN-padded where a symbol has no row.
+
+    Args:
+        df_dict: dict of pandas DataFrames keyed by symbol, e.g. the df_dict of process_data
+        columns: list of column names, e.g. ['high', 'low', 'close', 'volume']
+
+    Returns:
+        symbols: list of the keys of df_dict, the row order of the arrays
+        dates: pandas DatetimeIndex, union of the indices, the column order of the arrays
+        panel: dict of 2-D numpy arrays keyed by column name
+    """
+    symbols = list(df_dict.keys())
+    dates = pd.DatetimeIndex([])
+    for df in df_dict.values():
+        dates = dates.union(df.index)
+    panel = {column: np.full((len(symbols), len(dates)), np.nan) for column in columns}
+    for row, symbol in enumerate(symbols):
+        df = df_dict[symbol]
+        positions = dates.get_indexer(df.index)
+        for column in columns:
+            panel[column][row, positions] = df[column].to_numpy(dtype=float)
+    return symbols, dates, panel
+
+
+def _apply_left_packed(function, *arrays):
+    """
+    Apply a kernel to the valid values of every row, shifted to the start of the row.
+
+    A date is valid for a symbol when none of the arrays is NaN. Packing the valid dates of each row to the
+    left makes every symbol start at column 0 with no gaps, like the series of a single symbol, so seeds and
+    warm-up periods line up across symbols. The kernel receives dates x symbols arrays, contiguous along the
+    symbols so each time step is one vectorized operation, and its results are put back at the original
+    positions with NaN at invalid dates.
+    """
+    arrays = [np.asarray(values, dtype=float) for values in arrays]
+    valid = ~np.any([np.isnan(values) for values in arrays], axis=0)
+    # the k-th valid date of a row goes to row k of the packed dates x symbols arrays
+    symbols, dates = valid.shape
+    positions = np.flatnonzero(valid)
+    packed_positions = (np.cumsum(valid, axis=1).ravel()[positions] - 1) * symbols + positions // dates
+    packed = []
+    for values in arrays:
+        transposed = np.full((dates, symbols), np.nan)
+        transposed.ravel()[packed_positions] = values.ravel()[positions]
+        packed.append(transposed)
+
+    results = function(*packed)
+    single = not isinstance(results, tuple)
+    unpacked = []
+    for result in ((results,) if single else results):
+        values = np.full((symbols, dates), np.nan)
+        values.ravel()[positions] = result.ravel()[packed_positions]
+        unpacked.append(values)
+    return unpacked[0] if single else tuple(unpacked)
+
+
+def _is_zero(value):
+    # TA_IS_ZERO of TA-Lib
+    return (-0.00000001 < value) & (value < 0.00000001)
+
+
+def _rsi(close, time_period):
+    n, symbols = close.shape
+    rsi = np.full((n, symbols), np.nan)
+    if n <= time_period:
+        return rsi
+
+    # TA-Lib adds a change to the losses when it is negative and to the gains otherwise, also when it is NaN,
+    # adding the zero of the other side keeps the sums unchanged
+    diffs = close[1:] - close[:-1]
+    losses = np.where(diffs < 0, -diffs, 0.0)
+    gains = np.where(diffs < 0, 0.0, diffs)
+
+    average_gain = np.empty((n - time_period, symbols))
+    average_loss = np.empty((n - time_period, symbols))
+    prev_gain = np.zeros(symbols)
+    prev_loss = np.zeros(symbols)
+    for t in range(time_period):
+        prev_gain += gains[t]
+        prev_loss += losses[t]
+    np.divide(prev_gain, time_period, out=average_gain[0])
+    np.divide(prev_loss, time_period, out=average_loss[0])
+    for i in range(1, n - time_period):
+        prev_gain = average_gain[i]
+        np.multiply(average_gain[i - 1], time_period - 1, out=prev_gain)
+        prev_gain += gains[time_period + i - 1]
+        prev_gain /= time_period
+        prev_loss = average_loss[i]
+        np.multiply(average_loss[i - 1], time_period - 1, out=prev_loss)
+        prev_loss += losses[time_period + i - 1]
+        prev_loss /= time_period
+
+    total = average_gain + average_loss
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi[time_period:] = np.where(_is_zero(total), 0.0, 100.0 * (average_gain / total))
+    return rsi
+
+
+def calculate_panel_rsi(close, time_period=14):
+    """
+    Relative Strength Index of every symbol at once, matching talib.RSI of each symbol to floating point rounding.
+
+    Args:
+        close: 2-D numpy array of close prices, symbols x dates, NaN where a symbol has no bar
+
+    Returns:
+        2-D numpy array of RSI, symbols x dates
+    """
+    return _apply_left_packed(lambda c: _rsi(c, time_period), close)
+
+
+def _mfi(high, low, close, volume, time_period):
+    n, symbols = close.shape
+    mfi = np.full((n, symbols), np.nan)
+    if n <= time_period:
+        return mfi
+
+    typical_price = (high + low + close) / 3.0
+    # money flow of each date split into positive and negative, zero on the first date
+    diffs = np.zeros((n, symbols))
+    diffs[1:] = typical_price[1:] - typical_price[:-1]
+    money_flow = typical_price * volume
+    positive_flow = np.where(diffs > 0, money_flow, 0.0)
+    negative_flow = np.where(diffs < 0, money_flow, 0.0)
+
+    # running sums updated like TA-Lib's circular buffer to keep its rounding
+    positive_sum = np.empty((n - time_period, symbols))
+    negative_sum = np.empty((n - time_period, symbols))
+    positive_sum[0] = 0.0
+    negative_sum[0] = 0.0
+    for t in range(1, time_period + 1):
+        positive_sum[0] += positive_flow[t]
+        negative_sum[0] += negative_flow[t]
+    for i in range(1, n - time_period):
+        t = time_period + i
+        np.subtract(positive_sum[i - 1], positive_flow[t - time_period], out=positive_sum[i])
+        positive_sum[i] += positive_flow[t]
+        np.subtract(negative_sum[i - 1], negative_flow[t - time_period], out=negative_sum[i])
+        negative_sum[i] += negative_flow[t]
+
+    total = positive_sum + negative_sum
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mfi[time_period:] = np.where(total < 1.0, 0.0, 100.0 * (positive_sum / total))
+    return mfi
+
+
+def calculate_panel_mfi(high, low, close, volume, time_period=14):
+    """
+    Money Flow Index of every symbol at once, the same values as talib.MFI of each symbol.
+
+    Args:
+        high, low, close, volume: 2-D numpy arrays, symbols x dates, NaN where a symbol has no bar
+
+    Returns:
+        2-D numpy array of MFI, symbols x dates
+    """
+    return _apply_left_packed(lambda h, l, c, v: _mfi(h, l, c, v, time_period), high, low, close, volume)
+
+
+def _ema(values, time_period, k, start):
+    """
+    TA-Lib exponential moving average with its first value at row start, seeded by the mean of the
+    time_period values ending there.
+    """
+    n, symbols = values.shape
+    ema = np.full((n, symbols), np.nan)
+    if n <= start:
+        return ema
+    total = np.zeros(symbols)
+    for t in range(start - time_period + 1, start + 1):
+        total += values[t]
+    np.divide(total, time_period, out=ema[start])
+    for t in range(start + 1, n):
+        # ((value - previous) * k) + previous
+        previous = ema[t]
+        np.subtract(values[t], ema[t - 1], out=previous)
+        previous *= k
+        previous += ema[t - 1]
+    return ema
+
+
+def _macd(close, fastperiod, slowperiod, signalperiod):
+    if slowperiod < fastperiod:
+        fastperiod, slowperiod = slowperiod, fastperiod
+    # like TA-Lib both averages start where the slow one has enough values
+    start = slowperiod - 1
+    slow_ema = _ema(close, slowperiod, 2.0 / (slowperiod + 1), start)
+    fast_ema = _ema(close, fastperiod, 2.0 / (fastperiod + 1), start)
+    macd = fast_ema - slow_ema
+    signal_start = start + signalperiod - 1
+    signal = np.full(macd.shape, np.nan)
+    signal[start:] = _ema(macd[start:], signalperiod, 2.0 / (signalperiod + 1), signalperiod - 1)
+    macd[:signal_start] = np.nan
+    return macd, signal, macd - signal
+
+
+def calculate_panel_macd(close, fastperiod=12, slowperiod=26, signalperiod=9):
+    """
+    Moving Average Convergence/Divergence of every symbol at once, matching talib.MACD of each symbol to floating
+    point rounding.
+
+    Args:
+        close: 2-D numpy array of close prices, symbols x dates, NaN where a symbol has no bar
+
+    Returns:
+        macd, macd_signal, macd_hist: 2-D numpy arrays, symbols x dates
+    """
+    return _apply_left_packed(lambda c: _macd(c, fastperiod, slowperiod, signalperiod), close)
+
+
+def _ewm_mean(values, span):
+    """pandas ewm(span=span, adjust=False).mean() along the rows of values without NaN"""
+    alpha = 1. / (1. + (span - 1) / 2.)
+    old_weight = 1. - alpha
+    weight_total = old_weight + alpha
+    weighted_values = alpha * values
+    ewm = np.empty(values.shape)
+    ewm[0] = values[0]
+    for t in range(1, len(values)):
+        # (old_weight * weighted + alpha * current) / weight_total, pandas keeps weighted when it equals current
+        weighted = ewm[t]
+        np.multiply(ewm[t - 1], old_weight, out=weighted)
+        weighted += weighted_values[t]
+        weighted /= weight_total
+        np.copyto(weighted, ewm[t - 1], where=ewm[t - 1] == values[t])
+    return ewm
+
+
+def _rmi(close, time_period, momentum_period):
+    n = len(close)
+    momentum = np.full(close.shape, np.nan)
+    momentum[momentum_period:] = close[momentum_period:] - close[:n - momentum_period]
+    up = np.where(momentum > 0, momentum, 0)
+    down = -np.where(momentum < 0, momentum, 0)
+    if n == 0:
+        return momentum
+    ema_up = _ewm_mean(up, time_period)
+    ema_down = _ewm_mean(down, time_period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rmi = 100 * ema_up / (ema_up + ema_down)
+    # remove values that are calculated from incomplete data
+    rmi[:time_period + momentum_period - 1] = np.nan
+    return rmi
+
+
+def calculate_panel_rmi(close, time_period=14, momentum_period=5):
+    """
+    Relative Momentum Index of every symbol at once, the same values as calculate_rmi of each symbol.
+
+    Args:
+        close: 2-D numpy array of close prices, symbols x dates, NaN where a symbol has no bar
+
+    Returns:
+        2-D numpy array of RMI, symbols x dates
+    """
+    return _apply_left_packed(lambda c: _rmi(c, time_period, momentum_period), close)
+
+
+def _ichimoku(high, low, conversion_period, base_period, span_b_period):
+    periods = [conversion_period, base_period, span_b_period]
+    rolling_high = rolling_window_extremum(high, periods, np.maximum)
+    rolling_low = rolling_window_extremum(low, periods, np.minimum)
+
+    def mid_point(period):
+        column = periods.index(period)
+        return (rolling_high[:, column] + rolling_low[:, column]) / 2
+
+    n = len(high)
+    tenkan_sen = mid_point(conversion_period)
+    kijun_sen = mid_point(base_period)
+    senkou_span_a = np.full(high.shape, np.nan)
+    senkou_span_b = np.full(high.shape, np.nan)
+    if base_period < n:
+        senkou_span_a[base_period:] = ((tenkan_sen + kijun_sen) / 2)[:n - base_period]
+        senkou_span_b[base_period:] = mid_point(span_b_period)[:n - base_period]
+    return tenkan_sen, kijun_sen, senkou_span_a, senkou_span_b
+
+
+def calculate_panel_ichimoku(high, low, conversion_period=9, base_period=26, span_b_period=52):
+    """
+    Ichimoku lines of every symbol at once, the same values as calculate_ichimoku of each symbol.
+
+    Args:
+        high, low: 2-D numpy arrays, symbols x dates, NaN where a symbol has no bar
+
+    Returns:
+        dict of 2-D numpy arrays keyed by tenkan_sen, kijun_sen, senkou_span_a and senkou_span_b
+    """
+    lines = _apply_left_packed(
+        lambda h, l: _ichimoku(h, l, conversion_period, base_period, span_b_period), high, low)
+    return dict(zip(ichimoku_lines, lines))
@@ -1,5 +1,10 @@
+from collections import deque
+import operator
+import numpy as np
 import pandas as pd
 
+from tools.rolling_helper import rolling_window_extremum
+
 
 def calculate_ichimoku(df, future=False, conversion_period=9, base_period=26, span_b_period=52):
     """
@@ -37,16 +42,67 @@ def calculate_ichimoku(df, future=False, conversion_period=9, base_period=26, sp
     return df
 
 
+ichimoku_lines = ['tenkan_sen', 'kijun_sen', 'senkou_span_a', 'senkou_span_b']
+
+
+def calculate_ichimoku_sweep(df, period_grid, as_frame=False):
+    """
+    Calculate Ichimoku for many (conversion_period, base_period, span_b_period) combinations at once.
+
+    The rolling highs and lows of every distinct period are answered from one sparse table of the highs
+    and one of the lows, so a grid of 100 combinations costs about as much as a few calculate_ichimoku
+    calls. The values match calculate_ichimoku of each combination exactly.
+
+    Args:
+        df: pandas DataFrame, input data containing high and low prices
+        period_grid: list of (conversion_period, base_period, span_b_period) tuples
+        as_frame: boolean, return a DataFrame instead of a numpy array (default is False)
+
+    Returns:
+        numpy array of shape (len(period_grid), len(df), 4) with the lines in the order of ichimoku_lines,
+        or when as_frame a pandas DataFrame indexed like df with columns
+        (conversion_period, base_period, span_b_period, line)
+    """
+    period_grid = [tuple(int(period) for period in periods) for periods in period_grid]
+    windows = sorted({period for periods in period_grid for period in periods})
+    window_position = {period: i for i, period in enumerate(windows)}
+
+    rolling_high = rolling_window_extremum(df['high'].to_numpy(dtype=float), windows, np.maximum)
+    rolling_low = rolling_window_extremum(df['low'].to_numpy(dtype=float), windows, np.minimum)
+    mid_points = (rolling_high + rolling_low) / 2
+
+    n = len(df)
+    result = np.full((len(period_grid), n, len(ichimoku_lines)), np.nan)
+    for i, (conversion_period, base_period, span_b_period) in enumerate(period_grid):
+        tenkan_sen = mid_points[:, window_position[conversion_period]]
+        kijun_sen = mid_points[:, window_position[base_period]]
+        result[i, :, 0] = tenkan_sen
+        result[i, :, 1] = kijun_sen
+        if base_period < n:
+            result[i, base_period:, 2] = ((tenkan_sen + kijun_sen) / 2)[:n - base_period]
+            result[i, base_period:, 3] = mid_points[:n - base_period, window_position[span_b_period]]
+
+    if not as_frame:
+        return result
+    columns = pd.MultiIndex.from_tuples(
+        [periods + (line,) for periods in period_grid for line in ichimoku_lines],
+        names=['conversion_period', 'base_period', 'span_b_period', 'line'])
+    return pd.DataFrame(result.transpose(1, 0, 2).reshape(n, -1), index=df.index, columns=columns)
+
+
 def convert_to_polarity(value):
     """
     Converts a numerical value into its corresponding polarity.
 
     Args:
-        value: The numerical value to be converted.
+        value: The numerical value to be converted, or a pandas Series / numpy array converted element-wise.
 
     Returns:
         The polarity of the input value. Positive values are converted to 1, negative values are converted to -1, and zero remains unchanged.
     """
+    if isinstance(value, (pd.Series, np.ndarray)):
+        # np.sign keeps NaN, adding 0.0 turns -0.0 into 0.0
+        return np.sign(value) + 0.0
     # check if null
     if value == value:
         if value > 0:
@@ -91,3 +147,116 @@ def calculate_rmi(data, time_period=14, momentum_period=5):
 
     return RMI
 
+
+class IchimokuState:
+    """
+    Streaming Ichimoku calculator that updates Tenkan-sen, Kijun-sen and Senkou Span A/B one bar at a time.
+
+    The rolling highs and lows are kept in monotonic deques, so each bar costs amortized O(1) and the
+    outputs match calculate_ichimoku bar for bar. Chikou Span needs future closes and is not streamed.
+    The state can be saved with to_dict and restored with from_dict to resume without reloading history.
+
+    Args:
+        conversion_period: int, period for calculating Tenkan-sen (default is 9)
+        base_period: int, period for calculating Kijun-sen and the Senkou Span shift (default is 26)
+        span_b_period: int, period for calculating Senkou Span B (default is 52)
+    """
+    columns = ichimoku_lines
+
+    def __init__(self, conversion_period=9, base_period=26, span_b_period=52):
+        self.conversion_period = conversion_period
+        self.base_period = base_period
+        self.span_b_period = span_b_period
+        self.bar_count = 0
+        # index of the latest NaN high/low, a window containing it has no value like pandas rolling
+        self.last_nan = {'high': -1, 'low': -1}
+        # per period, deques of (bar index, value) with decreasing highs and increasing lows
+        self.windows = {
+            period: {'high': deque(), 'low': deque()}
+            for period in sorted({conversion_period, base_period, span_b_period})
+        }
+        # unshifted Senkou Span A/B of the last base_period bars
+        self.spans = deque(maxlen=base_period)
+
+    def _extreme(self, period, side):
+        if self.bar_count < period or self.last_nan[side] > self.bar_count - 1 - period:
+            return np.nan
+        return self.windows[period][side][0][1]
+
+    def update(self, high, low):
+        """
+        Add one bar.
+
+        Args:
+            high: float, high price of the bar
+            low: float, low price of the bar
+
+        Returns:
+            dict of tenkan_sen, kijun_sen, senkou_span_a and senkou_span_b for the bar
+        """
+        i = self.bar_count
+        for side, value, is_dominated in [('high', high, operator.le), ('low', low, operator.ge)]:
+            if value != value:
+                self.last_nan[side] = i
+            for period, window in self.windows.items():
+                values = window[side]
+                if value == value:
+                    while values and is_dominated(values[-1][1], value):
+                        values.pop()
+                    values.append((i, value))
+                while values and values[0][0] <= i - period:
+                    values.popleft()
+        self.bar_count += 1
+
+        tenkan_sen = (self._extreme(self.conversion_period, 'high') + self._extreme(self.conversion_period, 'low')) / 2
+        kijun_sen = (self._extreme(self.base_period, 'high') + self._extreme(self.base_period, 'low')) / 2
+        span_b = (self._extreme(self.span_b_period, 'high') + self._extreme(self.span_b_period, 'low')) / 2
+
+        if len(self.spans) == self.base_period:
+            senkou_span_a, senkou_span_b = self.spans[0]
+        else:
+            senkou_span_a, senkou_span_b = np.nan, np.nan
+        self.spans.append(((tenkan_sen + kijun_sen) / 2, span_b))
+
+        return {
+            'tenkan_sen': tenkan_sen,
+            'kijun_sen': kijun_sen,
+            'senkou_span_a': senkou_span_a,
+            'senkou_span_b': senkou_span_b,
+        }
+
+    def update_batch(self, df):
+        """
+        Add the bars of a DataFrame with high and low columns.
+
+        Returns:
+            pandas DataFrame of the Ichimoku lines indexed like df
+        """
+        rows = [self.update(high, low) for high, low in zip(df['high'].to_numpy(float), df['low'].to_numpy(float))]
+        return pd.DataFrame(rows, index=df.index, columns=self.columns, dtype=float)
+
+    def to_dict(self):
+        """JSON serializable state, e.g. for tools.json_helper.save_dict_to_json"""
+        return {
+            'conversion_period': self.conversion_period,
+            'base_period': self.base_period,
+            'span_b_period': self.span_b_period,
+            'bar_count': self.bar_count,
+            'last_nan': dict(self.last_nan),
+            'windows': {
+                str(period): {side: [list(item) for item in values] for side, values in window.items()}
+                for period, window in self.windows.items()
+            },
+            'spans': [list(item) for item in self.spans],
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        ichimoku_state = cls(state['conversion_period'], state['base_period'], state['span_b_period'])
+        ichimoku_state.bar_count = state['bar_count']
+        ichimoku_state.last_nan = dict(state['last_nan'])
+        for period, window in state['windows'].items():
+            for side, values in window.items():
+                ichimoku_state.windows[int(period)][side] = deque(tuple(item) for item in values)
+        ichimoku_state.spans.extend(tuple(item) for item in state['spans'])
+        return ichimoku_state
@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from tools.disk_cache import DiskCache
+
+# request parameters that do not change the response, e.g. credentials
+ignored_params = ['apikey']
+
+
+class CacheMissError(Exception):
+    pass
+
+
+def request_key(provider, endpoint, symbol, params=None):
+    """
+    Hash a request (provider, endpoint, symbol and parameters) into the name of its cache entry.
+
+    Returns:
+        str, hex digest identifying the request
+    """
+    params = {key: str(value) for key, value in (params or {}).items() if key not in ignored_params}
+    request = json.dumps([provider, endpoint, symbol, params], sort_keys=True)
+    return hashlib.sha256(request.encode()).hexdigest()
+
+
+class ResponseCache(DiskCache):
+    """
+    On-disk cache of raw provider responses, one gzip compressed JSON file per request.
+
+    Entries older than ttl seconds are downloaded again. In offline mode entries are served regardless of their
+    age and a missing entry raises CacheMissError instead of being downloaded. Once the cache grows beyond
+    max_bytes the oldest entries are removed first. Entries are written atomically, so the cache can be shared
+    by concurrent downloads.
+
+    Usage:
+        cache = ResponseCache('res/response_cache')
+        payload = cache.get('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM', params)
+        if payload is None:
+            payload = download(...)
+            cache.put('alpha_vantage', 'TIME_SERIES_DAILY_ADJUSTED', 'IBM', params, payload)
+
+    Args:
+        cache_dir: str, directory of the cache files
+        ttl: float, seconds a response is served from the cache (default is 12 hours)
+        max_bytes: int, size of the cache on disk (default is 1 GiB)
+        offline: boolean, only serve responses from the cache (default is False)
+    """
+    suffix = '.json.gz'
+
+    def __init__(self, cache_dir, ttl=12 * 3600, max_bytes=1024 ** 3, offline=False):
+        super().__init__(cache_dir, max_bytes)
+        self.ttl = ttl
+        self.offline = offline
+
+    def _path(self, provider, endpoint, symbol, params):
+        key = request_key(provider, endpoint, symbol, params)
+        return os.path.join(self._group_dir(provider), f'{key}{self.suffix}')
+
+    def get(self, provider, endpoint, symbol, params=None):
+        """
+        Return the cached response of a request, None if it is not cached or expired.
+
+        Raises:
+            CacheMissError: in offline mode when the response is not cached
+        """
+        path = self._path(provider, endpoint, symbol, params)
+        try:
+            expired = time.time() - os.path.getmtime(path) > self.ttl
+            if expired and not self.offline:
+                self.misses += 1
+                return None
+            with gzip.open(path, 'rt') as f:
+                payload = json.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            if self.offline:
+                raise CacheMissError(f'{provider} {endpoint} {symbol} is not cached')
+            return None
+        self.hits += 1
+        return payload
+
+    def put(self, provider, endpoint, symbol, params, payload):
+        """Store the JSON serializable response of a request."""
+        path = self._path(provider, endpoint, symbol, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{id(payload)}.tmp'
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump(payload, f)
+        self._replace(tmp_path, path)
+
+    def invalidate(self, provider=None):
+        """
+        Remove cached responses.
+
+        Args:
+            provider: str, remove only the responses of this provider, all responses when None
+
+        Returns:
+            int, number of removed entries
+        """
+        return super().invalidate(provider)
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+NANOSECONDS_PER_DAY = 24 * 60 * 60 * 10 ** 9
+
+
+def build_sparse_table(values, op, max_length=None):
+    """
+    Build a sparse table of an idempotent reduction over every power of two span of values.
+
+    Args:
+        values: 1-D numpy array, or n-D reduced along the first axis
+        op: numpy binary ufunc such as np.fmax or np.fmin (NaN ignoring) or np.maximum or np.minimum (NaN propagating)
+        max_length: int, longest range that will be queried, limits the table to the spans it needs (default is len(values))
+
+    Returns:
+        numpy array of shape (levels,) + values.shape, row k holds op over values[i:i + 2**k] at column i
+        (NaN padded at the end)
+    """
+    n = len(values)
+    levels = max(int(min(n, max_length or n)).bit_length(), 1)
+    table = np.full((levels,) + values.shape, np.nan)
+    table[0] = values
+    for k in range(1, levels):
+        half = 1 << (k - 1)
+        span = 1 << k
+        table[k, :n - span + 1] = op(table[k - 1, :n - span + 1], table[k - 1, half:n - half + 1])
+    return table
+
+
+def sparse_table_positions(n, left, right):
+    """
+    Flat positions in a sparse table of n values of the two overlapping spans covering values[left:right].
+
+    Args:
+        n: int, number of values the table was built from
+        left: numpy int array of inclusive start positions
+        right: numpy int array of exclusive end positions
+
+    Returns:
+        first: numpy int array, flat position of the span starting at left
+        second: numpy int array, flat position of the span ending at right
+        empty: numpy bool array, True where the range holds no values
+    """
+    length = right - left
+    empty = length <= 0
+    if empty.any():
+        length = np.where(empty, 1, length)
+        left = np.where(empty, 0, left)
+    # floor(log2(length)) looked up from a table of every possible length, without floating point rounding
+    log2_table = np.frexp(np.arange(1, max(n, 1) + 1))[1] - 1
+    k = np.take(log2_table, length - 1)
+    first = k * n + left
+    second = first + length - np.left_shift(1, k)
+    return first, second, empty
+
+
+def query_sparse_table(table, op, left, right, positions=None):
+    """
+    Reduce values[left:right] for arrays of bounds in O(1) each. Empty ranges return NaN.
+
+    Args:
+        table: sparse table from build_sparse_table
+        op: the ufunc the table was built with
+        left: numpy int array of inclusive start positions
+        right: numpy int array of exclusive end positions
+        positions: result of sparse_table_positions, to share it between tables of the same values
+
+    Returns:
+        numpy array of the reduction of each range, of shape left.shape + the trailing shape of the values
+    """
+    first, second, empty = positions if positions is not None else sparse_table_positions(table.shape[1], left, right)
+    flat_table = table.reshape((table.shape[0] * table.shape[1],) + table.shape[2:])
+    result = op(np.take(flat_table, first, axis=0), np.take(flat_table, second, axis=0))
+    result[empty] = np.nan
+    return result
+
+
+def rolling_calendar_extrema(values, index, windows_days):
+    """
+    Rolling max and min over several calendar day windows in a single sweep.
+
+    Matches pandas Series.rolling(window=f'{days}D').max() and .min(): the window of each row covers
+    (date - days, date], NaN values are ignored and a window without values is NaN. One sparse table
+    per reduction answers every row and window at once, instead of one rolling pass per window and
+    reduction.
+
+    Args:
+        values: 1-D array-like of values, e.g. close prices
+        index: monotonic increasing DatetimeIndex of the values
+        windows_days: list of window lengths in calendar days
+
+    Returns:
+        rolling_max: numpy array of shape (len(values), len(windows_days))
+        rolling_min: numpy array of shape (len(values), len(windows_days))
+    """
+    values = np.asarray(values, dtype=float)
+    index = pd.DatetimeIndex(index)
+    if not index.is_monotonic_increasing:
+        raise ValueError('index must be monotonic increasing')
+
+    n = len(values)
+    if n == 0:
+        return np.full((0, len(windows_days)), np.nan), np.full((0, len(windows_days)), np.nan)
+
+    times = index.asi8
+    window_lengths = np.asarray(windows_days, dtype=np.int64) * NANOSECONDS_PER_DAY
+    # one row per window keeps the searched start times sorted, which makes the binary searches cache friendly
+    left = np.searchsorted(times, (times[None, :] - window_lengths[:, None]).ravel(), side='right')
+    left = left.reshape(len(windows_days), n)
+    right = np.broadcast_to(np.arange(1, n + 1), left.shape)
+
+    positions = sparse_table_positions(n, left, right)
+    rolling_max = query_sparse_table(build_sparse_table(values, np.fmax), np.fmax, left, right, positions)
+    rolling_min = query_sparse_table(build_sparse_table(values, np.fmin), np.fmin, left, right, positions)
+    return rolling_max.T, rolling_min.T
+
+
+def rolling_window_extremum(values, windows, op):
+    """
+    Rolling reduction over several row windows from one sparse table.
+
+    With op np.maximum or np.minimum this matches pandas Series.rolling(window).max() or .min() for every
+    window: a row has a value only once the window is full and holds no NaN.
+
+    Args:
+        values: 1-D array-like of values, e.g. high prices, or 2-D rolled down the rows, e.g. the dates x
+            symbols arrays of panel_helper
+        windows: list of positive window lengths in rows
+        op: np.maximum or np.minimum
+
+    Returns:
+        numpy array of shape (len(values), len(windows)) + the trailing shape of values
+    """
+    values = np.asarray(values, dtype=float)
+    windows = np.asarray(windows, dtype=np.int64)
+    if (windows <= 0).any():
+        raise ValueError('windows must be positive')
+
+    n = len(values)
+    if n == 0 or len(windows) == 0:
+        return np.full((n, len(windows)) + values.shape[1:], np.nan)
+
+    right = np.broadcast_to(np.arange(1, n + 1), (len(windows), n))
+    left = right - windows[:, None]
+    incomplete = left < 0
+    left = np.maximum(left, 0)
+
+    table = build_sparse_table(values, op, max_length=int(windows.max()))
+    result = query_sparse_table(table, op, left, right)
+    result[incomplete] = np.nan
+    return np.moveaxis(result, 0, 1)
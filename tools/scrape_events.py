@@ -1,19 +1,48 @@
-
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import asyncio
+from collections import Counter
+from contextlib import ExitStack
 import json
 import os
 import pandas as pd
 import psycopg2
-from selenium import webdriver
-from selenium.webdriver.common.by import By
 import time
-from tools.database_helper import get_ticker_id
+from tools.database_helper import bulk_upsert
+from tools.download_helper import RateLimitedSession, ThrottledError, download_and_save
+from tools.hdf5_helper import HDF5BatchWriter
+from tools.response_cache import CacheMissError
+
+try:
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+except ImportError:  # only the HTTP backend is available
+    webdriver = None
+
+FINVIZ_LOGIN_URL = 'https://finviz.com/login.ashx'
+# form action of the login page
+FINVIZ_LOGIN_SUBMIT_URL = 'https://finviz.com/login_submit.ashx'
+FINVIZ_QUOTE_URL = 'https://elite.finviz.com/quote.ashx'
 
 
 def main(ticker_symbols,
         save_type='psql', reference_table='tickers',
-        path=None, tables=None, conn=None, cur=None):
+        path=None, tables=None, conn=None, cur=None, cache=None,
+        backend='http', requests_per_minute=30, concurrency=4, **fetcher_kwargs):
+    """
+    Download the chart events (earnings, dividends and splits) of Finviz quote pages and save them to HDF5 or
+    Postgres.
+
+    Args:
+        backend: str, 'http' to download the quote pages concurrently over one logged in session (FinvizFetcher)
+            or 'selenium' to load them one after another in Safari (default is 'http')
+        requests_per_minute: float, request rate of the http backend (default is 30)
+        concurrency: int, maximum number of open requests of the http backend (default is 4)
+        **fetcher_kwargs: further arguments of FinvizFetcher, e.g. username and password
+
+    Returns:
+        dict of error messages keyed by the symbols that could not be downloaded or saved
+    """
     if save_type == 'psql':
         type_to_table = {
             'chartEvent/earnings': tables['earnings_table'],
@@ -21,37 +50,183 @@ def main(ticker_symbols,
             'chartEvent/split': tables['split_table']
         }
 
-        queries = {
-            'chartEvent/earnings':
-                """
-                INSERT INTO {} (ticker_id, date_timestamp, fiscal_period, fiscal_end_date, eps_actual, eps_estimate, 
-                eps_reported_actual, eps_reported_estimate, 
-                sales_actual, sales_estimate)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (ticker_id, date_timestamp) DO NOTHING;
-                """.format(type_to_table['chartEvent/earnings']),
-            'chartEvent/dividends':
-                """
-                INSERT INTO {} (ticker_id, date_timestamp, ordinary, special)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (ticker_id, date_timestamp) DO NOTHING;
-                """.format(type_to_table['chartEvent/dividends']),
-            'chartEvent/split':
-                """
-                INSERT INTO {} (ticker_id, date_timestamp, factor_from, factor_to)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (ticker_id, date_timestamp) DO NOTHING;
-                """.format(type_to_table['chartEvent/split'])
-        }
+    # events of all tickers are written while the HDF5 store is open, or batch_size tickers per transaction
+    with ExitStack() as stack:
+        writer = stack.enter_context(HDF5BatchWriter(path)) if save_type == 'hdf5' else None
+        event_writer = EventBatchWriter(conn, cur, type_to_table, reference_table=reference_table) \
+            if save_type == 'psql' else None
+
+        def save_events(ticker_symbol, data, meta_data=None):
+            # process and save event data
+            event_df = pd.DataFrame.from_dict(data['chartEvents'])
+            event_df['dateTimestamp'] = pd.to_datetime(event_df['dateTimestamp'], unit='s')
+
+            if save_type == 'hdf5':
+                writer.write('events/' + ticker_symbol, event_df)
+            elif save_type == 'psql':
+                event_writer(ticker_symbol, event_df)
+            else:
+                raise Exception('Unknown save type. Choose from "hdf5" or "psql"')
+
+        driver = None
+        if backend == 'http':
+            async def fetch(fetcher, ticker_symbol):
+                return await fetcher.get_chart_data(ticker_symbol), None
+
+            fetcher = FinvizFetcher(requests_per_minute=requests_per_minute, concurrency=concurrency, cache=cache,
+                                    **fetcher_kwargs)
+            failed_symbols = download_and_save(ticker_symbols, fetch, save_events, downloader=fetcher)
+        elif backend == 'selenium':
+            failed_symbols = {}
+            for ticker_symbol in ticker_symbols:
+                # chart data downloaded before, e.g. by a run that crashed, is served from the cache
+                try:
+                    data = cache.get('finviz', 'quote', ticker_symbol, {'p': 'd'}) if cache is not None else None
+                except CacheMissError as e:
+                    print(e)
+                    failed_symbols[ticker_symbol] = str(e)
+                    continue
+                if data is None:
+                    if driver is None:
+                        driver = login()
+                    data = get_chart_data(driver, ticker_symbol)
+                    if cache is not None:
+                        cache.put('finviz', 'quote', ticker_symbol, {'p': 'd'}, data)
+                    time.sleep(3)
+                # a failed batch of the event writer is recorded for its tickers, like download_and_save does
+                try:
+                    save_events(ticker_symbol, data)
+                except Exception as e:
+                    failed_symbols[ticker_symbol] = str(e)
+                    print(f'{ticker_symbol} failed: {e}')
+        else:
+            raise Exception('Unknown backend. Choose from "http" or "selenium"')
+
+        if event_writer is not None:
+            try:
+                event_writer.flush()
+            except Exception as e:
+                print(e)
+            failed_symbols.update(event_writer.failed_symbols)
+    # Quit the driver
+    if driver is not None:
+        driver.quit()
+    return failed_symbols
 
 
+def parse_chart_data(script):
+    """Parse the chart data of the 'var data = {...};' script of a Finviz quote page."""
+    # The string manipulation here is to clean the JSON string
+    # by removing the variable declaration and semicolon at the end.
+    json_str = script.split('var data = {')[1].rsplit('};\n', 1)[0]
+    json_str = f'{{{json_str}}}'
+    # Parse the JSON string into a Python dictionary
+    return json.loads(json_str)
 
+
+def parse_quote_page(html):
+    """Parse the chart data of a Finviz quote page, cutting out the script element holding it first."""
+    position = html.find('var data = ')
+    if position < 0:
+        raise ValueError('No chart data in the quote page')
+    start = html.rindex('>', 0, position) + 1
+    end = html.index('</script>', position)
+    return parse_chart_data(html[start:end])
+
+
+class FinvizFetcher(RateLimitedSession):
+    """
+    Download the chart data of Finviz quote pages over one logged in HTTP session with connection pooling.
+
+    The session logs in with the first page that is not cached. Pages are requested at requests_per_minute with at
+    most concurrency requests open, throttled requests are retried with exponential backoff (see
+    tools.download_helper.RateLimitedSession).
+
+    Usage:
+        async with FinvizFetcher(requests_per_minute=30) as fetcher:
+            data = await fetcher.get_chart_data('IBM')
+
+    Args:
+        username: str, Finviz Elite email (default is the FINVIZ_USERNAME environment variable)
+        password: str, Finviz Elite password (default is the FINVIZ_PASSWORD environment variable)
+        requests_per_minute: float, request rate (default is 30)
+        concurrency: int, maximum number of open requests (default is 4)
+        max_retries: int, retries of a throttled request before giving up (default is 5)
+        backoff: float, seconds to wait before the first retry, doubled for each further retry (default is 2.0)
+        url: str, quote page, e.g. of a local stub server in tests
+        login_url: str, URL the login form is posted to
+        timeout: float, seconds before a request fails (default is 60)
+        cache: ResponseCache of the chart data, nothing is cached when None
+    """
+    def __init__(self, username=None, password=None, requests_per_minute=30, concurrency=4, max_retries=5,
+                 backoff=2.0, url=FINVIZ_QUOTE_URL, login_url=FINVIZ_LOGIN_SUBMIT_URL, timeout=60, cache=None):
+        super().__init__(requests_per_minute, concurrency, max_retries, backoff, timeout, cache)
+        self.username = username or os.environ.get('FINVIZ_USERNAME')
+        self.password = password or os.environ.get('FINVIZ_PASSWORD')
+        self.url = url
+        self.login_url = login_url
+        self.logged_in = False
+        self.login_error = None
+        self._login_lock = None
+
+    async def login(self):
+        """
+        Post the login form, the session keeps the cookies of the login. A failed login is not tried again, its
+        error is raised for every further page instead of posting wrong credentials once per ticker.
+        """
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if self.logged_in:
+                return
+            if self.login_error is not None:
+                raise self.login_error
+            try:
+                await self.bucket.acquire()
+                async with self.session.post(self.login_url,
+                                             data={'email': self.username, 'password': self.password}) as response:
+                    response.raise_for_status()
+                    # a failed login ends on the login page again
+                    if 'login' in response.url.path:
+                        raise ValueError('Finviz login failed, check FINVIZ_USERNAME and FINVIZ_PASSWORD')
+            except Exception as e:
+                self.login_error = e
+                raise
+            self.logged_in = True
+
+    async def _request(self, ticker_symbol):
+        await self.bucket.acquire()
+        async with self._semaphore:
+            self.requests += 1
+            async with self.session.get(self.url, params={'t': ticker_symbol, 'p': 'd'}) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise ThrottledError(f'HTTP {response.status}')
+                response.raise_for_status()
+                if 'login' in response.url.path:
+                    raise ValueError(f'Quote page of {ticker_symbol} redirected to the login page')
+                html = await response.text()
+        return parse_quote_page(html)
+
+    async def get_chart_data(self, ticker_symbol):
+        """Chart data of a quote page, served from the cache when it was downloaded before."""
+        if self.cache is not None:
+            data = self.cache.get('finviz', 'quote', ticker_symbol, {'p': 'd'})
+            if data is not None:
+                return data
+        await self.login()
+        data = await self._with_retries(self._request, ticker_symbol)
+        if self.cache is not None:
+            self.cache.put('finviz', 'quote', ticker_symbol, {'p': 'd'}, data)
+        return data
+
+
+def login():
     # Replace 'your_username' and 'your_password' with your login credentials.
     USERNAME = os.environ['FINVIZ_USERNAME']
     PASSWORD = os.environ['FINVIZ_PASSWORD']
 
-    # Replace with the actual login URL and any other URLs you need to navigate to.
-    LOGIN_URL = 'https://finviz.com/login.ashx'
+    if webdriver is None:
+        raise ImportError('The selenium backend needs selenium, use backend="http" instead')
 
     # Set up Safari options, if necessary
     options = webdriver.SafariOptions()
@@ -61,7 +236,7 @@ def main(ticker_symbols,
     driver = webdriver.Safari(options=options)
 
     # Open the login page
-    driver.get(LOGIN_URL)
+    driver.get(FINVIZ_LOGIN_URL)
 
     # Wait for the page to load
     time.sleep(2)
@@ -80,74 +255,155 @@ def main(ticker_symbols,
 
     # Wait for the post-login page to load
     time.sleep(2)
+    return driver
 
-    for ticker_symbol in ticker_symbols:
-        DATA_URL = f'https://elite.finviz.com/quote.ashx?t={ticker_symbol}&p=d'
 
-        # Navigate to the URL from which you want to scrape data
-        driver.get(DATA_URL)
+def get_chart_data(driver, ticker_symbol):
+    DATA_URL = f'https://elite.finviz.com/quote.ashx?t={ticker_symbol}&p=d'
 
-        # Wait for the element containing the JSON to be present
-        element = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, '//script[contains(text(), "var data = ")]'))
-        )
+    # Navigate to the URL from which you want to scrape data
+    driver.get(DATA_URL)
 
-        # Extract the JSON string
-        json_str = element.get_attribute('innerHTML')
-
-        # The string manipulation here is to clean the JSON string
-        # by removing the variable declaration and semicolon at the end.
-        json_str = json_str.split('var data = {')[1].rsplit('};\n', 1)[0]
-        json_str = f'{{{json_str}}}'
-        # Parse the JSON string into a Python dictionary
-        data = json.loads(json_str)
-
-        # process and save event data
-        event_df = pd.DataFrame.from_dict(data['chartEvents'])
-        event_df['dateTimestamp'] = pd.to_datetime(event_df['dateTimestamp'], unit='s')
-
-        if save_type == 'hdf5':
-            save_hdf5('events/' + ticker_symbol, event_df, path)
-        elif save_type == 'psql':
-            ticker_id = get_ticker_id(cur, ticker_symbol, reference_table=reference_table)
-            if not ticker_id:
-                print(f'Ticker symbol not in reference table: {ticker_symbol}')
-                continue
-            save_sql(conn, cur, ticker_id, queries, event_df)
-        else:
-            raise Exception('Unknown save type. Choose from "hdf5" or "psql"')
-        time.sleep(3)
-    # Quit the driver
-    driver.quit()
-
-
-def save_hdf5(loc, event_df, path):
-    with pd.HDFStore(path, mode='a') as store:
-        # Save each DataFrame to the store
-        store.put(loc, event_df, format='table', data_columns=True)
-
-
-def save_sql(conn, cur, ticker_id, queries, data):
-    # Insert data into PostgreSQL database
-    for index, row in data.iterrows():
-        event_type = row['eventType']
-        if event_type == 'chartEvent/earnings':
-            cur.execute(
-                queries[event_type],
-                (ticker_id, row.get('dateTimestamp'), row.get('fiscalPeriod'), row.get('fiscalEndDate'), row.get('epsActual'),
-                 row.get('epsEstimate'), row.get('epsReportedActual'), row.get('epsReportedEstimate'), row.get('salesActual'), row.get('salesEstimate'))
-            )
-        elif event_type == 'chartEvent/dividends':
-            cur.execute(
-                queries[event_type],
-                (ticker_id, row.get('dateTimestamp'), row.get('ordinary'), row.get('special'))
-            )
-        elif event_type == 'chartEvent/split':
-            cur.execute(
-                queries[event_type],
-                (ticker_id, row.get('dateTimestamp'), row.get('factorFrom'), row.get('factorTo'))
-            )
-        else:
-            raise Exception(f'Unknown event type {event_type}')
+    # Wait for the element containing the JSON to be present
+    element = WebDriverWait(driver, 10).until(
+        EC.presence_of_element_located((By.XPATH, '//script[contains(text(), "var data = ")]'))
+    )
+
+    # Extract the JSON string
+    return parse_chart_data(element.get_attribute('innerHTML'))
+
+
+# database columns of the chart event fields of each event type
+event_columns = {
+    'chartEvent/earnings': {
+        'dateTimestamp': 'date_timestamp',
+        'fiscalPeriod': 'fiscal_period',
+        'fiscalEndDate': 'fiscal_end_date',
+        'epsActual': 'eps_actual',
+        'epsEstimate': 'eps_estimate',
+        'epsReportedActual': 'eps_reported_actual',
+        'epsReportedEstimate': 'eps_reported_estimate',
+        'salesActual': 'sales_actual',
+        'salesEstimate': 'sales_estimate',
+    },
+    'chartEvent/dividends': {
+        'dateTimestamp': 'date_timestamp',
+        'ordinary': 'ordinary',
+        'special': 'special',
+    },
+    'chartEvent/split': {
+        'dateTimestamp': 'date_timestamp',
+        'factorFrom': 'factor_from',
+        'factorTo': 'factor_to',
+    },
+}
+
+
+def write_events(cur, events, type_to_table, unknown_events=None):
+    """
+    Write chart events of any number of tickers with one COPY and merge per event type, events that are already
+    stored are kept. The caller commits.
+
+    Args:
+        events: pandas DataFrame of chart events with a ticker_id column
+        type_to_table: dict of the tables keyed by event type
+        unknown_events: Counter of the events of unknown types, which are skipped
+
+    Returns:
+        int, number of inserted events
+    """
+    row_count = 0
+    for event_type, type_events in events.groupby('eventType', sort=False):
+        if event_type not in event_columns:
+            if unknown_events is not None:
+                unknown_events[event_type] += len(type_events)
+            continue
+        columns = event_columns[event_type]
+        df = type_events.reindex(columns=['ticker_id', *columns]).rename(columns=columns)
+        row_count += bulk_upsert(cur, df, type_to_table[event_type], conflict_columns=('ticker_id', 'date_timestamp'),
+                                 update=False)
+    return row_count
+
+
+def save_sql(conn, cur, ticker_id, type_to_table, data):
+    """Insert the chart events of one ticker."""
+    unknown_events = Counter()
+    write_events(cur, data.assign(ticker_id=ticker_id), type_to_table, unknown_events)
     conn.commit()
+    if unknown_events:
+        print(f'Skipped events of unknown types: {dict(unknown_events)}')
+
+
+class EventBatchWriter:
+    """
+    Save the chart events of many tickers to Postgres with one COPY and merge per event type and one commit per
+    batch of tickers. Events of unknown types are counted in unknown_events and skipped, the other events of the
+    ticker are saved.
+
+    Usage:
+        with EventBatchWriter(conn, cur, type_to_table) as writer:
+            for symbol in symbols:
+                writer(symbol, event_df)
+
+    Args:
+        type_to_table: dict of the tables keyed by event type, e.g. {'chartEvent/split': 'split'}
+        batch_size: int, number of tickers written per transaction (default is 100)
+    """
+    def __init__(self, conn, cur, type_to_table, reference_table='tickers', batch_size=100):
+        self.conn = conn
+        self.cur = cur
+        self.type_to_table = type_to_table
+        self.reference_table = reference_table
+        self.batch_size = batch_size
+        self.pending = []
+        self.failed_symbols = {}
+        self.unknown_events = Counter()
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def __call__(self, ticker_symbol, event_df):
+        self.pending.append((ticker_symbol, event_df))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the pending tickers in one transaction, returns the number of inserted events."""
+        pending, self.pending = self.pending, []
+        if not pending:
+            return 0
+        symbols = [ticker_symbol for ticker_symbol, _ in pending]
+        unknown_events = Counter()
+        try:
+            row_count = self._write(pending, unknown_events)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            for ticker_symbol in symbols:
+                self.failed_symbols[ticker_symbol] = str(e)
+            raise Exception(f'Saving events of {", ".join(symbols)} failed: {e}') from e
+        if unknown_events:
+            print(f'Skipped events of unknown types: {dict(unknown_events)}')
+            self.unknown_events.update(unknown_events)
+        return row_count
+
+    def _write(self, pending, unknown_events):
+        self.cur.execute(
+            f"SELECT ticker_symbol, ticker_id FROM {self.reference_table} WHERE ticker_symbol = ANY(%s)",
+            ([ticker_symbol for ticker_symbol, _ in pending],)
+        )
+        ticker_ids = dict(self.cur.fetchall())
+        frames = []
+        for ticker_symbol, event_df in pending:
+            if ticker_symbol not in ticker_ids:
+                print(f'Ticker symbol not in reference table: {ticker_symbol}')
+                self.failed_symbols[ticker_symbol] = 'Ticker not found'
+                continue
+            frames.append(event_df.assign(ticker_id=ticker_ids[ticker_symbol]))
+        if not frames:
+            return 0
+        return write_events(self.cur, pd.concat(frames, ignore_index=True), self.type_to_table, unknown_events)
@@ -0,0 +1,241 @@
+import operator
+import re
+import numpy as np
+import pandas as pd
+
+try:
+    import numexpr
+except ImportError:  # fall back to numpy evaluation
+    numexpr = None
+
+comparison_operators = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+token_pattern = re.compile(r'''
+    \s*(?:
+        (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?) |
+        (?P<name>[A-Za-z_][A-Za-z0-9_]*) |
+        (?P<operator>==|!=|<=|>=|<|>|&|\||~|\(|\))
+    )''', re.VERBOSE)
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = token_pattern.match(expression, position)
+        if not match:
+            raise Exception(f'Invalid signal rule at "{expression[position:]}"')
+        kind = match.lastgroup
+        value = match.group(kind)
+        # keywords read like the symbols they stand for
+        if kind == 'name' and value in ('and', 'or', 'not'):
+            kind, value = 'operator', {'and': '&', 'or': '|', 'not': '~'}[value]
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent parser of signal rules. Unlike Python, comparisons bind tighter than & and |, so
+    'a == -1 & b > 0' means '(a == -1) & (b > 0)'.
+
+    Grammar:
+        expression := term ('|' term)*
+        term       := factor ('&' factor)*
+        factor     := '~' factor | '(' expression ')' | operand comparison_operator operand
+        operand    := column name | number
+
+    Nodes are tuples: ('or', left, right), ('and', left, right), ('not', node), ('compare', op, left, right),
+    ('column', name), ('number', value).
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise Exception(f'Invalid signal rule, expected {value or "more input"} but found {token[1]}')
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.expression()
+        if self.position != len(self.tokens):
+            raise Exception(f'Invalid signal rule, unexpected {self.peek()[1]}')
+        return node
+
+    def expression(self):
+        node = self.term()
+        while self.peek()[1] == '|':
+            self.take('|')
+            node = ('or', node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek()[1] == '&':
+            self.take('&')
+            node = ('and', node, self.factor())
+        return node
+
+    def factor(self):
+        kind, value = self.peek()
+        if value == '~':
+            self.take('~')
+            return ('not', self.factor())
+        if value == '(':
+            self.take('(')
+            node = self.expression()
+            self.take(')')
+            return node
+        left = self.operand()
+        _, op = self.take()
+        if op not in comparison_operators:
+            raise Exception(f'Invalid signal rule, expected a comparison but found {op}')
+        return ('compare', op, left, self.operand())
+
+    def operand(self):
+        kind, value = self.take()
+        if kind == 'name':
+            return ('column', value)
+        if kind == 'number':
+            return ('number', float(value))
+        raise Exception(f'Invalid signal rule, expected a column or number but found {value}')
+
+
+def _columns(node):
+    if node[0] == 'column':
+        return [node[1]]
+    if node[0] == 'number':
+        return []
+    if node[0] == 'compare':
+        return _columns(node[2]) + _columns(node[3])
+    return [c for child in node[1:] for c in _columns(child)]
+
+
+def _to_numexpr(node):
+    """Fully parenthesized numexpr expression of a node"""
+    if node[0] == 'column':
+        return node[1]
+    if node[0] == 'number':
+        return repr(node[1])
+    if node[0] == 'compare':
+        return f'({_to_numexpr(node[2])} {node[1]} {_to_numexpr(node[3])})'
+    if node[0] == 'not':
+        return f'(~{_to_numexpr(node[1])})'
+    return f'({_to_numexpr(node[1])} {"&" if node[0] == "and" else "|"} {_to_numexpr(node[2])})'
+
+
+def _to_numpy(node):
+    """Closure evaluating a node on a dict of column arrays"""
+    if node[0] == 'column':
+        name = node[1]
+        return lambda arrays: arrays[name]
+    if node[0] == 'number':
+        value = node[1]
+        return lambda arrays: value
+    if node[0] == 'compare':
+        op = comparison_operators[node[1]]
+        left, right = _to_numpy(node[2]), _to_numpy(node[3])
+        return lambda arrays: op(left(arrays), right(arrays))
+    if node[0] == 'not':
+        child = _to_numpy(node[1])
+        return lambda arrays: ~child(arrays)
+    op = np.logical_and if node[0] == 'and' else np.logical_or
+    left, right = _to_numpy(node[1]), _to_numpy(node[2])
+    return lambda arrays: op(left(arrays), right(arrays))
+
+
+class SignalRule:
+    """
+    Signal rule compiled once into a vectorized evaluation over DataFrame columns.
+
+    Example: SignalRule('crossover_indicator == -1 & crossover_difference > 0')
+    """
+    def __init__(self, expression, use_numexpr=True):
+        self.expression = expression
+        tree = _Parser(tokenize(expression)).parse()
+        self.columns = list(dict.fromkeys(_columns(tree)))
+        self.use_numexpr = use_numexpr and numexpr is not None
+        self._numexpr_expression = _to_numexpr(tree)
+        self._numpy_function = _to_numpy(tree)
+
+    def __repr__(self):
+        return f'SignalRule({self.expression!r})'
+
+    def evaluate_arrays(self, arrays):
+        """Evaluate on a dict of equally long numpy arrays keyed by column name, returns a boolean array"""
+        if self.use_numexpr:
+            return numexpr.evaluate(self._numexpr_expression, local_dict={c: arrays[c] for c in self.columns})
+        return np.asarray(self._numpy_function(arrays), dtype=bool)
+
+    def __call__(self, df):
+        """Evaluate on a DataFrame, returns a boolean Series aligned with df"""
+        arrays = {c: df[c].to_numpy(dtype=float) for c in self.columns}
+        return pd.Series(self.evaluate_arrays(arrays), index=df.index)
+
+    def evaluate_panel(self, df_dict):
+        """
+        Evaluate on many DataFrames, e.g. the df_dict of process_data, in a single vectorized call.
+
+        Returns:
+            dict of boolean Series aligned with each DataFrame
+        """
+        keys = list(df_dict.keys())
+        arrays = {c: np.concatenate([df_dict[k][c].to_numpy(dtype=float) for k in keys]) if keys else np.empty(0)
+                  for c in self.columns}
+        result = self.evaluate_arrays(arrays)
+        signals = {}
+        offset = 0
+        for key in keys:
+            n = len(df_dict[key])
+            signals[key] = pd.Series(result[offset:offset + n], index=df_dict[key].index)
+            offset += n
+        return signals
+
+
+signal_rules = {}
+
+
+def register_signal_rule(name, expression):
+    """Compile a signal rule and make it available by name to filter_data and get_signal_index"""
+    signal_rules[name] = SignalRule(expression)
+    return signal_rules[name]
+
+
+def get_signal_rule(name):
+    if name not in signal_rules:
+        raise Exception(f'Unknown signal rule {name}')
+    return signal_rules[name]
+
+
+# Train when bullish crossover signal is present: tenkan-sen crosses above kijun-sen and the close is above the cloud
+register_signal_rule(
+    'bullish_cloud_crossover',
+    'crossover_indicator == -1 & crossover_difference > 0 & '
+    'close_diff_senkou_span_a_percent > 0 & close_diff_senkou_span_b_percent > 0'
+)
+# Train when bearish crossover signal is present: tenkan-sen crosses below kijun-sen and the close is below the cloud
+register_signal_rule(
+    'bearish_cloud_crossover',
+    'crossover_indicator == -1 & crossover_difference < 0 & '
+    'close_diff_senkou_span_a_percent < 0 & close_diff_senkou_span_b_percent < 0'
+)
+# Need to determine target
+register_signal_rule(
+    'bullish_and_bearish_cloud_crossover',
+    f"({signal_rules['bullish_cloud_crossover'].expression}) | ({signal_rules['bearish_cloud_crossover'].expression})"
+)
@@ -0,0 +1,454 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+import talib
+import time
+
+from tools.database_helper import bulk_upsert
+from tools.pattern_helper import calculate_ichimoku, calculate_rmi
+
+sma_periods = [20, 50, 200]
+# SMA 200 needs 199 prior rows and Ichimoku 77, the seeds of the recursive RSI, MFI, RMI and MACD decay
+# to below 1e-12 of their values within 400 rows
+TI_WARMUP_ROWS = 400
+price_columns = ['date', 'open', 'high', 'low', 'close', 'volume']
+
+
+def calculate_technical_indicators(df):
+    """
+    Args:
+        df: pandas DataFrame of split adjusted daily quotes with id, date, open, high, low, close and volume columns
+
+    Returns:
+        df: pandas DataFrame, id and the columns of the technical indicator table
+    """
+    df = df.copy()
+    for timeperiod in sma_periods:
+        df[f'sma_{timeperiod}'] = talib.SMA(df['close'], timeperiod=timeperiod)
+
+    # Technical Indicators
+    timeperiod = 14
+    df[f'rsi_{timeperiod}'] = talib.RSI(df['close'], timeperiod=timeperiod)
+    df[f'mfi_{timeperiod}'] = talib.MFI(high=df['high'], low=df['low'], close=df['close'], volume=df['volume'],
+                                        timeperiod=timeperiod)
+    momentum_period = 5
+    df[f'rmi_{timeperiod}_{momentum_period}'] = calculate_rmi(
+        df['close'],
+        time_period=timeperiod,
+        momentum_period=momentum_period)
+
+    fastperiod = 12
+    slowperiod = 26
+    signalperiod = 9
+
+    macd = talib.MACD(df['close'], fastperiod=fastperiod, slowperiod=slowperiod, signalperiod=signalperiod)
+    df[f'macd_{fastperiod}_{slowperiod}_{signalperiod}'] = macd[0]
+    df[f'macd_signal_{fastperiod}_{slowperiod}_{signalperiod}'] = macd[1]
+    df[f'macd_hist_{fastperiod}_{slowperiod}_{signalperiod}'] = macd[2]
+
+    df = calculate_ichimoku(df, future=False)
+
+    df.rename(columns={
+        'tenkan_sen': 'ic_conversion_9_26_52',
+        'kijun_sen': 'ic_base_9_26_52',
+        'senkou_span_a': 'ic_span_a_9_26_52',
+        'senkou_span_b': 'ic_span_b_9_26_52'
+    }, inplace=True)
+
+    return df.drop(price_columns + ['chikou_span'], axis=1)
+
+
+def refresh_adjusted_quotes(cur, tables, full=False):
+    """
+    Bring the split adjusted quotes of every ticker up to date in a single statement.
+
+    The split coefficient is applied to the past, but not to the day of the split. The adjustment state table
+    remembers the last adjusted date, the product of the split coefficients and the number of quotes of each
+    ticker. Tickers with new quotes only get their new quotes adjusted, as the adjustment of a quote only
+    depends on the splits after it. Tickers with a new split or quotes added before their last adjusted date
+    are adjusted again entirely, and their technical indicator watermark is removed so the indicators are
+    recomputed too. The caller commits.
+
+    Args:
+        cur: psycopg2 cursor
+        tables: dict of table names from create_stock_database_tables
+        full: boolean, adjust the whole history of every ticker (default is False)
+
+    Returns:
+        dict of booleans keyed by the ids of the refreshed tickers, True when the whole history was adjusted
+    """
+    start = time.perf_counter()
+    cur.execute(f"""
+        WITH ticker_state AS (
+            SELECT
+                d.ticker_id,
+                COALESCE(EXP(SUM(LN(d.split_coefficient))), 1) AS split_product,
+                COUNT(*) AS row_count,
+                MAX(d.date) AS last_date,
+                s.last_date AS adjusted_last_date,
+                s.split_product AS adjusted_split_product,
+                s.row_count AS adjusted_row_count,
+                COUNT(*) FILTER (WHERE d.date <= s.last_date) AS rows_up_to_adjusted_last_date
+            FROM
+                {tables['stock_quotes_daily_table']} AS d
+                LEFT JOIN {tables['adj_state_table']} AS s ON s.ticker_id = d.ticker_id
+            GROUP BY
+                d.ticker_id, s.last_date, s.split_product, s.row_count
+        ), readjust_state AS (
+            SELECT
+                *,
+                COALESCE(
+                    %(full)s
+                    OR ABS(split_product - adjusted_split_product) > 1e-12 * adjusted_split_product
+                    OR rows_up_to_adjusted_last_date <> adjusted_row_count,
+                    TRUE
+                ) AS readjust
+            FROM
+                ticker_state
+        ), stale AS (
+            SELECT * FROM readjust_state WHERE readjust OR last_date > adjusted_last_date
+        ), adjusted AS (
+            SELECT
+                d.id,
+                d.date,
+                d.open,
+                d.high,
+                d.low,
+                d.close,
+                d.volume,
+                COALESCE(
+                    EXP(
+                        SUM(LN(d.split_coefficient)) OVER (
+                            PARTITION BY d.ticker_id
+                            ORDER BY d.date DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                        )
+                    ), 1
+                ) AS cumulative_split
+            FROM
+                {tables['stock_quotes_daily_table']} AS d
+                INNER JOIN stale AS s ON s.ticker_id = d.ticker_id
+            WHERE
+                s.readjust OR d.date > s.adjusted_last_date
+        ), upserted_quotes AS (
+            INSERT INTO {tables['stock_quotes_daily_adj_table']} (id, date, open, high, low, close, volume)
+            SELECT
+                id,
+                date,
+                open / cumulative_split,
+                high / cumulative_split,
+                low / cumulative_split,
+                close / cumulative_split,
+                volume * cumulative_split
+            FROM
+                adjusted
+            ON CONFLICT (id) DO UPDATE SET
+            date = EXCLUDED.date,
+            open = EXCLUDED.open,
+            high = EXCLUDED.high,
+            low = EXCLUDED.low,
+            close = EXCLUDED.close,
+            volume = EXCLUDED.volume
+            RETURNING id
+        ), upserted_state AS (
+            INSERT INTO {tables['adj_state_table']} (ticker_id, last_date, split_product, row_count)
+            SELECT ticker_id, last_date, split_product, row_count FROM stale
+            ON CONFLICT (ticker_id) DO UPDATE SET
+            last_date = EXCLUDED.last_date,
+            split_product = EXCLUDED.split_product,
+            row_count = EXCLUDED.row_count
+        ), reset_watermarks AS (
+            DELETE FROM {tables['ti_watermark_table']} AS w
+            USING stale AS s
+            WHERE w.ticker_id = s.ticker_id AND s.readjust
+        )
+        SELECT ticker_id, readjust, (SELECT COUNT(*) FROM upserted_quotes) FROM stale
+    """, {'full': full})
+    rows = cur.fetchall()
+    refreshed_tickers = {ticker_id: readjust for ticker_id, readjust, _ in rows}
+    row_count = rows[0][2] if rows else 0
+    seconds = time.perf_counter() - start
+    print(f'{row_count} adjusted quotes of {len(refreshed_tickers)} tickers '
+          f'({sum(refreshed_tickers.values())} adjusted entirely) in {seconds:.2f} s')
+    return refreshed_tickers
+
+
+def get_adjusted_quotes(cur, ticker_id, tables, warmup_before=None):
+    """
+    Split adjusted daily quotes of a ticker from the table maintained by refresh_adjusted_quotes.
+
+    Args:
+        cur: psycopg2 cursor
+        ticker_id: int
+        tables: dict of table names from create_stock_database_tables
+        warmup_before: date, only return the rows after it and the TI_WARMUP_ROWS rows up to it (all rows when None)
+
+    Returns:
+        pandas DataFrame with id, date, open, high, low, close and volume columns ordered by date
+    """
+    stock_quotes_daily_table = tables['stock_quotes_daily_table']
+    date_filter = ''
+    params = [ticker_id]
+    if warmup_before is not None:
+        date_filter = f"""
+            AND d.date > COALESCE((
+                SELECT date FROM {stock_quotes_daily_table}
+                WHERE ticker_id = %s AND date <= %s
+                ORDER BY date DESC
+                OFFSET %s LIMIT 1
+            ), '-infinity'::date)
+        """
+        params += [ticker_id, warmup_before, TI_WARMUP_ROWS]
+
+    cur.execute(f"""
+        SELECT
+            a.id,
+            a.date,
+            a.open,
+            a.high,
+            a.low,
+            a.close,
+            a.volume
+        FROM
+            {tables['stock_quotes_daily_adj_table']} AS a
+            INNER JOIN {stock_quotes_daily_table} AS d ON d.id = a.id
+        WHERE
+            d.ticker_id = %s {date_filter}
+        ORDER BY
+            a.date;
+    """, params)
+    rows = cur.fetchall()
+    colnames = [desc[0] for desc in cur.description]
+    return pd.DataFrame(rows, columns=colnames)
+
+
+def get_ticker_state(cur, ticker_id, tables, last_date=None):
+    """
+    Returns:
+        split_product: float, product of all split coefficients of the ticker
+        row_count: int, number of quotes up to last_date (all quotes when None)
+        max_date: date of the latest quote, None when the ticker has no quotes
+    """
+    cur.execute(f"""
+        SELECT
+            COALESCE(EXP(SUM(LN(split_coefficient))), 1),
+            COUNT(*) FILTER (WHERE %s::date IS NULL OR date <= %s::date),
+            MAX(date)
+        FROM {tables['stock_quotes_daily_table']}
+        WHERE ticker_id = %s
+    """, (last_date, last_date, ticker_id))
+    return cur.fetchone()
+
+
+def get_watermark(cur, ticker_id, tables):
+    """
+    Returns:
+        tuple of last_date, last_id, split_product and row_count processed for the ticker, None if never processed
+    """
+    cur.execute(f"""
+        SELECT last_date, last_id, split_product, row_count
+        FROM {tables['ti_watermark_table']}
+        WHERE ticker_id = %s
+    """, (ticker_id,))
+    return cur.fetchone()
+
+
+def set_watermark(cur, ticker_id, tables, last_date, last_id, split_product, row_count):
+    cur.execute(f"""
+        INSERT INTO {tables['ti_watermark_table']} (ticker_id, last_date, last_id, split_product, row_count)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (ticker_id) DO UPDATE SET
+        last_date = EXCLUDED.last_date,
+        last_id = EXCLUDED.last_id,
+        split_product = EXCLUDED.split_product,
+        row_count = EXCLUDED.row_count
+    """, (ticker_id, last_date, last_id, split_product, row_count))
+
+
+def needs_full_recompute(watermark, split_product, row_count):
+    """
+    True when the stored adjusted quotes and indicators cannot be extended: the ticker was never processed,
+    a new split changed the adjustment of its history or quotes were added before the last processed date.
+    """
+    if watermark is None:
+        return True
+    _, _, previous_split_product, previous_row_count = watermark
+    return not np.isclose(previous_split_product, split_product, rtol=1e-12, atol=0) or \
+        previous_row_count != row_count
+
+
+def fetch_ticker_update(cur, ticker_id, tables, full=False):
+    """
+    Fetch the split adjusted quotes a ticker needs to bring its technical indicators up to date.
+
+    The watermark table remembers the last processed date of each ticker. Only the new quotes and the
+    TI_WARMUP_ROWS quotes before them are fetched. All quotes are fetched when full is True or a new split
+    invalidates the adjusted history.
+
+    Returns:
+        dict of the quotes df, the boolean mask new_rows of the quotes to write and the watermark state,
+        None when the ticker is up to date
+    """
+    watermark = None if full else get_watermark(cur, ticker_id, tables)
+    last_date = watermark[0] if watermark is not None else None
+    split_product, row_count, max_date = get_ticker_state(cur, ticker_id, tables, last_date)
+    if max_date is None:
+        return None
+
+    recompute = full or needs_full_recompute(watermark, split_product, row_count)
+    if recompute:
+        df = get_adjusted_quotes(cur, ticker_id, tables)
+        new_rows = np.ones(len(df), dtype=bool)
+    elif max_date <= last_date:
+        return None
+    else:
+        df = get_adjusted_quotes(cur, ticker_id, tables, warmup_before=last_date)
+        new_rows = (df['date'] > last_date).to_numpy()
+
+    # every quote up to the new last date will have been processed
+    processed_rows = len(df) if recompute else row_count + int(new_rows.sum())
+    return {'df': df, 'new_rows': new_rows, 'split_product': split_product, 'row_count': processed_rows}
+
+
+def write_ticker_update(conn, cur, ticker_id, tables, update, ti_df):
+    """
+    Write the new technical indicators of a ticker and move its watermark in one transaction.
+
+    Args:
+        update: dict from fetch_ticker_update
+        ti_df: pandas DataFrame from calculate_technical_indicators of update['df']
+
+    Returns:
+        int, number of written rows
+    """
+    df, new_rows = update['df'], update['new_rows']
+    # a recompute overwrites the stored rows
+    bulk_upsert(cur, ti_df[new_rows], tables['stock_quotes_daily_ti_table'])
+    set_watermark(cur, ticker_id, tables, df['date'].iloc[-1], int(df['id'].iloc[-1]), update['split_product'],
+                  update['row_count'])
+    conn.commit()
+    return int(new_rows.sum())
+
+
+def update_technical_indicators(conn, cur, ticker_id, tables, full=False):
+    """
+    Write the split adjusted quotes and technical indicators of a ticker that are not stored yet.
+
+    Args:
+        conn: psycopg2 connection
+        cur: psycopg2 cursor
+        ticker_id: int
+        tables: dict of table names from create_stock_database_tables
+        full: boolean, recompute the whole history (default is False)
+
+    Returns:
+        int, number of written rows
+    """
+    update = fetch_ticker_update(cur, ticker_id, tables, full=full)
+    if update is None:
+        return 0
+    ti_df = calculate_technical_indicators(update['df'])
+    return write_ticker_update(conn, cur, ticker_id, tables, update, ti_df)
+
+
+def get_stale_ticker_ids(cur, tables, full=False):
+    """Ids of the tickers with adjusted quotes after their technical indicator watermark, all tickers when full"""
+    cur.execute(f"""
+        SELECT s.ticker_id
+        FROM {tables['adj_state_table']} AS s
+        LEFT JOIN {tables['ti_watermark_table']} AS w ON w.ticker_id = s.ticker_id
+        WHERE %s OR w.ticker_id IS NULL OR s.last_date > w.last_date
+        ORDER BY s.ticker_id
+    """, (full,))
+    return [ticker_id[0] for ticker_id in cur.fetchall()]
+
+
+def update_all_technical_indicators(conn, cur, tables, full=False):
+    """
+    Update the split adjusted quotes of every ticker, then the technical indicators of the tickers with new
+    adjusted quotes one after another.
+
+    Returns:
+        int, number of written rows
+    """
+    refresh_adjusted_quotes(cur, tables, full=full)
+    conn.commit()
+    ticker_ids = get_stale_ticker_ids(cur, tables, full=full)
+
+    total_rows = 0
+    for ticker_id in ticker_ids:
+        total_rows += update_technical_indicators(conn, cur, ticker_id, tables, full=full)
+    print(f'{total_rows} rows written for {len(ticker_ids)} tickers')
+    return total_rows
+
+
+def _update_pooled(connection_pool, cpu_executor, ticker_id, tables, full):
+    with connection_pool.connection() as conn:
+        with conn.cursor() as cur:
+            update = fetch_ticker_update(cur, ticker_id, tables, full=full)
+        # end the read transaction before the connection goes back to the pool
+        conn.rollback()
+    if update is None:
+        return 0
+    # the connection is free for other tickers while the indicators are calculated
+    ti_df = cpu_executor.submit(calculate_technical_indicators, update['df']).result()
+    with connection_pool.connection() as conn:
+        with conn.cursor() as cur:
+            return write_ticker_update(conn, cur, ticker_id, tables, update, ti_df)
+
+
+def update_all_technical_indicators_concurrently(connection_pool, tables, full=False, workers=None,
+                                                 max_in_flight=None, progress_every=50):
+    """
+    Update the split adjusted quotes of every ticker, then the technical indicators of the tickers with new
+    adjusted quotes with fetches, calculations and writes of different tickers overlapping.
+
+    Each ticker is handled by a thread that fetches its quotes on a pooled connection, calculates the
+    indicators in a process pool and writes them in its own transaction. While some tickers wait for
+    the database others are calculated, which keeps the cores busy during a full recompute.
+
+    Args:
+        connection_pool: tools.database_helper.BlockingConnectionPool, its size bounds the concurrent queries
+        tables: dict of table names from create_stock_database_tables
+        full: boolean, recompute the whole history (default is False)
+        workers: int, number of processes calculating indicators (default is the number of CPUs)
+        max_in_flight: int, number of tickers processed at the same time (default is twice the workers)
+        progress_every: int, print progress and throughput after this many tickers (default is 50)
+
+    Returns:
+        total_rows: int, number of written rows
+        failed_tickers: dict of error messages keyed by ticker id
+    """
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or 2 * workers
+    with connection_pool.connection() as conn:
+        with conn.cursor() as cur:
+            refresh_adjusted_quotes(cur, tables, full=full)
+            conn.commit()
+            ticker_ids = get_stale_ticker_ids(cur, tables, full=full)
+
+    start = time.perf_counter()
+    total_rows = 0
+    failed_tickers = {}
+    # the workers are started lazily from the ticker threads, which hold pooled connections and locks, so they
+    # are started by a fork server instead of forking this multi-threaded process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver')) \
+            as cpu_executor, \
+            ThreadPoolExecutor(max_workers=max_in_flight) as ticker_executor:
+        futures = {
+            ticker_executor.submit(_update_pooled, connection_pool, cpu_executor, ticker_id, tables, full): ticker_id
+            for ticker_id in ticker_ids
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            ticker_id = futures[future]
+            try:
+                total_rows += future.result()
+            except Exception as e:
+                failed_tickers[ticker_id] = str(e)
+                print(f'Ticker {ticker_id} failed: {e}')
+            if done % progress_every == 0 or done == len(futures):
+                seconds = time.perf_counter() - start
+                print(f'{done}/{len(futures)} tickers, {total_rows} rows in {seconds:.1f} s '
+                      f'({done / seconds:.1f} tickers/s, {total_rows / seconds:.0f} rows/s)')
+    return total_rows, failed_tickers